@@ -32,7 +32,99 @@ class Settings:
     MIKROTIK_PORT = int(os.getenv("MIKROTIK_PORT", 8443))
     MIKROTIK_USER = os.getenv("MIKROTIK_USER", "api_bot")
     MIKROTIK_PASS = os.getenv("MIKROTIK_PASS")
-    
+
+    # Pool de sesiones RouterOS (ver app/services/mikrotik_pool.py)
+    MIKROTIK_POOL_MAX = int(os.getenv("MIKROTIK_POOL_MAX", 4))
+    MIKROTIK_POOL_IDLE_SECS = float(os.getenv("MIKROTIK_POOL_IDLE_SECS", 300))
+    MIKROTIK_KEEPALIVE_SECS = float(os.getenv("MIKROTIK_KEEPALIVE_SECS", 30))
+    MIKROTIK_TIMEOUT_SECS = float(os.getenv("MIKROTIK_TIMEOUT_SECS", 10))
+    MIKROTIK_BREAKER_FALLOS = int(os.getenv("MIKROTIK_BREAKER_FALLOS", 3))  # fallos seguidos que marcan el router como caído
+    MIKROTIK_BREAKER_ESPERA_SECS = float(os.getenv("MIKROTIK_BREAKER_ESPERA_SECS", 15))
+    MIKROTIK_BREAKER_ESPERA_MAX_SECS = float(os.getenv("MIKROTIK_BREAKER_ESPERA_MAX_SECS", 120))
+
+    # Índice local de Userman (ver app/services/mikrotik_indice.py)
+    USERMAN_INDICE_TTL_SECS = float(os.getenv("USERMAN_INDICE_TTL_SECS", 300))
+    USERMAN_PERFILES_TTL_SECS = float(os.getenv("USERMAN_PERFILES_TTL_SECS", 600))
+    # Buscar al usuario conocido del cliente en paralelo con ChatGPT (ver app/routers/webhook_wa.py)
+    USERMAN_PRECARGA = os.getenv("USERMAN_PRECARGA", "true").lower() == "true"
+
+    # Un router por campamento, leído de la tabla campamentos (ver app/services/mikrotik_routers.py)
+    MIKROTIK_MULTI_ROUTER = os.getenv("MIKROTIK_MULTI_ROUTER", "false").lower() == "true"
+    ROUTERS_TTL_SECS = float(os.getenv("ROUTERS_TTL_SECS", 600))  # releer campamentos cada N segundos
+
+    # Cola de mensajes entrantes de WhatsApp (ver app/services/cola.py)
+    # El pipeline es async: cada worker es una corrutina barata, no un hilo
+    WA_WORKERS = int(os.getenv("WA_WORKERS", 32))
+    WA_COLA_MAX = int(os.getenv("WA_COLA_MAX", 500))
+
+    # Cliente HTTP async compartido para Telegram/Twilio (ver app/core/http.py)
+    HTTP_TIMEOUT_SECS = float(os.getenv("HTTP_TIMEOUT_SECS", 10))
+    HTTP_MAX_CONEXIONES = int(os.getenv("HTTP_MAX_CONEXIONES", 50))
+
+    # Envíos por Twilio (ver app/services/whatsapp.py)
+    TWILIO_POOL_SIZE = int(os.getenv("TWILIO_POOL_SIZE", 10))
+
+    # Cola de envíos salientes (ver app/services/envios.py)
+    WA_ENVIO_TASA = float(os.getenv("WA_ENVIO_TASA", 10))  # mensajes/seg por remitente
+    WA_ENVIO_RAFAGA = int(os.getenv("WA_ENVIO_RAFAGA", 20))
+    WA_ENVIO_REINTENTOS = int(os.getenv("WA_ENVIO_REINTENTOS", 3))
+
+    # Cache de respuestas de ChatGPT (ver app/services/cache_respuestas.py)
+    PROMPT_CACHE_MAX = int(os.getenv("PROMPT_CACHE_MAX", 1000))  # entradas en memoria
+    PROMPT_CACHE_TTL_SECS = float(os.getenv("PROMPT_CACHE_TTL_SECS", 3600))
+    PROMPT_CACHE_DIAS = int(os.getenv("PROMPT_CACHE_DIAS", 7))  # vigencia en prompt_cache
+    PROMPT_CACHE_MIN_TELEFONOS = int(os.getenv("PROMPT_CACHE_MIN_TELEFONOS", 2))  # clientes distintos antes de cachear
+    PROMPT_CACHE_VACIADO_SECS = float(os.getenv("PROMPT_CACHE_VACIADO_SECS", 60))
+    PROMPT_CACHE_VACIADO_HITS = int(os.getenv("PROMPT_CACHE_VACIADO_HITS", 50))
+
+    # Cache semántico de preguntas frecuentes (ver app/services/cache_semantico.py)
+    CACHE_SEMANTICO_ACTIVO = os.getenv("CACHE_SEMANTICO_ACTIVO", "false").lower() == "true"
+    CACHE_SEMANTICO_RUTA = os.getenv("CACHE_SEMANTICO_RUTA", "data/cache_semantico.npz")
+    CACHE_SEMANTICO_UMBRAL = float(os.getenv("CACHE_SEMANTICO_UMBRAL", 0.85))
+
+    # Estado de conversación en memoria (ver app/services/conversacion.py)
+    CONVERSACION_CACHE_MAX = int(os.getenv("CONVERSACION_CACHE_MAX", 5000))
+    CONVERSACION_CACHE_TTL_SECS = float(os.getenv("CONVERSACION_CACHE_TTL_SECS", 900))
+
+    # Escritura diferida de conversation_cache / ai_cost_tracking (ver app/services/buffer_escritura.py)
+    BUFFER_MAX_FILAS = int(os.getenv("BUFFER_MAX_FILAS", 50))
+    BUFFER_INTERVALO_MS = float(os.getenv("BUFFER_INTERVALO_MS", 2000))
+    BUFFER_DIRECTORIO = os.getenv("BUFFER_DIRECTORIO", "data")  # respaldo local de filas pendientes
+    BUFFER_MAX_PENDIENTES = int(os.getenv("BUFFER_MAX_PENDIENTES", 10000))  # tope en memoria si Supabase no responde
+    BUFFER_MAX_INTENTOS = int(os.getenv("BUFFER_MAX_INTENTOS", 3))  # rechazos de un lote antes de aislar filas inválidas
+
+    # Historial enviado a ChatGPT (ver app/services/historial.py)
+    HISTORIAL_TURNOS = int(os.getenv("HISTORIAL_TURNOS", 5))  # turnos guardados en memoria por cliente
+    HISTORIAL_PRESUPUESTO_TOKENS = int(os.getenv("HISTORIAL_PRESUPUESTO_TOKENS", 500))
+    HISTORIAL_RESUMEN_TOKENS = int(os.getenv("HISTORIAL_RESUMEN_TOKENS", 150))
+    HISTORIAL_TELEFONOS_MAX = int(os.getenv("HISTORIAL_TELEFONOS_MAX", 5000))
+
+    # Respuestas de ChatGPT en streaming: la function call se detecta antes de que termine la respuesta (ver app/services/chatgpt.py)
+    CHATGPT_STREAMING = os.getenv("CHATGPT_STREAMING", "true").lower() == "true"
+
+    # Deduplicación de reintentos de webhooks (ver app/services/idempotencia.py)
+    IDEMPOTENCIA_MAX = int(os.getenv("IDEMPOTENCIA_MAX", 10000))  # eventos recordados en memoria
+    IDEMPOTENCIA_LIMPIEZA_SECS = float(os.getenv("IDEMPOTENCIA_LIMPIEZA_SECS", 6 * 3600))  # borrado de eventos vencidos
+
+    # Aprobaciones de ventas en segundo plano (ver app/services/aprobaciones.py)
+    APROBACION_WORKERS = int(os.getenv("APROBACION_WORKERS", 4))
+    APROBACION_INTENTOS = int(os.getenv("APROBACION_INTENTOS", 3))  # intentos ante errores transitorios de Supabase
+    APROBACION_BACKOFF_SECS = float(os.getenv("APROBACION_BACKOFF_SECS", 2))  # espera inicial entre intentos (se duplica)
+    APROBACION_MASIVA_MAX = int(os.getenv("APROBACION_MASIVA_MAX", 200))  # ventas por aprobación masiva
+    ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")  # header X-Admin-Token de /admin/* (sin token: deshabilitado)
+
+    # Outbox de activaciones en MikroTik (ver app/services/activaciones.py)
+    ACTIVACION_LOTE = int(os.getenv("ACTIVACION_LOTE", 20))  # activaciones tomadas por ronda
+    ACTIVACION_INTERVALO_SECS = float(os.getenv("ACTIVACION_INTERVALO_SECS", 10))
+    ACTIVACION_REINTENTOS = int(os.getenv("ACTIVACION_REINTENTOS", 8))  # intentos antes de marcarla fallida
+    ACTIVACION_BACKOFF_SECS = float(os.getenv("ACTIVACION_BACKOFF_SECS", 5))
+    ACTIVACION_BACKOFF_MAX_SECS = float(os.getenv("ACTIVACION_BACKOFF_MAX_SECS", 600))
+
+    # Vencimientos de planes y recordatorios (ver app/services/vencimientos.py)
+    VENCIMIENTOS_INTERVALO_SECS = float(os.getenv("VENCIMIENTOS_INTERVALO_SECS", 60))
+    VENCIMIENTOS_AVISO_HORAS = float(os.getenv("VENCIMIENTOS_AVISO_HORAS", 12))  # recordatorio antes de vencer
+    VENCIMIENTOS_RECHEQUEO_SECS = float(os.getenv("VENCIMIENTOS_RECHEQUEO_SECS", 900))  # plan aún vigente en el router
+
     # Plan inicial para clientes nuevos (perfil Userman)
     PLAN_INICIAL_NUEVO = os.getenv("PLAN_INICIAL_NUEVO", "3Dias")
 
@@ -0,0 +1,43 @@
+"""
+Cliente HTTP asíncrono compartido (httpx) para Telegram (los envíos de
+WhatsApp tienen su propio pool de conexiones a Twilio en whatsapp.py).
+
+Un solo AsyncClient con pool de conexiones keepalive (y HTTP/2 si el paquete
+'h2' está instalado) evita abrir un socket + TLS nuevo en cada request.
+"""
+
+from typing import Optional
+import httpx
+from app.core.config import settings
+
+try:
+    import h2  # noqa: F401  (habilita HTTP/2 en httpx)
+    HTTP2_DISPONIBLE = True
+except ImportError:
+    HTTP2_DISPONIBLE = False
+
+_cliente: Optional[httpx.AsyncClient] = None
+
+
+def obtener_cliente_http() -> httpx.AsyncClient:
+    """Retorna el AsyncClient compartido (lo crea la primera vez)"""
+    global _cliente
+    if _cliente is None or _cliente.is_closed:
+        _cliente = httpx.AsyncClient(
+            http2=HTTP2_DISPONIBLE,
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT_SECS),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONEXIONES,
+                max_keepalive_connections=settings.HTTP_MAX_CONEXIONES,
+                keepalive_expiry=60,
+            ),
+        )
+    return _cliente
+
+
+async def cerrar_cliente_http():
+    """Cierra el pool de conexiones (al apagar la aplicación)"""
+    global _cliente
+    if _cliente is not None:
+        await _cliente.aclose()
+        _cliente = None
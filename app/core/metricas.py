@@ -0,0 +1,74 @@
+"""
+Métricas en memoria: latencia por etapa del pipeline (ChatGPT, MikroTik,
+Supabase, envío, etc).
+
+Uso:
+    from app.core.metricas import medir
+
+    with medir("chatgpt"):
+        obtener_respuesta_chatgpt(...)
+
+Se conservan las últimas N muestras por etapa para calcular p50/p95 sin
+crecer indefinidamente.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict
+
+
+def percentil(valores, p: float) -> float:
+    """Percentil p (0-100) de una lista ya ordenada"""
+    if not valores:
+        return 0.0
+    k = min(len(valores) - 1, max(0, int(round(p / 100 * (len(valores) - 1)))))
+    return valores[k]
+
+
+class RegistroLatencias:
+    """Muestras de latencia por etapa (thread-safe)"""
+
+    def __init__(self, muestras_max: int = 500):
+        self.muestras_max = muestras_max
+        self._muestras: Dict[str, Deque[float]] = {}
+        self._totales: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, etapa: str, segundos: float):
+        with self._lock:
+            muestras = self._muestras.get(etapa)
+            if muestras is None:
+                muestras = self._muestras[etapa] = deque(maxlen=self.muestras_max)
+            muestras.append(segundos)
+            self._totales[etapa] = self._totales.get(etapa, 0) + 1
+
+    def resumen(self) -> Dict[str, Dict]:
+        """{etapa: {n, p50_ms, p95_ms, max_ms}}"""
+        with self._lock:
+            copia = {etapa: sorted(m) for etapa, m in self._muestras.items()}
+            totales = dict(self._totales)
+
+        return {
+            etapa: {
+                "n": totales.get(etapa, 0),
+                "p50_ms": round(percentil(valores, 50) * 1000, 1),
+                "p95_ms": round(percentil(valores, 95) * 1000, 1),
+                "max_ms": round(valores[-1] * 1000, 1) if valores else 0.0,
+            }
+            for etapa, valores in copia.items()
+        }
+
+
+latencias = RegistroLatencias()
+
+
+@contextmanager
+def medir(etapa: str):
+    """Registra cuánto tarda el bloque en la etapa indicada"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        latencias.registrar(etapa, time.perf_counter() - inicio)
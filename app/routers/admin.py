@@ -0,0 +1,23 @@
+import hmac
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
+from app.core.config import settings
+from app.services.aprobaciones import aprobar_ventas_pendientes
+
+router = APIRouter(prefix="/admin")
+
+
+def _verificar_token(token: Optional[str]):
+    """Sin ADMIN_API_TOKEN configurado los endpoints de admin quedan deshabilitados"""
+    if not settings.ADMIN_API_TOKEN or not hmac.compare_digest(token or "", settings.ADMIN_API_TOKEN):
+        raise HTTPException(status_code=403, detail="forbidden")
+
+
+@router.post("/ventas/aprobar-pendientes")
+async def aprobar_pendientes(limite: Optional[int] = None, x_admin_token: Optional[str] = Header(None)):
+    """
+    Aprueba todas las ventas pendientes de una vez (misma lógica que el
+    comando /aprobar_todos de Telegram) y devuelve el resumen.
+    """
+    _verificar_token(x_admin_token)
+    return await aprobar_ventas_pendientes(limite)
@@ -0,0 +1,36 @@
+from fastapi import APIRouter
+from app.core.metricas import latencias
+from app.routers.webhook_wa import cola_whatsapp
+from app.services.envios import cola_envios
+from app.services.aprobaciones import cola_aprobaciones
+from app.services.activaciones import outbox_activaciones
+from app.services.vencimientos import barredor_vencimientos
+from app.services import cache_respuestas, cache_semantico
+from app.services.buffer_escritura import BUFFERS
+from app.services.costos_ai import uso_ai
+from app.services.idempotencia import eventos_webhook
+from app.services.mikrotik_routers import catalogo_routers
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def ver_metricas():
+    """Profundidad de las colas y latencia (p50/p95) por etapa del pipeline"""
+    return {
+        "colas": [cola_whatsapp.estadisticas(), cola_aprobaciones.estadisticas(), cola_envios.estadisticas()],
+        "cache_respuestas": cache_respuestas.estadisticas(),
+        "cache_semantico": cache_semantico.estadisticas(),
+        "buffers": [buffer.estadisticas() for buffer in BUFFERS],
+        "webhooks": eventos_webhook.estadisticas(),
+        "routers": catalogo_routers.estadisticas(),
+        "activaciones": outbox_activaciones.estadisticas(),
+        "vencimientos": barredor_vencimientos.estadisticas(),
+        "latencias": latencias.resumen(),
+    }
+
+
+@router.get("/metrics/ai")
+async def ver_metricas_ai():
+    """Uso de OpenAI: latencia p50/p95, tokens por conversación y costo por venta aprobada"""
+    return uso_ai.resumen()
@@ -1,15 +1,30 @@
-import requests
+import asyncio
 from fastapi import APIRouter, Request
 from app.core.config import settings
-from app.services.supabase import obtener_venta, actualizar_estado_venta
-from app.services.mikrotik import reemplazar_plan_usuario
-from app.services.whatsapp import enviar_mensaje_whatsapp
+from app.core.http import obtener_cliente_http
+from app.services.aprobaciones import (
+    ACCIONES,
+    encolar_aprobacion,
+    procesar_aprobacion,
+    VentaYaProcesada,
+    aprobar_ventas_pendientes,
+    texto_resumen_masivo,
+)
+from app.services.telegram import enviar_mensaje_telegram_async
+from app.services.idempotencia import eventos_webhook, clave_telegram
 
 router = APIRouter()
 
-def responder_callback_telegram(callback_query_id: str, texto: str = "Procesado"):
+# Comando del admin para aprobar de una vez todas las ventas pendientes
+COMANDOS_APROBAR_TODOS = ("/aprobar_todos", "aprobar todos", "aprobar todos los pendientes")
+
+# Aprobaciones masivas en curso (referencia para que no las recolecte el GC)
+_tareas_masivas: set = set()
+
+async def responder_callback_telegram_async(callback_query_id: str, texto: str = "Procesado"):
     """
     Responde a Telegram para que el botón deje de mostrar 'cargando'
+    (AsyncClient compartido)
     """
     bot_token = settings.TG_BOT_TOKEN
     if not bot_token:
@@ -24,7 +39,7 @@ def responder_callback_telegram(callback_query_id: str, texto: str = "Procesado"
     }
     
     try:
-        response = requests.post(url, json=payload, timeout=5)
+        response = await obtener_cliente_http().post(url, json=payload, timeout=5)
         if response.status_code == 200:
             print("✅ Callback respondido a Telegram")
         else:
@@ -36,7 +51,11 @@ def responder_callback_telegram(callback_query_id: str, texto: str = "Procesado"
 @router.post("/telegram")
 async def receive_telegram(request: Request):
     """
-    Webhook que recibe los clics de los botones de Telegram
+    Webhook que recibe los clics de los botones de Telegram.
+    
+    Los reintentos de Telegram (mismo callback_query.id / update_id) se
+    responden con el resultado guardado: una aprobación nunca se aplica dos
+    veces. Los updates ignorados o con error se liberan.
     """
     # 🔍 PASO 1: LOGGING COMPLETO DEL JSON RECIBIDO
     try:
@@ -49,6 +68,36 @@ async def receive_telegram(request: Request):
         print(f"❌ Error al parsear JSON de Telegram: {err}")
         return {"status": "error", "message": "JSON inválido"}
     
+    clave = clave_telegram(data)
+    previo = await eventos_webhook.reclamar(clave)
+    if previo is not None:
+        return previo
+    
+    try:
+        resultado = await procesar_update_telegram(data)
+    except Exception:
+        await eventos_webhook.liberar(clave)
+        raise
+    
+    if resultado.get("status") in ("error", "ignored"):
+        # Nada que proteger: un reintento se vuelve a procesar
+        await eventos_webhook.liberar(clave)
+    else:
+        await eventos_webhook.completar(clave, resultado)
+    return resultado
+
+
+async def procesar_update_telegram(data: dict) -> dict:
+    """
+    Procesa un update de Telegram ya deduplicado.
+    
+    Returns:
+        Resultado que se devuelve a Telegram (y a sus reintentos)
+    """
+    mensaje = data.get("message") or {}
+    if _es_comando_aprobar_todos(mensaje.get("text")):
+        return await procesar_comando_aprobar_todos(mensaje)
+    
     # 🔍 PASO 2: VERIFICAR SI ES UN CALLBACK_QUERY
     if "callback_query" not in data:
         print("⚠️ No es un callback_query, ignorando...")
@@ -78,94 +127,81 @@ async def receive_telegram(request: Request):
         
     except ValueError as e:
         print(f"❌ Error al procesar callback_data: {e}")
-        responder_callback_telegram(callback_query_id, "❌ Formato de datos inválido")
+        await responder_callback_telegram_async(callback_query_id, "❌ Formato de datos inválido")
         return {"status": "error", "message": str(e)}
     
-    # 🔍 PASO 4: BUSCAR LA VENTA EN LA BASE DE DATOS
+    if accion not in ACCIONES:
+        print(f"⚠️ Acción desconocida: '{accion}'")
+        await responder_callback_telegram_async(callback_query_id, f"⚠️ Acción '{accion}' no reconocida")
+        return {"status": "error", "message": f"unknown_action: {accion}"}
+    
+    # 🔍 PASO 4: ENCOLAR, RESPONDER EL CLIC YA Y PROCESAR EN SEGUNDO PLANO
+    # (MikroTik + Supabase + WhatsApp tardan varios segundos; el resultado
+    # se deja editando el mensaje del admin al terminar)
+    mensaje_admin = callback.get("message") or {}
+    chat_id = (mensaje_admin.get("chat") or {}).get("id")
+    message_id = mensaje_admin.get("message_id")
+    
     try:
-        venta = obtener_venta(venta_id)
-        if not venta:
-            print(f"❌ Venta {venta_id} no encontrada en la base de datos")
-            responder_callback_telegram(callback_query_id, "❌ Venta no encontrada")
-            return {"status": "error", "message": "venta_no_encontrada"}
-        
-        cliente_wa = venta.get("whatsapp_id")
-        print(f"📱 Cliente WhatsApp: {cliente_wa}")
-        
+        encolado = await encolar_aprobacion(accion, venta_id, chat_id, message_id)
+    except VentaYaProcesada:
+        print(f"♻️ Venta {venta_id} ya procesada, se ignora '{accion}'")
+        await responder_callback_telegram_async(callback_query_id, "♻️ Esta venta ya fue procesada")
+        return {"status": "ignored", "reason": "already_processed", "venta_id": venta_id}
     except Exception as err:
-        print(f"❌ Error al consultar la venta: {err}")
-        responder_callback_telegram(callback_query_id, "❌ Error de base de datos")
+        print(f"❌ Error al encolar la acción '{accion}': {err}")
+        await responder_callback_telegram_async(callback_query_id, "❌ Error al procesar")
         return {"status": "error", "message": str(err)}
     
-    # 🔍 PASO 5: PROCESAR LA ACCIÓN (APROBAR O RECHAZAR)
-    try:
-        if accion == "aprobar":
-            print(f"✅ Procesando APROBACIÓN de venta {venta_id}...")
-            
-            # Obtener datos del cliente desde venta
-            usuario = venta.get("usuario_mikrotik")  # Debe guardarse cuando ChatGPT crea usuario
-            dias_solicitados = venta.get("dias_solicitados", 1)
-            plan_solicitado = venta.get("plan_solicitado", f"1User{dias_solicitados}Dia")
-            
-            if not usuario:
-                print(f"⚠️ Venta {venta_id} no tiene usuario asociado")
-                responder_callback_telegram(callback_query_id, "⚠️ Sin usuario asociado")
-                return {"status": "error", "message": "no_usuario"}
-            
-            # 1. REEMPLAZAR plan en MikroTik (elimina el temporal y pone el completo)
-            exito, msg = reemplazar_plan_usuario(usuario, plan_solicitado)
-            
-            if exito:
-                # 2. Actualizar estado en Supabase
-                actualizar_estado_venta(venta_id, "aprobado")
-                
-                # 3. Notificar al cliente (SIN información técnica)
-                mensaje = (
-                    f"✅ ¡Pago Aprobado!\n\n"
-                    f"🎉 Ya tienes {dias_solicitados} días de internet activados.\n\n"
-                    f"¡Disfruta tu conexión! 🌐\n\n"
-                    f"📲 Soporte: +51987654321"
-                )
-                enviar_mensaje_whatsapp(cliente_wa, mensaje)
-                
-                print(f"✅ Venta {venta_id} aprobada. {dias_solicitados} días activados para {usuario}")
-                responder_callback_telegram(callback_query_id, f"✅ {usuario}: {dias_solicitados}d OK")
-                
-            else:
-                # MikroTik no disponible, pero aprobar igual
-                print(f"⚠️ MikroTik error: {msg}, pero aprobando venta {venta_id}")
-                actualizar_estado_venta(venta_id, "aprobado")
-                mensaje = (
-                    f"✅ ¡Pago Aprobado!\n\n"
-                    f"Estamos activando tu internet. Espera unos minutos.\n\n"
-                    f"Si tienes problemas, escríbenos al +51987654321"
-                )
-                enviar_mensaje_whatsapp(cliente_wa, mensaje)
-                responder_callback_telegram(callback_query_id, "✅ Aprobado (error MikroTik)")
-
-        
-        elif accion == "rechazar":
-            print(f"🚫 Procesando RECHAZO de venta {venta_id}...")
-            
-            # 1. Actualizar estado en Supabase
-            actualizar_estado_venta(venta_id, "rechazado")
-            
-            # 2. Notificar al cliente
-            enviar_mensaje_whatsapp(cliente_wa, "❌ Tu pago fue rechazado. Por favor contacta a soporte.")
-            
-            print(f"🚫 Venta {venta_id} rechazada")
-            responder_callback_telegram(callback_query_id, "🚫 Venta rechazada")
-        
-        else:
-            print(f"⚠️ Acción desconocida: '{accion}'")
-            responder_callback_telegram(callback_query_id, f"⚠️ Acción '{accion}' no reconocida")
-            return {"status": "error", "message": f"unknown_action: {accion}"}
+    await responder_callback_telegram_async(callback_query_id, "⏳ Procesando...")
+    if encolado:
+        print(f"📥 {accion} de venta {venta_id} encolada")
+        return {"status": "queued", "action": accion, "venta_id": venta_id}
     
+    try:
+        # Cola detenida o llena: procesar dentro del request
+        await procesar_aprobacion({
+            "accion": accion,
+            "venta_id": venta_id,
+            "chat_id": chat_id,
+            "message_id": message_id,
+        })
     except Exception as err:
         print(f"❌ Error al procesar la acción '{accion}': {err}")
-        responder_callback_telegram(callback_query_id, "❌ Error al procesar")
         return {"status": "error", "message": str(err)}
     
     # ✅ TODO OK
     print(f"✅ Webhook de Telegram procesado exitosamente\n")
     return {"status": "success", "action": accion, "venta_id": venta_id}
+
+
+def _es_comando_aprobar_todos(texto) -> bool:
+    comando = (texto or "").strip().lower().split("@")[0]  # "/aprobar_todos@MiBot"
+    return comando in COMANDOS_APROBAR_TODOS
+
+
+async def _aprobar_todos(chat_id):
+    try:
+        texto = texto_resumen_masivo(await aprobar_ventas_pendientes())
+    except Exception as err:
+        print(f"❌ Error en la aprobación masiva: {err}")
+        texto = f"❌ Error en la aprobación masiva: {err}"
+    await enviar_mensaje_telegram_async(chat_id, texto)
+
+
+async def procesar_comando_aprobar_todos(mensaje: dict) -> dict:
+    """
+    Comando /aprobar_todos del admin: responde al instante y aprueba en
+    segundo plano; el resumen llega como otro mensaje.
+    """
+    chat_id = (mensaje.get("chat") or {}).get("id")
+    if not settings.TG_ADMIN_ID or str(chat_id) != str(settings.TG_ADMIN_ID):
+        print(f"⚠️ /aprobar_todos desde un chat no autorizado: {chat_id}")
+        return {"status": "ignored", "reason": "unauthorized"}
+    
+    print("📦 Aprobación masiva pedida desde Telegram")
+    await enviar_mensaje_telegram_async(chat_id, "⏳ Aprobando todas las ventas pendientes...")
+    tarea = asyncio.create_task(_aprobar_todos(chat_id))
+    _tareas_masivas.add(tarea)
+    tarea.add_done_callback(_tareas_masivas.discard)
+    return {"status": "queued", "action": "aprobar_todos"}
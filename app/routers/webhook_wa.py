@@ -1,67 +1,82 @@
+import asyncio
+from typing import Dict, Optional
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import PlainTextResponse
-from app.services.chatgpt import obtener_respuesta_chatgpt, guardar_conversacion_cache
-from app.services.whatsapp import enviar_mensaje_whatsapp
-from app.services.supabase import (
-    guardar_venta_pendiente,
-    obtener_contexto_conversacion,
-    guardar_contexto_conversacion,
+from app.services.chatgpt import (
+    obtener_respuesta_chatgpt_async,
+    obtener_respuesta_chatgpt_streaming_async,
+    guardar_conversacion_cache_async,
 )
-from app.services.telegram import enviar_alerta_pago
+from app.services.envios import responder_whatsapp
+from app.services.supabase import guardar_venta_pendiente_async
+from app.services.telegram import enviar_alerta_pago_async
 from app.services.mikrotik import (
     buscar_usuario_existente,
     crear_usuario_userman,
 )
+from app.services.mikrotik_routers import catalogo_routers
+from app.services.intenciones import detectar_intencion
+from app.services.historial import agregar_turno
+from app.services.conversacion import (
+    EstadoConversacion,
+    cargar_estado,
+    guardar_estado,
+    PIDIENDO_USUARIO,
+    ELIGIENDO_DIAS,
+    ESPERANDO_PAGO,
+    PAGO_ENVIADO,
+)
+from app.services.cola import ColaTrabajos
+from app.services.idempotencia import eventos_webhook, clave_twilio
 from app.core.config import settings
+from app.core.metricas import medir
 
 router = APIRouter()
 
 
-def inicializar_cliente(numero: str):
-    """Obtiene el contexto del cliente desde Supabase (o crea uno nuevo)"""
-    contexto = obtener_contexto_conversacion(numero)
-    if not contexto:
-        # Crear contexto nuevo en Supabase
-        guardar_contexto_conversacion(numero, {
-            "ultimo_usuario": None,
-            "plan_solicitado": None,
-        })
-        contexto = {"ultimo_usuario": None, "plan_solicitado": None}
-    return contexto
-
-
-def ejecutar_accion_bot(accion: str, datos: dict, numero: str) -> str:
+async def ejecutar_accion_bot(
+    accion: str,
+    datos: dict,
+    estado: EstadoConversacion,
+    adelantos: Optional[Dict[str, asyncio.Task]] = None
+) -> str:
     """
     Ejecuta acciones técnicas que ChatGPT solicita.
     
+    MikroTik (routeros_api) es síncrono: sus llamadas se ejecutan en un hilo.
+    Los cambios de la conversación se aplican sobre `estado` (fusión) y se
+    guardan una sola vez al terminar el mensaje.
+    
     Args:
         accion: Nombre de la acción ("crear_usuario_nuevo", "buscar_usuario_existente")
         datos: Datos necesarios para la acción
-        numero: Número del cliente
+        estado: Estado de la conversación del cliente
+        adelantos: Búsquedas en MikroTik ya lanzadas durante el streaming {usuario: tarea}
     
     Returns:
         Mensaje de respuesta para el cliente
     """
-    cliente = inicializar_cliente(numero)
-    
     if accion == "crear_usuario_nuevo":
         # ChatGPT tiene todos los datos, crear usuario con 3 días gratis
         import random, string
         password = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
         
-        exito, msg = crear_usuario_userman(
+        exito, msg = await asyncio.to_thread(
+            crear_usuario_userman,
             usuario=datos["usuario"],
             password=password,
             nombre_completo=datos["nombre_completo"],
-            plan="3Dias"
+            plan="3Dias",
+            zona=datos.get("zona")
         )
         
         if exito:
-            # Guardar contexto actualizado en Supabase
-            guardar_contexto_conversacion(numero, {
-                "ultimo_usuario": datos["usuario"],
-                "plan_solicitado": settings.PLAN_INICIAL_NUEVO,
-            })
+            estado.actualizar(
+                estado=ELIGIENDO_DIAS,
+                ultimo_usuario=datos["usuario"],
+                plan_solicitado=settings.PLAN_INICIAL_NUEVO,
+                zona=datos.get("zona") or estado.zona,
+            )
             return (
                 f"✅ ¡Listo {datos['nombre_completo'].split()[0]}!\n\n"
                 f"👤 Usuario: {datos['usuario']}\n"
@@ -73,42 +88,41 @@ def ejecutar_accion_bot(accion: str, datos: dict, numero: str) -> str:
             return f"❌ Error al crear usuario: {msg}"
     
     elif accion == "buscar_usuario_existente":
-        usuario_data = buscar_usuario_existente(datos["usuario"])
+        usuario_data = await _buscar_usuario(datos["usuario"], adelantos, estado.zona)
         
         if usuario_data:
-            # Guardar usuario en contexto
-            guardar_contexto_conversacion(numero, {
-                "ultimo_usuario": datos["usuario"],
-                "dias_solicitados": None,
-            })
+            estado.actualizar(
+                estado=ELIGIENDO_DIAS,
+                ultimo_usuario=datos["usuario"],
+                dias_solicitados=None,
+                zona=usuario_data.get("zona") or estado.zona,
+            )
             return (
                 f"✅ Usuario {datos['usuario']} encontrado!\n"
                 f"¿Cuántos días quieres recargar?"
             )
         else:
+            estado.actualizar(estado=PIDIENDO_USUARIO)
             return f"❌ Usuario '{datos['usuario']}' no encontrado. Verifica el nombre."
     
     elif accion == "registrar_pedido":
         # El cliente dijo cuántos días quiere - SOLO GUARDAR, NO ACTIVAR NADA
-        usuario = datos.get("usuario")
+        usuario = datos.get("usuario") or estado.ultimo_usuario
         dias = datos.get("dias", 1)
         
-        # Si no tenemos usuario, obtenerlo del contexto
-        if not usuario:
-            contexto = obtener_contexto_conversacion(numero)
-            usuario = contexto.get("ultimo_usuario") if contexto else None
-        
         if not usuario:
+            estado.actualizar(estado=PIDIENDO_USUARIO)
             return "❌ No tengo tu usuario guardado. ¿Cuál es tu usuario?"
         
         print(f"📝 Registrando pedido: {usuario} quiere {dias} días")
         
-        # SOLO guardar en contexto, NO activar nada
-        guardar_contexto_conversacion(numero, {
-            "ultimo_usuario": usuario,
-            "dias_solicitados": dias,
-            "pendiente_pago": True,
-        })
+        # SOLO guardar en el estado, NO activar nada
+        estado.actualizar(
+            estado=ESPERANDO_PAGO,
+            ultimo_usuario=usuario,
+            dias_solicitados=dias,
+            pendiente_pago=True,
+        )
         
         return (
             f"Dale! Son S/{dias} por {dias} días 💰\n\n"
@@ -118,6 +132,48 @@ def ejecutar_accion_bot(accion: str, datos: dict, numero: str) -> str:
     return "❌ Acción desconocida"
 
 
+async def _buscar_usuario(usuario: str, adelantos: Optional[Dict[str, asyncio.Task]] = None, zona: str = None):
+    """Reutiliza la búsqueda adelantada durante el streaming si existe"""
+    tarea = (adelantos or {}).get(usuario)
+    if tarea is not None:
+        try:
+            return await tarea
+        except Exception as e:
+            print(f"⚠️ Búsqueda adelantada de {usuario} falló, reintentando: {e}")
+    return await asyncio.to_thread(buscar_usuario_existente, usuario, zona)
+
+
+def _adelantar_busqueda(usuario: str, adelantos: Dict[str, asyncio.Task], zona: str = None):
+    """
+    Lanza buscar_usuario_existente en un hilo sin esperarla. Además de
+    dejar el resultado listo, calienta la sesión del pool y la fila del
+    usuario en el índice de Userman.
+    """
+    if usuario in adelantos:
+        return
+    print(f"⚡ Búsqueda adelantada de {usuario} en MikroTik")
+    adelantos[usuario] = asyncio.create_task(asyncio.to_thread(buscar_usuario_existente, usuario, zona))
+
+
+async def _obtener_respuesta_ia(body_text: str, from_number: str, estado: EstadoConversacion, adelantos: Dict[str, asyncio.Task]) -> dict:
+    """
+    ChatGPT con o sin streaming (CHATGPT_STREAMING).
+    
+    En streaming, apenas el modelo termina de escribir el usuario de
+    buscar_usuario_existente se lanza la búsqueda en MikroTik, en paralelo
+    con el resto de la respuesta.
+    """
+    if not settings.CHATGPT_STREAMING:
+        return await obtener_respuesta_chatgpt_async(body_text, from_number, estado)
+    
+    def al_detectar_funcion(funcion: str, datos: dict):
+        usuario = datos.get("usuario")
+        if funcion == "buscar_usuario_existente" and isinstance(usuario, str):
+            _adelantar_busqueda(usuario, adelantos, estado.zona)
+    
+    return await obtener_respuesta_chatgpt_streaming_async(body_text, from_number, estado, al_detectar_funcion)
+
+
 
 
 
@@ -127,6 +183,128 @@ async def webhook_verification():
     return {"status": "Webhook activo", "service": "Twilio WhatsApp"}
 
 
+async def procesar_mensaje_whatsapp(mensaje: dict):
+    """
+    Pipeline completo de un mensaje entrante (se ejecuta en un worker de la cola).
+    
+    El estado de la conversación se lee una vez al inicio y se guarda una
+    vez al final (solo si cambió).
+    
+    Args:
+        mensaje: {"from_number", "body_text", "num_media", "media_url"}
+    """
+    from_number = mensaje["from_number"]
+    body_text = mensaje["body_text"]
+    num_media = mensaje["num_media"]
+    media_url = mensaje["media_url"]
+    
+    with medir("supabase.contexto"):
+        estado = await cargar_estado(from_number)
+    
+    # ============= CASO 1: TEXTO =============
+    if body_text and num_media == 0:
+        # Respuestas estructuradas ("5 días", "mi usuario es pepa") se
+        # resuelven localmente; el texto libre va a ChatGPT
+        with medir("intenciones"):
+            resultado = detectar_intencion(body_text, estado)
+        
+        adelantos: Dict[str, asyncio.Task] = {}
+        if resultado is None:
+            # Si ya conocemos al usuario, lo más probable es que el mensaje
+            # termine en una consulta a MikroTik: se busca mientras ChatGPT
+            # responde (latencia = max(LLM, router) en lugar de la suma)
+            if settings.USERMAN_PRECARGA and estado.ultimo_usuario:
+                _adelantar_busqueda(estado.ultimo_usuario, adelantos, estado.zona)
+            
+            # ChatGPT maneja la conversación y detecta acciones
+            with medir("chatgpt"):
+                resultado = await _obtener_respuesta_ia(body_text, from_number, estado, adelantos)
+        
+        # Si ChatGPT pide ejecutar una acción
+        if resultado["accion"]:
+            with medir(f"accion.{resultado['accion']}"):
+                respuesta = await ejecutar_accion_bot(resultado["accion"], resultado["datos"], estado, adelantos)
+        else:
+            respuesta = resultado["respuesta"]
+            if resultado.get("estado"):
+                estado.actualizar(estado=resultado["estado"])
+        
+        # Guardar conversación (escritura diferida, en lote)
+        await guardar_conversacion_cache_async(
+            phone_number=from_number,
+            user_message=body_text,
+            ai_response=respuesta,
+            tokens_used=resultado.get("tokens_used", 0),
+            funcion=resultado["accion"]
+        )
+        agregar_turno(from_number, body_text, respuesta, estado)
+        
+        await responder_whatsapp(from_number, respuesta)
+    
+    # ============= CASO 2: IMAGEN (comprobante) =============
+    elif num_media > 0 and media_url:
+        print(f"📸 Comprobante de {from_number}")
+        
+        # Días solicitados del estado (o default 1)
+        dias_solicitados = estado.dias_solicitados or 1
+        usuario_mikrotik = estado.ultimo_usuario
+        
+        print(f"   Usuario: {usuario_mikrotik}, Días solicitados: {dias_solicitados}")
+        
+        # Campamento del cliente: la aprobación activará los días en su router
+        router = catalogo_routers.por_zona(estado.zona, refrescar=False)
+        
+        # Guardar en Supabase con usuario y días
+        with medir("supabase.venta"):
+            venta_id = await guardar_venta_pendiente_async(
+                whatsapp_id=from_number, 
+                plan=f"{dias_solicitados} días",
+                foto_url=media_url,
+                usuario_mikrotik=usuario_mikrotik,
+                plan_solicitado=f"1User{dias_solicitados}Dia",
+                dias_solicitados=dias_solicitados,
+                campamento_id=router.id if router else None
+            )
+        
+        if venta_id:
+            estado.actualizar(estado=PAGO_ENVIADO, pendiente_pago=False, venta_id=venta_id)
+            with medir("alerta_telegram"):
+                await enviar_alerta_pago_async(venta_id, from_number, f"{dias_solicitados} días", media_url)
+            respuesta = (
+                f"✅ Comprobante recibido!\n\n"
+                f"📋 Usuario: {usuario_mikrotik}\n"
+                f"📅 Días: {dias_solicitados}\n"
+                f"💰 Monto: S/{dias_solicitados}\n\n"
+                f"Un agente lo validará en breve. Gracias! 🙏"
+            )
+        else:
+            respuesta = "❌ Error al procesar el comprobante. Intenta de nuevo o contacta al admin."
+        
+        await responder_whatsapp(from_number, respuesta)
+    
+    # Una sola escritura del estado por mensaje (si cambió algo)
+    with medir("supabase.contexto"):
+        await guardar_estado(estado)
+
+
+# Workers que procesan los mensajes fuera del request de Twilio.
+# Un carril por worker: los mensajes de un mismo número van siempre al mismo
+# carril y se procesan en orden; números distintos avanzan en paralelo.
+cola_whatsapp = ColaTrabajos(
+    "whatsapp",
+    procesar_mensaje_whatsapp,
+    workers=settings.WA_WORKERS,
+    maxsize=settings.WA_COLA_MAX,
+    clave=lambda mensaje: mensaje["from_number"],
+)
+
+# Aviso al cliente cuyo mensaje no entró en la cola
+RESPUESTA_SATURADO = (
+    "⏳ Estamos con mucha demanda en este momento. "
+    "Por favor vuelve a enviar tu mensaje en unos minutos. 🙏"
+)
+
+
 @router.post("/webhook")
 async def receive_message_twilio(request: Request):
     """
@@ -138,10 +316,25 @@ async def receive_message_twilio(request: Request):
     4. Bot ejecuta acción en MikroTik
     5. Cliente envía comprobante (foto) → Guarda y alerta admin
     6. Admin aprueba en Telegram → Bot actualiza plan
+    
+    El endpoint solo valida y encola el mensaje: responde a Twilio en
+    milisegundos y un worker de cola_whatsapp ejecuta los pasos anteriores.
+    Si el carril del cliente está lleno el mensaje se descarta con un aviso
+    (RESPUESTA_SATURADO): nunca se procesa dentro del request.
+    
+    Los reintentos de Twilio (mismo MessageSid) se responden con el
+    resultado guardado sin volver a procesar el mensaje. Si el mensaje se
+    ignora o falla, el evento se libera y un reintento se procesa de nuevo.
     """
+    clave = None
     try:
         form_data = await request.form()
         
+        clave = clave_twilio(form_data)
+        previo = await eventos_webhook.reclamar(clave)
+        if previo is not None:
+            return previo
+        
         from_number = form_data.get("From", "").replace("whatsapp:", "").strip()
         body_text = form_data.get("Body", "").strip()
         num_media = int(form_data.get("NumMedia", 0))
@@ -151,78 +344,34 @@ async def receive_message_twilio(request: Request):
         print(f"📩 MENSAJE DE {from_number}: {body_text}")
         print(f"{'='*60}\n")
         
-        # ============= CASO 1: TEXTO =============
-        if body_text and num_media == 0:
-            # ChatGPT maneja la conversación y detecta acciones
-            resultado = obtener_respuesta_chatgpt(body_text, from_number)
-            
-            # Si ChatGPT pide ejecutar una acción
-            if resultado["accion"]:
-                respuesta = ejecutar_accion_bot(resultado["accion"], resultado["datos"], from_number)
-                
-                # Guardar en cache con la respuesta de la acción
-                guardar_conversacion_cache(
-                    phone_number=from_number,
-                    user_message=body_text,
-                    ai_response=respuesta,
-                    tokens_used=resultado.get("tokens_used", 0)
-                )
-            else:
-                respuesta = resultado["respuesta"]
-                
-                # Guardar conversación normal en cache
-                guardar_conversacion_cache(
-                    phone_number=from_number,
-                    user_message=body_text,
-                    ai_response=respuesta,
-                    tokens_used=resultado.get("tokens_used", 0)
-                )
-            
-            enviar_mensaje_whatsapp(from_number, respuesta)
+        if not from_number or not (body_text or (num_media > 0 and media_url)):
+            print("⚠️ Mensaje sin remitente o sin contenido, ignorando")
+            await eventos_webhook.liberar(clave)
+            return {"status": "ignored"}
         
-        # ============= CASO 2: IMAGEN (comprobante) =============
-        elif num_media > 0 and media_url:
-            print(f"📸 Comprobante de {from_number}")
-            
-            # Obtener contexto del cliente
-            contexto = inicializar_cliente(from_number)
-            
-            # Obtener días solicitados del contexto (o default 1)
-            dias_solicitados = contexto.get("dias_solicitados", 1)
-            usuario_mikrotik = contexto.get("ultimo_usuario")
-            
-            print(f"   Usuario: {usuario_mikrotik}, Días solicitados: {dias_solicitados}")
-            
-            # Guardar en Supabase con usuario y días
-            venta_id = guardar_venta_pendiente(
-                whatsapp_id=from_number, 
-                plan=f"{dias_solicitados} días",
-                foto_url=media_url,
-                usuario_mikrotik=usuario_mikrotik,
-                plan_solicitado=f"1User{dias_solicitados}Dia",
-                dias_solicitados=dias_solicitados
-            )
-            
-            if venta_id:
-                enviar_alerta_pago(venta_id, from_number, f"{dias_solicitados} días", media_url)
-                respuesta = (
-                    f"✅ Comprobante recibido!\n\n"
-                    f"📋 Usuario: {usuario_mikrotik}\n"
-                    f"📅 Días: {dias_solicitados}\n"
-                    f"💰 Monto: S/{dias_solicitados}\n\n"
-                    f"Un agente lo validará en breve. Gracias! 🙏"
-                )
-            else:
-                respuesta = "❌ Error al procesar el comprobante. Intenta de nuevo o contacta al admin."
-            
-            enviar_mensaje_whatsapp(from_number, respuesta)
+        mensaje = {
+            "from_number": from_number,
+            "body_text": body_text,
+            "num_media": num_media,
+            "media_url": media_url,
+        }
+        
+        if cola_whatsapp.encolar(mensaje):
+            resultado = {"status": "queued"}
+        else:
+            # Cola saturada: avisar al cliente y responder a Twilio ya mismo
+            print(f"🚦 Mensaje de {from_number} descartado por saturación")
+            await responder_whatsapp(from_number, RESPUESTA_SATURADO)
+            resultado = {"status": "saturado"}
         
-        return {"status": "success"}
+        await eventos_webhook.completar(clave, resultado)
+        return resultado
     
     except Exception as e:
         print(f"❌ Error en webhook: {e}")
         import traceback
         traceback.print_exc()
+        await eventos_webhook.liberar(clave)
         return {"status": "error"}
 
 
@@ -0,0 +1,356 @@
+"""
+Outbox de activaciones en MikroTik.
+
+Antes la aprobación llamaba a reemplazar_plan_usuario y, si el router
+fallaba, la venta quedaba aprobada sin plan activado hasta que alguien la
+reprocesara a mano. Ahora:
+
+  1. La aprobación marca la venta 'aprobado' e inserta la activación en
+     activaciones_pendientes en la misma transacción (migración 012)
+  2. Este worker toma las activaciones vencidas en lotes (tomar_activaciones,
+     con SKIP LOCKED: varios procesos no toman la misma), las agrupa por
+     campamento y cada router aplica su lote en una sola sesión
+     (reemplazar_planes_lote); los routers distintos trabajan en paralelo
+  3. Las que fallan vuelven a 'pendiente' con backoff exponencial; tras
+     ACTIVACION_REINTENTOS intentos con el router respondiendo quedan
+     'fallido' y se avisa al admin
+
+Si el router está caído (circuit breaker abierto) el intento no cuenta para
+el límite, y cuando el router vuelve se adelantan todas las pendientes.
+
+El cliente recibe el aviso de "Pago aprobado" con el primer intento (plan
+activado o "espera unos minutos") y otro al activarse tras un reintento.
+Cada plan activado queda en la tabla activaciones (fecha_fin) y en el
+barredor de vencimientos (vencimientos.py).
+"""
+
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.services.supabase import (
+    tomar_activaciones_async,
+    registrar_resultados_activaciones_async,
+    adelantar_activaciones_async,
+    obtener_ventas_async,
+    registrar_avance_ventas_async,
+    registrar_activaciones_async,
+)
+from app.services.mikrotik import reemplazar_planes_lote
+from app.services.mikrotik_pool import al_recuperarse_router
+from app.services.envios import responder_whatsapp
+from app.services.telegram import editar_mensaje_telegram_async
+from app.services.aprobaciones import COMPLETADO, ERROR, SOPORTE, texto_admin
+from app.services.vencimientos import barredor_vencimientos
+
+PENDIENTE = "pendiente"
+COMPLETADA = "completado"
+FALLIDA = "fallido"
+
+# Una activación 'procesando' más tiempo que esto se considera abandonada
+# (proceso caído a mitad del lote) y se vuelve a tomar
+PLAZO_PROCESANDO_SECS = 300
+
+
+def _mensaje_espera() -> str:
+    return (
+        f"✅ ¡Pago Aprobado!\n\n"
+        f"Estamos activando tu internet. Espera unos minutos.\n\n"
+        f"Si tienes problemas, escríbenos al {SOPORTE}"
+    )
+
+
+class OutboxActivaciones:
+    """
+    Worker que drena activaciones_pendientes.
+
+    Args:
+        lote_max: Activaciones tomadas por ronda
+        intervalo_secs: Cada cuánto se buscan activaciones vencidas sin aviso
+        reintentos_max: Intentos (con el router respondiendo) antes de 'fallido'
+        backoff_secs: Espera tras el primer fallo (se duplica con cada uno)
+        backoff_max_secs: Tope de la espera
+    """
+
+    def __init__(
+        self,
+        lote_max: int = 20,
+        intervalo_secs: float = 10,
+        reintentos_max: int = 8,
+        backoff_secs: float = 5,
+        backoff_max_secs: float = 600,
+    ):
+        self.lote_max = max(1, lote_max)
+        self.intervalo_secs = intervalo_secs
+        self.reintentos_max = max(1, reintentos_max)
+        self.backoff_secs = backoff_secs
+        self.backoff_max_secs = backoff_max_secs
+
+        self._hay_trabajo: Optional[asyncio.Event] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._deteniendo = False
+        self._escuchando_routers = False
+        self._lotes = 0
+        self._completadas = 0
+        self._reintentos = 0
+        self._fallidas = 0
+        self._errores = 0
+
+    @property
+    def activo(self) -> bool:
+        return self._tarea is not None and not self._tarea.done()
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def iniciar(self):
+        """Lanza el worker (dentro del event loop)"""
+        if self.activo:
+            return
+        loop = asyncio.get_running_loop()
+        self._deteniendo = False
+        self._hay_trabajo = asyncio.Event()
+        self._hay_trabajo.set()  # revisar lo que quedó pendiente del arranque anterior
+        self._tarea = asyncio.create_task(self._ciclo(), name="outbox-activaciones")
+
+        def al_recuperarse(pool):
+            # Llega desde un hilo del pool de MikroTik
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(lambda: loop.create_task(self._adelantar()))
+
+        if not self._escuchando_routers:
+            al_recuperarse_router(al_recuperarse)
+            self._escuchando_routers = True
+
+    async def detener(self, timeout_secs: float = 15):
+        """Deja terminar el lote en curso; lo que no alcance se retoma al arrancar"""
+        if not self.activo:
+            return
+        self._deteniendo = True
+        self._hay_trabajo.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._tarea), timeout=timeout_secs)
+        except asyncio.TimeoutError:
+            print("⚠️ Outbox de activaciones: lote sin terminar, se retoma al arrancar")
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+        self._tarea = None
+
+    def despertar(self):
+        """Avisa que hay activaciones nuevas (sin esperar al intervalo)"""
+        if self._hay_trabajo is not None:
+            self._hay_trabajo.set()
+
+    async def _adelantar(self):
+        """Un router volvió: las pendientes se intentan ya, sin esperar su backoff"""
+        try:
+            await adelantar_activaciones_async()
+        except Exception as e:
+            print(f"⚠️ No se pudieron adelantar las activaciones pendientes: {e}")
+        print("🔁 Router recuperado, reintentando activaciones pendientes")
+        self.despertar()
+
+    async def _ciclo(self):
+        while not self._deteniendo:
+            try:
+                await asyncio.wait_for(self._hay_trabajo.wait(), timeout=self.intervalo_secs)
+            except asyncio.TimeoutError:
+                pass
+            self._hay_trabajo.clear()
+            try:
+                # Una ráfaga de aprobaciones se drena en lotes seguidos
+                while not self._deteniendo and len(await self.procesar_lote()) >= self.lote_max:
+                    pass
+            except Exception as e:
+                self._errores += 1
+                print(f"❌ Error en el outbox de activaciones: {e}")
+
+    # ------------------------------------------------------------------
+    # Lotes
+    # ------------------------------------------------------------------
+
+    async def procesar_lote(self, limite: int = None) -> List[Dict]:
+        """
+        Toma y aplica un lote de activaciones vencidas.
+
+        Args:
+            limite: Máximo de activaciones a tomar (None = lote_max)
+
+        Returns:
+            Nuevo estado de cada activación tomada
+            ({"id", "venta_id", "estado", "intentos", ...})
+        """
+        filas = await tomar_activaciones_async(limite or self.lote_max, PLAZO_PROCESANDO_SECS)
+        if not filas:
+            return []
+        self._lotes += 1
+
+        grupos: Dict[Optional[int], List[Dict]] = {}
+        for fila in filas:
+            grupos.setdefault(fila.get("campamento_id"), []).append(fila)
+        print(f"📦 Outbox: {len(filas)} activaciones en {len(grupos)} campamentos")
+
+        # routeros_api es síncrono: un hilo por campamento
+        resultados = await asyncio.gather(*(
+            asyncio.to_thread(reemplazar_planes_lote, [(f["usuario"], f["plan"]) for f in grupo], campamento_id)
+            for campamento_id, grupo in grupos.items()
+        ), return_exceptions=True)
+
+        ahora = datetime.now(timezone.utc)
+        registros, avisos = [], []
+        for grupo, resultado_grupo in zip(grupos.values(), resultados):
+            if isinstance(resultado_grupo, Exception):
+                resultado_grupo = [
+                    {"exito": False, "mensaje": f"Error: {resultado_grupo}", "router_caido": False}
+                ] * len(grupo)
+            for fila, resultado in zip(grupo, resultado_grupo):
+                registro = self._registro(fila, resultado, ahora)
+                registros.append(registro)
+                avisos.append((fila, resultado, registro))
+
+        await registrar_resultados_activaciones_async(registros)
+
+        ventas = {}
+        try:
+            ventas = {v["id"]: v for v in await obtener_ventas_async([f["venta_id"] for f in filas])}
+        except Exception as e:
+            print(f"⚠️ No se pudieron leer las ventas del lote: {e}")
+        await self._registrar_vigencias(
+            [fila for fila, _, registro in avisos if registro["estado"] == COMPLETADA], ventas, ahora
+        )
+        try:
+            await registrar_avance_ventas_async([
+                self._avance_venta(fila, resultado, registro, ahora) for fila, resultado, registro in avisos
+            ])
+        except Exception as e:
+            print(f"⚠️ No se pudo registrar el avance de las ventas del lote: {e}")
+        await asyncio.gather(*(
+            self._avisar(fila, resultado, registro, ventas.get(fila["venta_id"]))
+            for fila, resultado, registro in avisos
+        ), return_exceptions=True)
+        return registros
+
+    async def _registrar_vigencias(self, filas: List[Dict], ventas: Dict, ahora: datetime):
+        """Registra los planes activados en activaciones (un insert por lote) y en el barredor"""
+        if not filas:
+            return
+        nuevas = [{
+            "venta_id": fila["venta_id"],
+            "usuario_hotspot": fila["usuario"],
+            "fecha_inicio": ahora.isoformat(),
+            "fecha_fin": (ahora + timedelta(days=fila.get("dias") or 1)).isoformat(),
+        } for fila in filas]
+        try:
+            insertadas = await registrar_activaciones_async(nuevas)
+        except Exception as e:
+            print(f"⚠️ No se pudieron registrar las activaciones del lote: {e}")
+            return
+        for activacion in insertadas:
+            venta = ventas.get(activacion["venta_id"]) or {}
+            barredor_vencimientos.agregar(activacion, venta.get("whatsapp_id"), venta.get("campamento_id"))
+
+    def _registro(self, fila: Dict, resultado: Dict, ahora: datetime) -> Dict:
+        """Nuevo estado de la fila según el resultado del intento"""
+        intentos = (fila.get("intentos") or 0) + 1
+        registro = {"id": fila["id"], "venta_id": fila["venta_id"], "intentos": intentos, "ultimo_error": None, "proximo_intento": None}
+
+        if resultado["exito"]:
+            self._completadas += 1
+            registro["estado"] = COMPLETADA
+        elif intentos >= self.reintentos_max and not resultado["router_caido"]:
+            self._fallidas += 1
+            registro.update(estado=FALLIDA, ultimo_error=resultado["mensaje"])
+            print(f"❌ Activación de {fila['usuario']} fallida tras {intentos} intentos: {resultado['mensaje']}")
+        else:
+            self._reintentos += 1
+            espera = min(self.backoff_secs * 2 ** (intentos - 1), self.backoff_max_secs)
+            espera *= random.uniform(0.8, 1.2)  # que un lote fallido no reintente todo a la vez
+            registro.update(
+                estado=PENDIENTE,
+                ultimo_error=resultado["mensaje"],
+                proximo_intento=(ahora + timedelta(seconds=espera)).isoformat(),
+            )
+            print(f"🔁 Activación de {fila['usuario']} falló ({resultado['mensaje']}), reintento en {espera:.0f}s")
+        return registro
+
+    def _avance_venta(self, fila: Dict, resultado: Dict, registro: Dict, ahora: datetime) -> Dict:
+        """Campos de la venta tras el intento (para registrar_avance_ventas)"""
+        avance = {
+            "id": fila["venta_id"],
+            "aprobacion_intentos": registro["intentos"],
+            "aprobacion_error": None if registro["estado"] == COMPLETADA else resultado["mensaje"],
+        }
+        if registro["estado"] == COMPLETADA:
+            avance.update(
+                aprobacion_estado=COMPLETADO,
+                activo=True,
+                usuario_hotspot=fila["usuario"],
+                fecha_inicio_activacion=ahora.isoformat(),
+                fecha_fin_activacion=(ahora + timedelta(days=fila.get("dias") or 1)).isoformat(),
+            )
+        elif registro["estado"] == FALLIDA:
+            avance["aprobacion_estado"] = ERROR
+        # Si sigue 'pendiente_activacion' solo se registra el intento
+        return avance
+
+    async def _avisar(self, fila: Dict, resultado: Dict, registro: Dict, venta: Optional[Dict]):
+        """Avisa al cliente y edita el mensaje del admin (la venta ya se actualizó en lote)"""
+        venta_id = fila["venta_id"]
+        usuario, dias = fila["usuario"], fila.get("dias", 1)
+        intentos = registro["intentos"]
+        primero = intentos == 1
+        cliente_wa = (venta or {}).get("whatsapp_id")
+
+        if registro["estado"] == COMPLETADA:
+            if primero:
+                mensaje = (
+                    f"✅ ¡Pago Aprobado!\n\n"
+                    f"🎉 Ya tienes {dias} días de internet activados.\n\n"
+                    f"¡Disfruta tu conexión! 🌐\n\n"
+                    f"📲 Soporte: {SOPORTE}"
+                )
+                texto = f"✅ {usuario}: {dias}d OK"
+            else:
+                mensaje = (
+                    f"🎉 ¡Listo! Ya tienes {dias} días de internet activados.\n\n"
+                    f"¡Disfruta tu conexión! 🌐"
+                )
+                texto = f"✅ {usuario}: {dias}d OK (tras {intentos} intentos)"
+            print(f"✅ Venta {venta_id} activada. {dias} días para {usuario}")
+        elif registro["estado"] == FALLIDA:
+            mensaje = _mensaje_espera() if primero else None
+            texto = f"⚠️ Aprobado, pero la activación falló tras {intentos} intentos: {resultado['mensaje']}"
+        else:
+            if not primero:
+                return
+            mensaje = _mensaje_espera()
+            if resultado["router_caido"]:
+                texto = "✅ Aprobado (router caído: se activará cuando vuelva)"
+            else:
+                texto = f"✅ Aprobado (error MikroTik: {resultado['mensaje']}, reintentando)"
+
+        if mensaje and cliente_wa:
+            await responder_whatsapp(cliente_wa, mensaje)
+        if venta:
+            await editar_mensaje_telegram_async(venta.get("tg_chat_id"), venta.get("tg_message_id"), texto_admin(venta, venta_id, texto))
+
+    def estadisticas(self) -> Dict:
+        return {
+            "activo": self.activo,
+            "lotes": self._lotes,
+            "completadas": self._completadas,
+            "reintentos": self._reintentos,
+            "fallidas": self._fallidas,
+            "errores": self._errores,
+        }
+
+
+outbox_activaciones = OutboxActivaciones(
+    lote_max=settings.ACTIVACION_LOTE,
+    intervalo_secs=settings.ACTIVACION_INTERVALO_SECS,
+    reintentos_max=settings.ACTIVACION_REINTENTOS,
+    backoff_secs=settings.ACTIVACION_BACKOFF_SECS,
+    backoff_max_secs=settings.ACTIVACION_BACKOFF_MAX_SECS,
+)
@@ -0,0 +1,330 @@
+"""
+Trabajos de aprobación/rechazo de ventas lanzados desde Telegram.
+
+Antes el webhook de Telegram hacía toda la aprobación (leer la venta,
+reemplazar el plan en MikroTik, actualizar Supabase, avisar por WhatsApp)
+antes de responder el callback: el botón del admin quedaba girando varios
+segundos y Telegram podía reenviar el update. Ahora:
+
+  1. El webhook responde el callback al instante, marca la venta como
+     'en_cola' y encola el trabajo
+  2. Un worker ejecuta el trabajo. Aprobar marca la venta 'aprobado' y
+     deja su activación en el outbox de MikroTik en la misma transacción
+     (ver activaciones.py): la venta queda 'pendiente_activacion' hasta que
+     el worker del outbox aplica el plan, avisa al cliente y edita el
+     mensaje del admin
+  3. El avance queda en la fila de ventas (aprobacion_estado, intentos,
+     error) y al terminar se edita el mensaje del admin con el resultado
+
+Los trabajos de una misma venta van al mismo carril (nunca corren a la vez)
+y los que quedaron 'en_cola'/'procesando' al apagar se retoman al arrancar.
+Un error transitorio (red, timeout, conflicto de transacción en Postgres)
+se reintenta APROBACION_INTENTOS veces con espera exponencial antes de
+marcar la venta con 'error'; cada intento vuelve a leer la venta, así uno
+que llegó a aplicarse no se repite.
+
+Aprobación masiva (comando /aprobar_todos de Telegram y POST
+/admin/ventas/aprobar-pendientes): una consulta trae todas las ventas
+pendientes, una transacción las aprueba y encola sus activaciones, y el
+outbox las aplica enseguida con una sesión por router.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+import httpx
+from postgrest.exceptions import APIError
+from app.core.config import settings
+from app.services.cola import ColaTrabajos
+from app.services.supabase import (
+    obtener_venta_async,
+    actualizar_venta_async,
+    obtener_ventas_por_aprobacion_async,
+    aprobar_venta_con_activacion_async,
+    obtener_ventas_pendientes_async,
+    aprobar_ventas_con_activacion_async,
+    reclamar_venta_para_aprobacion_async,
+)
+from app.services.envios import responder_whatsapp
+from app.services.telegram import editar_mensaje_telegram_async
+from app.services.costos_ai import uso_ai
+
+EN_COLA = "en_cola"
+PROCESANDO = "procesando"
+COMPLETADO = "completado"
+ERROR = "error"
+PENDIENTE_ACTIVACION = "pendiente_activacion"  # aprobada, esperando el outbox de MikroTik
+
+# Acciones que llegan desde los botones de Telegram
+ACCIONES = ("aprobar", "rechazar")
+
+SOPORTE = "+51987654321"
+
+# Errores de Postgres que se resuelven solos al reintentar: conflicto de
+# serialización, deadlock, statement timeout, sin conexiones libres
+CODIGOS_TRANSITORIOS = {"40001", "40P01", "57014", "53300"}
+
+
+class VentaYaProcesada(Exception):
+    """La venta ya fue aprobada o rechazada: el clic se ignora"""
+
+
+async def marcar_aprobacion(venta_id, estado: str, **campos):
+    """Persiste el avance del trabajo en la fila de la venta"""
+    campos.update({
+        "aprobacion_estado": estado,
+        "aprobacion_actualizada": datetime.now(timezone.utc).isoformat(),
+    })
+    try:
+        await actualizar_venta_async(venta_id, campos)
+    except Exception as e:
+        print(f"⚠️ No se pudo registrar el avance de la venta {venta_id}: {e}")
+
+
+async def _aprobar(venta: Dict) -> Tuple[str, Dict, str]:
+    """
+    Returns:
+        (texto para el admin, campos finales de la venta, estado final del trabajo)
+    """
+    venta_id = venta["id"]
+    usuario = venta.get("usuario_mikrotik")
+    dias_solicitados = venta.get("dias_solicitados", 1)
+    plan_solicitado = venta.get("plan_solicitado") or f"1User{dias_solicitados}Dia"
+
+    if not usuario:
+        print(f"⚠️ Venta {venta_id} no tiene usuario asociado")
+        return "⚠️ Sin usuario asociado", {"aprobacion_error": "no_usuario"}, ERROR
+
+    # Aprobar + encolar la activación en MikroTik (una sola transacción):
+    # el cliente y el admin reciben el aviso cuando el outbox activa el plan
+    activacion_id = await aprobar_venta_con_activacion_async(
+        venta_id, usuario, plan_solicitado, dias_solicitados, venta.get("campamento_id")
+    )
+    if activacion_id is None:
+        print(f"♻️ Venta {venta_id} ya no está pendiente, no se aprueba")
+        return "♻️ Venta ya procesada", {}, COMPLETADO
+    uso_ai.registrar_venta_aprobada()
+    print(f"✅ Venta {venta_id} aprobada, activación de {usuario} en el outbox")
+    return "", {}, PENDIENTE_ACTIVACION
+
+
+async def _rechazar(venta: Dict) -> Tuple[str, Dict, str]:
+    venta_id = venta["id"]
+    await actualizar_venta_async(venta_id, {"estado": "rechazado"})
+    await responder_whatsapp(venta.get("whatsapp_id"), "❌ Tu pago fue rechazado. Por favor contacta a soporte.")
+    print(f"🚫 Venta {venta_id} rechazada")
+    return "🚫 Venta rechazada", {}, COMPLETADO
+
+
+def es_error_transitorio(e: Exception) -> bool:
+    """Fallo de red o de concurrencia en Supabase (no un dato inválido)"""
+    if isinstance(e, (httpx.TransportError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return isinstance(e, APIError) and e.code in CODIGOS_TRANSITORIOS
+
+
+def texto_admin(venta: Optional[Dict], venta_id, resultado: str) -> str:
+    if not venta:
+        return f"Venta #{venta_id}\n{resultado}"
+    return (
+        f"Venta #{venta_id}\n"
+        f"👤 Cliente: {venta.get('whatsapp_id')}\n"
+        f"📋 Usuario: {venta.get('usuario_mikrotik') or '-'}\n"
+        f"📅 Días: {venta.get('dias_solicitados', 1)}\n\n"
+        f"{resultado}"
+    )
+
+
+async def procesar_aprobacion(trabajo: Dict):
+    """
+    Ejecuta un trabajo {"accion", "venta_id", "chat_id", "message_id"}.
+    """
+    accion = trabajo["accion"]
+    venta_id = trabajo["venta_id"]
+    chat_id, message_id = trabajo.get("chat_id"), trabajo.get("message_id")
+
+    venta = None
+    intento = 0
+    while True:
+        intento += 1
+        try:
+            venta = await obtener_venta_async(venta_id)
+            if not venta:
+                print(f"❌ Venta {venta_id} no encontrada en la base de datos")
+                await editar_mensaje_telegram_async(chat_id, message_id, texto_admin(None, venta_id, "❌ Venta no encontrada"))
+                return
+
+            if venta.get("estado") != "pendiente" or venta.get("aprobacion_estado") in (COMPLETADO, PENDIENTE_ACTIVACION):
+                print(f"♻️ Venta {venta_id} ya procesada ({venta.get('estado')})")
+                return
+
+            print(f"⚙️ Procesando {accion.upper()} de venta {venta_id}...")
+            await marcar_aprobacion(venta_id, PROCESANDO)
+
+            if accion == "aprobar":
+                resultado, campos, estado_final = await _aprobar(venta)
+            else:
+                resultado, campos, estado_final = await _rechazar(venta)
+
+            if estado_final == PENDIENTE_ACTIVACION:
+                # La transacción ya dejó la venta 'pendiente_activacion'; el outbox
+                # edita el mensaje del admin al terminar el primer intento
+                from app.services.activaciones import outbox_activaciones
+                outbox_activaciones.despertar()
+                return
+
+            await marcar_aprobacion(venta_id, estado_final, **campos)
+            break
+
+        except Exception as e:
+            if intento < settings.APROBACION_INTENTOS and es_error_transitorio(e):
+                espera = settings.APROBACION_BACKOFF_SECS * 2 ** (intento - 1)
+                print(f"🔁 Error transitorio en la venta {venta_id} (intento {intento}), reintento en {espera:.0f}s: {e}")
+                await marcar_aprobacion(venta_id, PROCESANDO, aprobacion_error=str(e)[:500])
+                await asyncio.sleep(espera)
+                continue
+            print(f"❌ Error al procesar la acción '{accion}' de la venta {venta_id}: {e}")
+            await marcar_aprobacion(venta_id, ERROR, aprobacion_error=str(e)[:500])
+            resultado = "❌ Error al procesar"
+            break
+
+    await editar_mensaje_telegram_async(chat_id, message_id, texto_admin(venta, venta_id, resultado))
+
+
+# Un carril por venta: dos clics sobre la misma venta nunca corren a la vez
+cola_aprobaciones = ColaTrabajos(
+    "aprobaciones",
+    procesar_aprobacion,
+    workers=settings.APROBACION_WORKERS,
+    maxsize=200,
+    clave=lambda trabajo: str(trabajo["venta_id"]),
+)
+
+
+async def encolar_aprobacion(accion: str, venta_id: int, chat_id=None, message_id=None) -> bool:
+    """
+    Registra el trabajo en la venta y lo encola.
+
+    La marca 'en_cola' es condicional: solo se aplica si la venta sigue
+    'pendiente' y su aprobación no terminó, así un segundo clic (otro
+    callback_query.id, no lo frena la idempotencia) no la reaprueba ni la
+    rechaza después de aprobada.
+
+    Returns:
+        True si quedó encolado; False si la cola no está activa (el
+        llamador debe ejecutarlo con procesar_aprobacion)
+
+    Raises:
+        VentaYaProcesada: La venta ya fue aprobada o rechazada
+    """
+    reclamada = await reclamar_venta_para_aprobacion_async(venta_id, {
+        "aprobacion_estado": EN_COLA,
+        "aprobacion_actualizada": datetime.now(timezone.utc).isoformat(),
+        "aprobacion_accion": accion,
+        "tg_chat_id": str(chat_id) if chat_id else None,
+        "tg_message_id": message_id,
+    })
+    if not reclamada:
+        raise VentaYaProcesada(venta_id)
+    trabajo = {"accion": accion, "venta_id": venta_id, "chat_id": chat_id, "message_id": message_id}
+    return cola_aprobaciones.encolar(trabajo)
+
+
+async def recuperar_aprobaciones_pendientes() -> int:
+    """Re-encola los trabajos que quedaron a medias en el apagado anterior"""
+    try:
+        ventas = await obtener_ventas_por_aprobacion_async((EN_COLA, PROCESANDO))
+    except Exception as e:
+        print(f"⚠️ No se pudieron leer las aprobaciones pendientes: {e}")
+        return 0
+
+    encolados = 0
+    for venta in ventas:
+        accion = venta.get("aprobacion_accion")
+        if accion not in ACCIONES:
+            continue
+        encolados += cola_aprobaciones.encolar({
+            "accion": accion,
+            "venta_id": venta["id"],
+            "chat_id": venta.get("tg_chat_id"),
+            "message_id": venta.get("tg_message_id"),
+        })
+    if encolados:
+        print(f"♻️ {encolados} aprobaciones pendientes retomadas")
+    return encolados
+
+
+async def aprobar_ventas_pendientes(limite: int = None) -> Dict:
+    """
+    Aprueba de una vez todas las ventas pendientes.
+
+    Args:
+        limite: Máximo de ventas (None = APROBACION_MASIVA_MAX)
+
+    Returns:
+        Resumen {"pendientes", "aprobadas", "sin_usuario", "activadas",
+        "reintentando", "fallidas"} (sin_usuario y fallidas: ids de venta)
+    """
+    from app.services.activaciones import outbox_activaciones, COMPLETADA, FALLIDA
+
+    ventas = await obtener_ventas_pendientes_async(limite or settings.APROBACION_MASIVA_MAX)
+    resumen = {"pendientes": len(ventas), "aprobadas": 0, "sin_usuario": [], "activadas": 0, "reintentando": 0, "fallidas": []}
+
+    pedidos = []
+    for venta in ventas:
+        if not venta.get("usuario_mikrotik"):
+            resumen["sin_usuario"].append(venta["id"])
+            continue
+        dias = venta.get("dias_solicitados", 1)
+        pedidos.append({
+            "venta_id": venta["id"],
+            "usuario": venta["usuario_mikrotik"],
+            "plan": venta.get("plan_solicitado") or f"1User{dias}Dia",
+            "dias": dias,
+            "campamento_id": venta.get("campamento_id"),
+        })
+    if not pedidos:
+        return resumen
+
+    # 1. Una transacción: todas las ventas 'aprobado' + sus activaciones en el outbox
+    aprobadas = set(await aprobar_ventas_con_activacion_async(pedidos))
+    resumen["aprobadas"] = len(aprobadas)
+    for _ in aprobadas:
+        uso_ai.registrar_venta_aprobada()
+    print(f"✅ Aprobación masiva: {len(aprobadas)} de {len(ventas)} ventas pendientes")
+
+    # 2. Activar ya (agrupadas por router, una sesión por router). Las que
+    #    el worker del outbox tome primero las aplica él.
+    restantes = set(aprobadas)
+    while restantes:
+        registros = await outbox_activaciones.procesar_lote(limite=max(len(restantes), outbox_activaciones.lote_max))
+        if not registros:
+            break
+        for registro in registros:
+            if registro["venta_id"] not in restantes:
+                continue
+            restantes.discard(registro["venta_id"])
+            if registro["estado"] == COMPLETADA:
+                resumen["activadas"] += 1
+            elif registro["estado"] == FALLIDA:
+                resumen["fallidas"].append(registro["venta_id"])
+            else:
+                resumen["reintentando"] += 1
+    return resumen
+
+
+def texto_resumen_masivo(resumen: Dict) -> str:
+    """Resumen de aprobar_ventas_pendientes para el admin"""
+    if not resumen["pendientes"]:
+        return "📭 No hay ventas pendientes"
+    lineas = [
+        f"✅ Aprobación masiva: {resumen['aprobadas']}/{resumen['pendientes']} ventas aprobadas",
+        f"🎉 Activadas: {resumen['activadas']}",
+    ]
+    if resumen["reintentando"]:
+        lineas.append(f"🔁 Reintentando activación: {resumen['reintentando']}")
+    if resumen["fallidas"]:
+        lineas.append(f"❌ Activación fallida: {', '.join(f'#{i}' for i in resumen['fallidas'])}")
+    if resumen["sin_usuario"]:
+        lineas.append(f"⚠️ Sin usuario (revisar a mano): {', '.join(f'#{i}' for i in resumen['sin_usuario'])}")
+    return "\n".join(lineas)
@@ -0,0 +1,274 @@
+"""
+Escritura diferida (write-behind) de filas a Supabase.
+
+Las filas de conversation_cache y ai_cost_tracking no necesitan estar en la
+base antes de responder al cliente. Se acumulan en memoria y se insertan en
+lote cada `max_filas` filas o cada `intervalo_ms` milisegundos: una sola
+llamada a PostgREST por lote en lugar de un round trip por mensaje.
+
+Durabilidad: las filas nuevas se anotan en un archivo local (una línea JSON
+por fila) en cada ciclo, antes de insertar el lote, en una sola escritura
+fuera del event loop. El archivo se reescribe con lo que queda cuando el
+lote llega a Supabase, así que si el proceso se cae o Supabase no responde
+al apagar, las filas pendientes se reintentan en el próximo arranque.
+
+Un lote que Supabase rechaza (una fila inválida) no frena a los demás: tras
+`max_intentos` rechazos seguidos se parte en mitades hasta aislar las filas
+culpables, que van a un archivo de descartadas (descartadas_<tabla>.jsonl)
+para revisarlas a mano. Si Supabase no responde, las filas esperan en
+memoria hasta `max_pendientes`; pasado ese tope se descartan las más viejas.
+"""
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from postgrest.exceptions import APIError
+from app.core.config import settings
+
+
+class BufferEscritura:
+    """
+    Buffer de inserciones para una tabla.
+
+    Args:
+        tabla: Tabla de Supabase destino
+        max_filas: Filas acumuladas que disparan un vaciado inmediato
+        intervalo_ms: Tiempo máximo que una fila espera en memoria
+        archivo: Archivo local de respaldo (None = sin respaldo)
+        max_pendientes: Filas en memoria como máximo (se descartan las más viejas)
+        max_intentos: Rechazos seguidos de un lote antes de aislar las filas inválidas
+    """
+
+    def __init__(self, tabla: str, max_filas: int = 50, intervalo_ms: float = 2000, archivo: str = None,
+                 max_pendientes: int = 10000, max_intentos: int = 3):
+        self.tabla = tabla
+        self.max_filas = max(1, max_filas)
+        self.intervalo_ms = intervalo_ms
+        self.archivo = archivo
+        self.archivo_descartadas = (
+            os.path.join(os.path.dirname(archivo), f"descartadas_{tabla}.jsonl") if archivo else None
+        )
+        self.max_pendientes = max(self.max_filas, max_pendientes)
+        self.max_intentos = max(1, max_intentos)
+
+        self._filas: List[Dict] = []
+        self._en_vuelo: List[Dict] = []
+        self._por_respaldar: List[Dict] = []
+        self._rechazos = 0
+        self._hay_lote: Optional[asyncio.Event] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._insertadas = 0
+        self._lotes = 0
+        self._errores = 0
+        self._descartadas = 0
+        self._invalidas = 0
+
+    @property
+    def activo(self) -> bool:
+        return self._tarea is not None and not self._tarea.done()
+
+    # ------------------------------------------------------------------
+    # Archivo de respaldo
+    # ------------------------------------------------------------------
+
+    def _escribir(self, archivo: str, filas: List[Dict], reemplazar: bool = False):
+        if not archivo:
+            return
+        try:
+            os.makedirs(os.path.dirname(archivo) or ".", exist_ok=True)
+            with open(archivo, "w" if reemplazar else "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(fila, ensure_ascii=False, default=str) + "\n" for fila in filas))
+        except OSError as e:
+            print(f"⚠️ No se pudo escribir {archivo} ({self.tabla}): {e}")
+
+    async def _respaldar_nuevas(self):
+        """Anota en el respaldo las filas agregadas desde el último ciclo (una sola escritura)"""
+        if not self._por_respaldar:
+            return
+        filas, self._por_respaldar = self._por_respaldar, []
+        await asyncio.to_thread(self._escribir, self.archivo, filas)
+
+    async def _reescribir_respaldo(self):
+        """Deja en el respaldo solo las filas aún pendientes"""
+        if not self.archivo:
+            return
+        filas, self._por_respaldar = self._en_vuelo + self._filas, []
+        await asyncio.to_thread(self._escribir, self.archivo, filas, True)
+
+    def _recuperar_respaldo(self) -> List[Dict]:
+        if not self.archivo or not os.path.exists(self.archivo):
+            return []
+        filas = []
+        with open(self.archivo, encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    filas.append(json.loads(linea))
+                except json.JSONDecodeError:
+                    continue  # última línea a medio escribir por una caída
+        return filas
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def iniciar(self):
+        """Recupera filas del respaldo y lanza el vaciado periódico (dentro del event loop)"""
+        if self.activo:
+            return
+        recuperadas = self._recuperar_respaldo()[-self.max_pendientes:]
+        if recuperadas:
+            print(f"♻️ Buffer {self.tabla}: {len(recuperadas)} filas recuperadas del respaldo")
+            self._filas = recuperadas + self._filas
+        self._hay_lote = asyncio.Event()
+        self._tarea = asyncio.create_task(self._ciclo(), name=f"buffer-{self.tabla}")
+
+    async def detener(self):
+        """Último vaciado; lo que no se pueda insertar queda en el respaldo"""
+        if not self.activo:
+            return
+        self._tarea.cancel()
+        await asyncio.gather(self._tarea, return_exceptions=True)
+        self._tarea = None
+        await self.vaciar()
+        await self._respaldar_nuevas()
+        if self._filas:
+            print(f"⚠️ Buffer {self.tabla}: {len(self._filas)} filas quedan en {self.archivo}")
+
+    def agregar(self, fila: Dict) -> bool:
+        """
+        Agrega una fila (sin esperar a Supabase).
+
+        Returns:
+            True si quedó en el buffer, False si el buffer no está activo
+        """
+        if not self.activo:
+            return False
+        fila.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        if len(self._filas) >= self.max_pendientes:
+            # Supabase lleva rato sin responder: se pierden las más viejas
+            del self._filas[0]
+            self._descartadas += 1
+            if self._descartadas % 1000 == 1:
+                print(f"⚠️ Buffer {self.tabla} lleno ({self.max_pendientes} filas): descartando las más viejas")
+        self._filas.append(fila)
+        if self.archivo:
+            self._por_respaldar.append(fila)
+        if len(self._filas) >= self.max_filas:
+            self._hay_lote.set()
+        return True
+
+    def pendientes(self, campo: str, valor) -> List[Dict]:
+        """Filas aún no insertadas que cumplen campo == valor"""
+        return [fila for fila in self._en_vuelo + self._filas if fila.get(campo) == valor]
+
+    async def _ciclo(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._hay_lote.wait(), timeout=self.intervalo_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._hay_lote.clear()
+            await self._respaldar_nuevas()
+            await self.vaciar()
+
+    async def _insertar(self, filas: List[Dict]):
+        from app.services.supabase import obtener_supabase_async
+        cliente = await obtener_supabase_async()
+        await cliente.table(self.tabla).insert(filas).execute()
+
+    async def _aislar_invalidas(self, filas: List[Dict]):
+        """
+        Inserta un lote rechazado por mitades; las filas que Supabase
+        rechaza solas van al archivo de descartadas. Cada parte resuelta
+        sale del frente de _en_vuelo (las partes se recorren en orden).
+
+        Raises:
+            Exception: Si Supabase deja de responder (no es un rechazo)
+        """
+        try:
+            await self._insertar(filas)
+            self._insertadas += len(filas)
+            del self._en_vuelo[:len(filas)]
+            return
+        except APIError as e:
+            if len(filas) == 1:
+                self._invalidas += 1
+                print(f"🗑️ Buffer {self.tabla}: fila rechazada, va a {self.archivo_descartadas}: {e}")
+                await asyncio.to_thread(self._escribir, self.archivo_descartadas, filas)
+                del self._en_vuelo[:1]
+                return
+        mitad = len(filas) // 2
+        await self._aislar_invalidas(filas[:mitad])
+        await self._aislar_invalidas(filas[mitad:])
+
+    async def vaciar(self):
+        """Inserta todas las filas pendientes en lotes de max_filas"""
+        resueltas = self._insertadas + self._invalidas
+        while self._filas:
+            # El lote sale de la lista mientras viaja: agregar() puede
+            # descartar filas viejas sin tocar las que se están insertando
+            lote, self._filas = self._filas[:self.max_filas], self._filas[self.max_filas:]
+            self._en_vuelo = list(lote)
+            inicio = time.perf_counter()
+            try:
+                if self._rechazos >= self.max_intentos:
+                    await self._aislar_invalidas(list(lote))
+                else:
+                    await self._insertar(lote)
+                    self._insertadas += len(lote)
+            except Exception as e:
+                self._errores += 1
+                if isinstance(e, APIError):
+                    self._rechazos += 1
+                print(f"⚠️ Buffer {self.tabla}: error insertando {len(self._en_vuelo)} filas, se reintentará: {e}")
+                self._filas[:0] = self._en_vuelo
+                self._en_vuelo = []
+                break
+
+            self._en_vuelo = []
+            self._rechazos = 0
+            self._lotes += 1
+            print(f"💾 Buffer {self.tabla}: {len(lote)} filas en {(time.perf_counter() - inicio) * 1000:.0f}ms")
+
+        if self._insertadas + self._invalidas != resueltas:
+            await self._reescribir_respaldo()
+
+    def estadisticas(self) -> Dict:
+        return {
+            "tabla": self.tabla,
+            "activo": self.activo,
+            "pendientes": len(self._en_vuelo) + len(self._filas),
+            "insertadas": self._insertadas,
+            "lotes": self._lotes,
+            "errores": self._errores,
+            "descartadas": self._descartadas,
+            "invalidas": self._invalidas,
+        }
+
+
+def _archivo_respaldo(tabla: str) -> str:
+    return os.path.join(settings.BUFFER_DIRECTORIO, f"pendientes_{tabla}.jsonl")
+
+
+buffer_conversaciones = BufferEscritura(
+    "conversation_cache",
+    max_filas=settings.BUFFER_MAX_FILAS,
+    intervalo_ms=settings.BUFFER_INTERVALO_MS,
+    archivo=_archivo_respaldo("conversation_cache"),
+    max_pendientes=settings.BUFFER_MAX_PENDIENTES,
+    max_intentos=settings.BUFFER_MAX_INTENTOS,
+)
+
+buffer_costos = BufferEscritura(
+    "ai_cost_tracking",
+    max_filas=settings.BUFFER_MAX_FILAS,
+    intervalo_ms=settings.BUFFER_INTERVALO_MS,
+    archivo=_archivo_respaldo("ai_cost_tracking"),
+    max_pendientes=settings.BUFFER_MAX_PENDIENTES,
+    max_intentos=settings.BUFFER_MAX_INTENTOS,
+)
+
+BUFFERS = (buffer_conversaciones, buffer_costos)
@@ -0,0 +1,422 @@
+"""
+Cache de respuestas de ChatGPT en dos niveles.
+
+  1. LRU en memoria con TTL: un hit responde en microsegundos
+  2. Tabla prompt_cache de Supabase: compartida entre procesos y reinicios
+
+La clave es el mensaje normalizado (minúsculas, sin tildes ni signos) más el
+estado de la conversación, que aquí es el último mensaje del bot: "cuánto
+cuesta" al inicio y "cuánto cuesta" después de "¿Cuál es tu usuario?" son
+entradas distintas.
+
+Solo se guardan respuestas de turnos sin function calling. Con temperatura
+0.7 el mismo turno a veces responde con texto y a veces pide una función
+(registrar_pedido, buscar_usuario_existente); si el texto quedara en cache
+taparía la función para siempre. Por eso:
+
+  - Una clave que alguna vez pidió una función se marca (marcar_con_funcion):
+    se borra lo que tenía guardado y ya no se cachea ni se sirve desde cache
+  - No se guardan respuestas con precios o cantidad de días ("Son S/3 por 3
+    días"): son las que reemplazan a registrar_pedido
+
+La clave no distingue clientes, así que una respuesta solo se guarda cuando
+la misma pregunta, en el mismo estado, ya la hicieron al menos
+PROMPT_CACHE_MIN_TELEFONOS clientes distintos (el mismo criterio que
+construir_cache_semantico.py). Una respuesta con datos de un cliente (su
+usuario, su nombre) sale de una pregunta que solo hizo él y no llega al
+cache.
+
+Los hits (hit_count / tokens_saved) se acumulan en memoria y se registran en
+lote con la función registrar_hits_prompt_cache (migración 008).
+"""
+
+import asyncio
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+
+MODELO = "gpt-3.5-turbo"
+
+# Mensajes más largos casi nunca se repiten: no vale la pena cachearlos
+MAX_CARACTERES_MENSAJE = 200
+
+# Precios ("S/3", "5 soles") y cantidades de días/horas: respuestas de un pedido
+RE_PRECIO_O_DIAS = re.compile(r"s/\.?\s*\d|\d+(?:[.,]\d+)?\s*(?:soles?|d[ií]as?|horas?)\b", re.IGNORECASE)
+
+
+def normalizar_mensaje(texto: str) -> str:
+    """'¿Cuánto cuesta?? ' -> 'cuanto cuesta'"""
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^a-z0-9ñ ]+", " ", texto)
+    return " ".join(texto.split())
+
+
+def clave_prompt(mensaje: str, history: List[Dict]) -> Optional[str]:
+    """
+    Texto que identifica la pregunta en su contexto (se guarda como
+    original_prompt y su hash es la clave del cache).
+
+    Returns:
+        None si el mensaje no es cacheable
+    """
+    normalizado = normalizar_mensaje(mensaje)
+    if not normalizado or len(normalizado) > MAX_CARACTERES_MENSAJE:
+        return None
+    return f"{MODELO}|{estado_conversacion(history)}|{normalizado}"
+
+
+def estado_conversacion(history: List[Dict]) -> str:
+    """Último mensaje del bot normalizado ("inicio" si no hay)"""
+    ultimo_bot = next(
+        (m["content"] for m in reversed(history or []) if m.get("role") == "assistant"),
+        None
+    )
+    return normalizar_mensaje(ultimo_bot)[:MAX_CARACTERES_MENSAJE] if ultimo_bot else "inicio"
+
+
+class CacheLRU:
+    """LRU con TTL (thread-safe): lo usan tanto la ruta síncrona como la async"""
+
+    def __init__(self, max_items: int = 1000, ttl_secs: float = 3600):
+        self.max_items = max_items
+        self.ttl_secs = ttl_secs
+        self._datos: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: str):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave: str, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl_secs, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_items:
+                self._datos.popitem(last=False)
+
+    def quitar(self, clave: str):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def __len__(self):
+        return len(self._datos)
+
+
+cache_local = CacheLRU(
+    max_items=settings.PROMPT_CACHE_MAX,
+    ttl_secs=settings.PROMPT_CACHE_TTL_SECS,
+)
+
+# Claves cuyo turno pidió una función alguna vez: su texto no se cachea
+claves_con_funcion = CacheLRU(
+    max_items=settings.PROMPT_CACHE_MAX,
+    ttl_secs=settings.PROMPT_CACHE_DIAS * 86400,
+)
+
+# Clientes que ya hicieron cada pregunta (aún sin respuesta guardada)
+clientes_por_clave = CacheLRU(
+    max_items=settings.PROMPT_CACHE_MAX * 10,
+    ttl_secs=settings.PROMPT_CACHE_DIAS * 86400,
+)
+
+_contadores = {"hits_local": 0, "hits_supabase": 0, "misses": 0, "con_funcion": 0}
+
+# prompt_hash -> [hits, tokens ahorrados] aún no registrados en Supabase
+_hits_pendientes: Dict[str, List[int]] = {}
+_hits_lock = threading.Lock()
+_ultimo_vaciado = time.monotonic()
+
+
+def _ahora_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _fila_nueva(prompt_hash: str, prompt: str, respuesta: str, tokens: int) -> Dict:
+    return {
+        "prompt_hash": prompt_hash,
+        "original_prompt": prompt,
+        "cached_response": respuesta,
+        "model": MODELO,
+        "tokens_respuesta": tokens,
+        "expires_at": (datetime.now(timezone.utc) + timedelta(days=settings.PROMPT_CACHE_DIAS)).isoformat(),
+    }
+
+
+# ============================================================================
+# Hits en lote
+# ============================================================================
+
+def _registrar_hit(prompt_hash: str, tokens: int):
+    with _hits_lock:
+        pendiente = _hits_pendientes.setdefault(prompt_hash, [0, 0])
+        pendiente[0] += 1
+        pendiente[1] += tokens
+
+
+def _tomar_lote(forzar: bool = False) -> List[Dict]:
+    """Saca los hits pendientes si toca vaciar (por cantidad o por tiempo)"""
+    global _ultimo_vaciado
+    with _hits_lock:
+        if not _hits_pendientes:
+            return []
+        total = sum(h for h, _ in _hits_pendientes.values())
+        vencido = time.monotonic() - _ultimo_vaciado > settings.PROMPT_CACHE_VACIADO_SECS
+        if not (forzar or vencido or total >= settings.PROMPT_CACHE_VACIADO_HITS):
+            return []
+        lote = [
+            {"prompt_hash": h, "hits": hits, "tokens": tokens}
+            for h, (hits, tokens) in _hits_pendientes.items()
+        ]
+        _hits_pendientes.clear()
+        _ultimo_vaciado = time.monotonic()
+        return lote
+
+
+def _devolver_lote(lote: List[Dict]):
+    """Si falló el registro, los hits vuelven a quedar pendientes"""
+    for fila in lote:
+        with _hits_lock:
+            pendiente = _hits_pendientes.setdefault(fila["prompt_hash"], [0, 0])
+            pendiente[0] += fila["hits"]
+            pendiente[1] += fila["tokens"]
+
+
+def vaciar_hits(forzar: bool = False):
+    """Registra en Supabase los hits acumulados (una sola llamada RPC)"""
+    lote = _tomar_lote(forzar)
+    if not lote:
+        return
+    try:
+        from app.services.supabase import supabase
+        supabase.rpc("registrar_hits_prompt_cache", {"p_hits": lote}).execute()
+    except Exception as e:
+        print(f"⚠️ No se pudieron registrar hits de prompt_cache: {e}")
+        _devolver_lote(lote)
+
+
+async def vaciar_hits_async(forzar: bool = False):
+    """Versión async de vaciar_hits"""
+    lote = _tomar_lote(forzar)
+    if not lote:
+        return
+    try:
+        from app.services.supabase import obtener_supabase_async
+        supabase_async = await obtener_supabase_async()
+        await supabase_async.rpc("registrar_hits_prompt_cache", {"p_hits": lote}).execute()
+    except Exception as e:
+        print(f"⚠️ No se pudieron registrar hits de prompt_cache: {e}")
+        _devolver_lote(lote)
+
+
+_tareas: set = set()
+
+
+def _en_segundo_plano(coro):
+    """Lanza una escritura sin demorar la respuesta al cliente"""
+    tarea = asyncio.create_task(coro)
+    _tareas.add(tarea)
+    tarea.add_done_callback(_tareas.discard)
+
+
+# ============================================================================
+# Lectura / escritura
+# ============================================================================
+
+def _hit(prompt_hash: str, respuesta: str, tokens: int, nivel: str) -> str:
+    _contadores[nivel] += 1
+    _registrar_hit(prompt_hash, tokens)
+    print(f"⚡ Respuesta desde cache ({nivel.replace('hits_', '')})")
+    return respuesta
+
+
+def admite_respuesta(prompt_hash: str, respuesta: str, telefono: str = None) -> bool:
+    """
+    Si la respuesta de texto de este turno se puede guardar.
+
+    Args:
+        telefono: Cliente que hizo la pregunta (sin él no se sabe si la
+                  pregunta es de varios clientes y no se guarda)
+    """
+    if claves_con_funcion.obtener(prompt_hash) is not None:
+        return False
+    if not respuesta or RE_PRECIO_O_DIAS.search(respuesta) or not telefono:
+        return False
+    telefonos = clientes_por_clave.obtener(prompt_hash) or frozenset()
+    telefonos = telefonos | {telefono}
+    if len(telefonos) < settings.PROMPT_CACHE_MIN_TELEFONOS:
+        clientes_por_clave.guardar(prompt_hash, telefonos)
+        return False
+    clientes_por_clave.quitar(prompt_hash)
+    return True
+
+
+def _con_funcion(prompt_hash: str) -> bool:
+    if claves_con_funcion.obtener(prompt_hash) is None:
+        return False
+    _contadores["misses"] += 1
+    return True
+
+
+def buscar_respuesta(prompt_hash: str) -> Optional[str]:
+    """Busca la respuesta en memoria y luego en prompt_cache"""
+    if _con_funcion(prompt_hash):
+        return None
+    entrada = cache_local.obtener(prompt_hash)
+    if entrada is not None:
+        respuesta = _hit(prompt_hash, *entrada, "hits_local")
+        vaciar_hits()
+        return respuesta
+
+    try:
+        from app.services.supabase import supabase
+        response = supabase.table("prompt_cache")\
+            .select("cached_response, tokens_respuesta")\
+            .eq("prompt_hash", prompt_hash)\
+            .gt("expires_at", _ahora_iso())\
+            .limit(1)\
+            .execute()
+    except Exception as e:
+        print(f"⚠️ Error leyendo prompt_cache: {e}")
+        _contadores["misses"] += 1
+        return None
+
+    if not response.data:
+        _contadores["misses"] += 1
+        return None
+    fila = response.data[0]
+    entrada = (fila["cached_response"], fila.get("tokens_respuesta") or 0)
+    cache_local.guardar(prompt_hash, entrada)
+    respuesta = _hit(prompt_hash, *entrada, "hits_supabase")
+    vaciar_hits()
+    return respuesta
+
+
+async def buscar_respuesta_async(prompt_hash: str) -> Optional[str]:
+    """Versión async de buscar_respuesta"""
+    if _con_funcion(prompt_hash):
+        return None
+    entrada = cache_local.obtener(prompt_hash)
+    if entrada is not None:
+        respuesta = _hit(prompt_hash, *entrada, "hits_local")
+        _en_segundo_plano(vaciar_hits_async())
+        return respuesta
+
+    try:
+        from app.services.supabase import obtener_supabase_async
+        supabase_async = await obtener_supabase_async()
+        response = await supabase_async.table("prompt_cache")\
+            .select("cached_response, tokens_respuesta")\
+            .eq("prompt_hash", prompt_hash)\
+            .gt("expires_at", _ahora_iso())\
+            .limit(1)\
+            .execute()
+    except Exception as e:
+        print(f"⚠️ Error leyendo prompt_cache: {e}")
+        _contadores["misses"] += 1
+        return None
+
+    if not response.data:
+        _contadores["misses"] += 1
+        return None
+    fila = response.data[0]
+    entrada = (fila["cached_response"], fila.get("tokens_respuesta") or 0)
+    cache_local.guardar(prompt_hash, entrada)
+    respuesta = _hit(prompt_hash, *entrada, "hits_supabase")
+    _en_segundo_plano(vaciar_hits_async())
+    return respuesta
+
+
+def guardar_respuesta(prompt_hash: str, prompt: str, respuesta: str, tokens: int = 0, telefono: str = None):
+    """Guarda una respuesta nueva en ambos niveles (si admite_respuesta)"""
+    if not admite_respuesta(prompt_hash, respuesta, telefono):
+        return
+    cache_local.guardar(prompt_hash, (respuesta, tokens))
+    try:
+        from app.services.supabase import supabase
+        supabase.table("prompt_cache")\
+            .upsert(_fila_nueva(prompt_hash, prompt, respuesta, tokens), on_conflict="prompt_hash")\
+            .execute()
+    except Exception as e:
+        print(f"⚠️ Error guardando en prompt_cache: {e}")
+
+
+async def _guardar_supabase_async(prompt_hash: str, prompt: str, respuesta: str, tokens: int):
+    try:
+        from app.services.supabase import obtener_supabase_async
+        supabase_async = await obtener_supabase_async()
+        await supabase_async.table("prompt_cache")\
+            .upsert(_fila_nueva(prompt_hash, prompt, respuesta, tokens), on_conflict="prompt_hash")\
+            .execute()
+    except Exception as e:
+        print(f"⚠️ Error guardando en prompt_cache: {e}")
+
+
+def guardar_respuesta_async(prompt_hash: str, prompt: str, respuesta: str, tokens: int = 0, telefono: str = None):
+    """
+    Versión para el event loop de guardar_respuesta: el nivel en memoria se
+    actualiza al instante y prompt_cache en segundo plano.
+    """
+    if not admite_respuesta(prompt_hash, respuesta, telefono):
+        return
+    cache_local.guardar(prompt_hash, (respuesta, tokens))
+    _en_segundo_plano(_guardar_supabase_async(prompt_hash, prompt, respuesta, tokens))
+
+
+def _marcar(prompt_hash: str) -> bool:
+    """Marca la clave; True si es nueva (hay que borrar lo guardado)"""
+    if claves_con_funcion.obtener(prompt_hash) is not None:
+        return False
+    claves_con_funcion.guardar(prompt_hash, True)
+    cache_local.quitar(prompt_hash)
+    _contadores["con_funcion"] += 1
+    return True
+
+
+def marcar_con_funcion(prompt_hash: str):
+    """El turno pidió una función: la clave deja de cachearse"""
+    if not _marcar(prompt_hash):
+        return
+    try:
+        from app.services.supabase import supabase
+        supabase.table("prompt_cache").delete().eq("prompt_hash", prompt_hash).execute()
+    except Exception as e:
+        print(f"⚠️ Error borrando de prompt_cache: {e}")
+
+
+async def _borrar_supabase_async(prompt_hash: str):
+    try:
+        from app.services.supabase import obtener_supabase_async
+        supabase_async = await obtener_supabase_async()
+        await supabase_async.table("prompt_cache").delete().eq("prompt_hash", prompt_hash).execute()
+    except Exception as e:
+        print(f"⚠️ Error borrando de prompt_cache: {e}")
+
+
+def marcar_con_funcion_async(prompt_hash: str):
+    """Versión para el event loop de marcar_con_funcion (borra en segundo plano)"""
+    if _marcar(prompt_hash):
+        _en_segundo_plano(_borrar_supabase_async(prompt_hash))
+
+
+def estadisticas() -> Dict:
+    with _hits_lock:
+        pendientes = sum(h for h, _ in _hits_pendientes.values())
+    return {
+        **_contadores,
+        "entradas_local": len(cache_local),
+        "hits_sin_registrar": pendientes,
+    }
@@ -0,0 +1,212 @@
+"""
+Cache semántico (opcional) de preguntas frecuentes.
+
+El cache exacto (cache_respuestas.py) no reconoce paráfrasis: "cuanto es el
+dia", "precio por día?" y "a cuánto el día" son claves distintas. Aquí cada
+mensaje se convierte localmente en un vector TF-IDF de n-gramas de
+caracteres (sin modelos ni llamadas externas) y se compara contra un índice
+NumPy de preguntas ya respondidas. Si la similitud coseno supera el umbral,
+se responde sin llamar a OpenAI.
+
+Igual que en el cache exacto, cada par guarda el estado de la conversación
+(último mensaje del bot): solo compiten preguntas hechas en el mismo estado.
+Solo entran respuestas de turnos sin function calling y sin precios ni
+cantidad de días ("Son S/3 por 3 días"), que dependen del pedido del
+cliente: "quiero 5 dias" no debe responderse con el precio de 3.
+
+El índice se construye offline desde conversation_cache con
+`python construir_cache_semantico.py` y se carga al primer uso. Está
+desactivado por defecto (CACHE_SEMANTICO_ACTIVO); si NumPy no está
+instalado o el archivo no existe, también queda desactivado.
+"""
+
+import os
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.services.cache_respuestas import normalizar_mensaje, estado_conversacion, RE_PRECIO_O_DIAS
+
+try:
+    import numpy as np
+    NUMPY_DISPONIBLE = True
+except ImportError:
+    np = None
+    NUMPY_DISPONIBLE = False
+
+# Dimensión del vector (hashing trick: no hace falta guardar vocabulario)
+DIMENSION = 2048
+NGRAMAS = (2, 3, 4)
+
+
+def es_respuesta_indexable(respuesta: str) -> bool:
+    """Respuesta general (sin precio ni cantidad de días) que se puede reutilizar"""
+    return bool(respuesta) and not RE_PRECIO_O_DIAS.search(respuesta)
+
+
+def _ngramas(texto: str) -> List[str]:
+    """N-gramas de caracteres del texto normalizado (con bordes de palabra)"""
+    texto = f" {normalizar_mensaje(texto)} "
+    return [
+        texto[i:i + n]
+        for n in NGRAMAS
+        for i in range(len(texto) - n + 1)
+    ]
+
+
+def _conteos(textos: List[str]) -> "np.ndarray":
+    """Matriz (len(textos) x DIMENSION) de frecuencias de n-gramas"""
+    matriz = np.zeros((len(textos), DIMENSION), dtype=np.float32)
+    for fila, texto in enumerate(textos):
+        for ngrama in _ngramas(texto):
+            matriz[fila, zlib.crc32(ngrama.encode()) % DIMENSION] += 1
+    return matriz
+
+
+def _normalizar_filas(matriz: "np.ndarray") -> "np.ndarray":
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1
+    return matriz / normas
+
+
+def calcular_idf(textos: List[str]) -> "np.ndarray":
+    """IDF suavizado de cada posición del vector sobre el corpus de preguntas"""
+    presentes = (_conteos(textos) > 0).sum(axis=0)
+    return (np.log((1 + len(textos)) / (1 + presentes)) + 1).astype(np.float32)
+
+
+def vectorizar(textos: List[str], idf: "np.ndarray") -> "np.ndarray":
+    """Vectores TF-IDF normalizados (similitud coseno = producto punto)"""
+    conteos = _conteos(textos)
+    tf = np.log1p(conteos)
+    return _normalizar_filas(tf * idf)
+
+
+class IndiceSemantico:
+    """Pares (estado, pregunta) -> respuesta con sus vectores en una matriz NumPy"""
+
+    def __init__(self, estados: List[str], preguntas: List[str], respuestas: List[str],
+                 idf: "np.ndarray", matriz: "np.ndarray" = None):
+        self.estados = np.array(estados, dtype=str)
+        self.preguntas = list(preguntas)
+        self.respuestas = list(respuestas)
+        self.idf = idf
+        self.matriz = matriz if matriz is not None else vectorizar(self.preguntas, idf)
+
+    @classmethod
+    def construir(cls, ternas: List[Tuple[str, str, str]]) -> "IndiceSemantico":
+        """
+        Args:
+            ternas: [(estado, pregunta, respuesta)]; estado es
+                    estado_conversacion() del historial de la pregunta
+        """
+        preguntas = [p for _, p, _ in ternas]
+        return cls([e for e, _, _ in ternas], preguntas, [r for _, _, r in ternas], calcular_idf(preguntas))
+
+    def buscar(self, mensaje: str, estado: str = None) -> Optional[Tuple[str, float, str]]:
+        """
+        Args:
+            estado: Si se indica, solo se comparan los pares de ese estado
+
+        Returns:
+            (respuesta, similitud, pregunta_similar) del par más parecido,
+            o None si no hay pares (en ese estado)
+        """
+        if not self.preguntas:
+            return None
+        similitudes = self.matriz @ vectorizar([mensaje], self.idf)[0]
+        if estado is not None:
+            candidatos = self.estados == estado
+            if not candidatos.any():
+                return None
+            similitudes = np.where(candidatos, similitudes, -1.0)
+        mejor = int(np.argmax(similitudes))
+        return self.respuestas[mejor], float(similitudes[mejor]), self.preguntas[mejor]
+
+    def guardar(self, ruta: str):
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        np.savez_compressed(
+            ruta,
+            matriz=self.matriz,
+            idf=self.idf,
+            estados=self.estados,
+            preguntas=np.array(self.preguntas, dtype=str),
+            respuestas=np.array(self.respuestas, dtype=str),
+        )
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "IndiceSemantico":
+        with np.load(ruta) as datos:
+            return cls(
+                datos["estados"].tolist(),
+                datos["preguntas"].tolist(),
+                datos["respuestas"].tolist(),
+                datos["idf"],
+                datos["matriz"],
+            )
+
+    def __len__(self):
+        return len(self.preguntas)
+
+
+_indice: Optional[IndiceSemantico] = None
+_cargado = False
+_lock = threading.Lock()
+_contadores = {"hits": 0, "misses": 0}
+
+
+def obtener_indice_semantico() -> Optional[IndiceSemantico]:
+    """Carga el índice la primera vez (None si está desactivado o no existe)"""
+    global _indice, _cargado
+    if _cargado:
+        return _indice
+    with _lock:
+        if _cargado:
+            return _indice
+        _cargado = True
+        ruta = settings.CACHE_SEMANTICO_RUTA
+        if not settings.CACHE_SEMANTICO_ACTIVO:
+            return None
+        if not NUMPY_DISPONIBLE:
+            print("⚠️ Cache semántico desactivado: numpy no está instalado")
+            return None
+        if not os.path.exists(ruta):
+            print(f"⚠️ Cache semántico desactivado: no existe {ruta} (ver construir_cache_semantico.py)")
+            return None
+        try:
+            _indice = IndiceSemantico.cargar(ruta)
+            print(f"🧠 Cache semántico cargado: {len(_indice)} preguntas frecuentes")
+        except KeyError:
+            print(f"⚠️ Cache semántico desactivado: {ruta} es de una versión anterior, regenerarlo con construir_cache_semantico.py")
+        except Exception as e:
+            print(f"❌ Error cargando cache semántico: {e}")
+        return _indice
+
+
+def buscar_respuesta_similar(mensaje: str, history: List[Dict] = None) -> Optional[str]:
+    """
+    Respuesta de una pregunta frecuente parecida al mensaje, hecha en el
+    mismo estado de la conversación, si la similitud supera
+    CACHE_SEMANTICO_UMBRAL.
+    """
+    indice = obtener_indice_semantico()
+    if indice is None:
+        return None
+
+    resultado = indice.buscar(mensaje, estado_conversacion(history))
+    if resultado is None or resultado[1] < settings.CACHE_SEMANTICO_UMBRAL:
+        _contadores["misses"] += 1
+        return None
+
+    respuesta, similitud, pregunta = resultado
+    _contadores["hits"] += 1
+    print(f"🧠 Respuesta semántica ({similitud:.2f} con '{pregunta}')")
+    return respuesta
+
+
+def estadisticas() -> Dict:
+    return {
+        **_contadores,
+        "activo": _indice is not None,
+        "preguntas": len(_indice) if _indice is not None else 0,
+    }
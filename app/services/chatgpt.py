@@ -4,16 +4,134 @@ Proporciona respuestas conversacionales para clientes con cache e historial
 """
 
 import hashlib
+import json
+import re
+import time
 from datetime import datetime
-from typing import Optional, Dict, List
-from openai import OpenAI, RateLimitError, APIError
+from types import SimpleNamespace
+from typing import Callable, Optional, Dict, List
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIError
 from app.core.config import settings
+from app.core.metricas import latencias
+from app.services.cache_respuestas import (
+    MODELO,
+    clave_prompt,
+    buscar_respuesta,
+    buscar_respuesta_async,
+    guardar_respuesta,
+    guardar_respuesta_async,
+    marcar_con_funcion,
+    marcar_con_funcion_async,
+)
+from app.services.cache_semantico import buscar_respuesta_similar
+from app.services.buffer_escritura import buffer_conversaciones
+from app.services.costos_ai import uso_ai
+from app.services.historial import construir_historial
 
-# Cliente OpenAI (API v1.0+)
+# Clientes OpenAI (API v1.0+). Ambos reutilizan su pool de conexiones HTTP.
 client = OpenAI(api_key=settings.OPENAI_API_KEY)
+aclient = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+
+# Sistema prompt para conversación natural con cliente
+SYSTEM_PROMPT = """Eres asistente de ventas de internet ISP. Habla naturalmente como vendedor peruano.
+
+PLANES: S/1 por día (ej: 5 días = S/5, 7 días = S/7, 30 días = S/30)
+
+PRIMERO SIEMPRE PREGUNTA:
+- Si el cliente NO menciona su usuario → Pregunta: "¿Ya eres cliente o eres nuevo?"
+- Si dice que es NUEVO → Sigue flujo de nuevos
+- Si dice que YA ES CLIENTE o menciona su usuario → Sigue flujo de existentes
+
+FLUJO PARA NUEVOS CLIENTES:
+1. Ya confirmó que es nuevo
+2. Pregunta nombre completo
+3. Pregunta usuario deseado (ej: ricky3)
+4. Pregunta zona (Centro/Goza/Cocha)
+5. Di: "Perfecto! Te creo tu usuario con 1 día GRATIS para que pruebes el servicio 🎁"
+6. USA la función crear_usuario_nuevo con los datos
+
+FLUJO PARA CLIENTES EXISTENTES (IMPORTANTE):
+1. Si NO mencionó su usuario → Pregunta: "¿Cuál es tu usuario?"
+2. Si SÍ mencionó usuario (ej: "mi usuario es pepa") → USA función buscar_usuario_existente
+3. Después de encontrar usuario, pregunta: "¿Cuántos días quieres recargar?"
+4. Cliente responde cantidad (ej: "5 días", "quiero 3", etc)
+5. OBLIGATORIO: USA función registrar_pedido(usuario=X, dias=Y)
+   - La función responderá automáticamente al cliente
+   - NO respondas con texto, SOLO llama la función
+6. Cliente envía foto → Sistema guarda automáticamente
+7. Admin aprueba en Telegram → Se activan los días
+
+CRÍTICO: Cuando cliente dice cantidad de días, SIEMPRE llamar registrar_pedido, NUNCA responder con texto.
+
+REGLAS CRÍTICAS:
+- USA registrar_pedido cuando el cliente dice cuántos días quiere
+- NO actives internet automáticamente, solo registra el pedido
+- Los días se activan SOLO cuando el admin aprueba el pago en Telegram
+- Sé natural, cercano, usa emojis
+- Máximo 3 líneas por respuesta
+
+SOPORTE TÉCNICO:
+- Si el cliente tiene problemas técnicos (no puede conectar, lento, etc)
+- Dile: "Para soporte técnico escríbenos al +51987654321 📲"
+- NO intentes resolver problemas técnicos, solo deriva al número
+- Ejemplos de problemas: "no me conecta", "está lento", "se cae", "no carga" """
+
+# Definir funciones disponibles para ChatGPT
+FUNCIONES = [
+    {
+        "name": "crear_usuario_nuevo",
+        "description": "Crea un usuario nuevo en el sistema MikroTik con 3 días gratis",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "nombre_completo": {
+                    "type": "string",
+                    "description": "Nombre completo del cliente"
+                },
+                "usuario": {
+                    "type": "string",
+                    "description": "Nombre de usuario elegido (ej: ricky3)"
+                },
+                "zona": {
+                    "type": "string",
+                    "description": "Zona del cliente (Centro, Goza, Cocha, etc)"
+                }
+            },
+            "required": ["nombre_completo", "usuario", "zona"]
+        }
+    },
+    {
+        "name": "buscar_usuario_existente",
+        "description": "Busca un usuario existente en el sistema",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "usuario": {
+                    "type": "string",
+                    "description": "Nombre de usuario a buscar"
+                }
+            },
+            "required": ["usuario"]
+        }
+    },
+    {
+        "name": "registrar_pedido",
+        "description": "LLAMAR SIEMPRE cuando cliente dice cuántos días quiere (ej: '5 días', 'quiero 3', '7 dias'). Esta función guarda el pedido y responde automáticamente. NO respondas con texto después de llamar esta función.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "dias": {
+                    "type": "integer",
+                    "description": "Cantidad de días que el cliente quiere comprar"
+                }
+            },
+            "required": ["dias"]
+        }
+    }
+]
 
 # ============================================================================
-# FUNCIONES AUXILIARES PARA CACHE (Sin BD por ahora - comentadas para futuro)
+# FUNCIONES AUXILIARES PARA CACHE
 # ============================================================================
 
 def _generate_prompt_hash(prompt: str) -> str:
@@ -21,6 +139,15 @@ def _generate_prompt_hash(prompt: str) -> str:
     return hashlib.sha256(prompt.encode()).hexdigest()
 
 
+def _historial_desde_filas(filas: List[Dict]) -> List[Dict]:
+    """Convierte filas de conversation_cache (más reciente primero) a formato ChatGPT"""
+    history = []
+    for msg in reversed(filas):  # Invertir para orden cronológico
+        history.append({"role": "user", "content": msg["user_message"]})
+        history.append({"role": "assistant", "content": msg["ai_response"]})
+    return history
+
+
 def _get_conversation_history(phone_number: str, limit: int = 5) -> List[Dict]:
     """
     Obtiene el historial de conversación reciente del cliente desde Supabase.
@@ -44,20 +171,148 @@ def _get_conversation_history(phone_number: str, limit: int = 5) -> List[Dict]:
             .limit(limit)\
             .execute()
         
-        if not response.data:
-            return []
-        
-        # Convertir a formato ChatGPT (más reciente al final)
-        history = []
-        for msg in reversed(response.data):  # Invertir para orden cronológico
-            history.append({"role": "user", "content": msg["user_message"]})
-            history.append({"role": "assistant", "content": msg["ai_response"]})
-        
-        return history
+        return _historial_desde_filas(response.data or [])
     except Exception as e:
         print(f"Error obteniendo historial: {e}")
         return []
 
+
+def _construir_mensajes(mensaje_usuario: str, history: List[Dict]) -> List[Dict]:
+    """System prompt + historial + mensaje actual"""
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    
+    # Agregar historial de conversación si existe
+    if history:
+        print(f"📚 Historial recuperado: {len(history)} mensajes previos")
+        messages.extend(history)
+    
+    # Agregar mensaje actual
+    messages.append({"role": "user", "content": mensaje_usuario})
+    
+    print(f"💬 Total mensajes a ChatGPT: {len(messages)} (system + historial + actual)")
+    return messages
+
+
+def _parametros_completion(messages: List[Dict]) -> Dict:
+    return dict(
+        model=MODELO,
+        messages=messages,
+        functions=FUNCIONES,
+        function_call="auto",
+        temperature=0.7,
+        max_tokens=150,
+    )
+
+
+def _interpretar_respuesta(response) -> dict:
+    """Convierte la respuesta de OpenAI al dict {respuesta, accion, datos, tokens_used, uso}"""
+    message = response.choices[0].message
+    usage = getattr(response, "usage", None)
+    tokens_used = usage.total_tokens if usage else 0
+    uso = {
+        "modelo": getattr(response, "model", None) or MODELO,
+        "input_tokens": usage.prompt_tokens if usage else 0,
+        "output_tokens": usage.completion_tokens if usage else 0,
+    }
+    
+    # Si ChatGPT quiere llamar una función
+    if message.function_call:
+        function_name = message.function_call.name
+        function_args = json.loads(message.function_call.arguments)
+        
+        print(f"🤖 ChatGPT llama función: {function_name} con {function_args}")
+        
+        return {
+            "respuesta": None,  # Se generará después de ejecutar la función
+            "accion": function_name,
+            "datos": function_args,
+            "tokens_used": tokens_used,
+            "uso": uso
+        }
+    
+    # Respuesta normal sin función
+    response_text = message.content
+    print(f"✅ ChatGPT respondió: {response_text[:50]}...")
+    
+    return {
+        "respuesta": response_text,
+        "accion": None,
+        "datos": None,
+        "tokens_used": tokens_used,
+        "uso": uso
+    }
+
+
+def _clave_cache(mensaje_usuario: str, history: List[Dict]):
+    """(prompt, prompt_hash) del mensaje, o (None, None) si no es cacheable"""
+    prompt = clave_prompt(mensaje_usuario, history)
+    return (prompt, _generate_prompt_hash(prompt)) if prompt else (None, None)
+
+
+def _respuesta_cacheada(texto: str) -> dict:
+    return {
+        "respuesta": texto,
+        "accion": None,
+        "datos": None,
+        "tokens_used": 0,
+        "cacheada": True
+    }
+
+
+def _registrar_uso(phone_number: Optional[str], resultado: dict, latencia_secs: float = None):
+    """Tokens reales, latencia, cache y función de la respuesta (ver costos_ai.py)"""
+    uso = resultado.get("uso") or {}
+    uso_ai.registrar(
+        phone_number,
+        uso.get("modelo", MODELO),
+        input_tokens=uso.get("input_tokens", 0),
+        output_tokens=uso.get("output_tokens", 0),
+        latencia_secs=latencia_secs,
+        cacheada=bool(resultado.get("cacheada")),
+        funcion=resultado.get("accion"),
+    )
+
+
+def _actualizar_cache(prompt: str, prompt_hash: str, resultado: dict, phone_number: str = None):
+    """
+    Solo se cachean turnos sin function calling: si el turno pidió una
+    función, su clave queda marcada y ya no se sirve desde cache. El texto
+    se guarda cuando varios clientes hicieron la misma pregunta (ver
+    cache_respuestas.admite_respuesta).
+    """
+    if resultado["accion"]:
+        marcar_con_funcion(prompt_hash)
+    elif resultado["respuesta"]:
+        guardar_respuesta(prompt_hash, prompt, resultado["respuesta"], resultado["tokens_used"], phone_number)
+
+
+def _actualizar_cache_async(prompt: str, prompt_hash: str, resultado: dict, phone_number: str = None):
+    """Versión para el event loop de _actualizar_cache (Supabase en segundo plano)"""
+    if resultado["accion"]:
+        marcar_con_funcion_async(prompt_hash)
+    elif resultado["respuesta"]:
+        guardar_respuesta_async(prompt_hash, prompt, resultado["respuesta"], resultado["tokens_used"], phone_number)
+
+
+def _respuesta_error(e: Exception) -> dict:
+    """Respuesta para el cliente cuando falla OpenAI"""
+    if isinstance(e, RateLimitError):
+        print("❌ Rate limit de OpenAI excedido")
+        texto = "Estoy recibiendo muchas solicitudes. Intenta en un momento."
+    elif isinstance(e, APIError):
+        print(f"❌ Error de API OpenAI: {e}")
+        texto = "Tengo un problema técnico. Intenta más tarde."
+    else:
+        print(f"❌ Error en ChatGPT: {e}")
+        texto = "Lo siento, tengo un problema técnico. Intenta de nuevo."
+    
+    return {
+        "respuesta": texto,
+        "accion": None,
+        "datos": None
+    }
+
+
 def obtener_respuesta_chatgpt(mensaje_usuario: str, phone_number: str = None) -> dict:
     """
     Obtiene respuesta de ChatGPT para un mensaje del usuario.
@@ -75,226 +330,187 @@ def obtener_respuesta_chatgpt(mensaje_usuario: str, phone_number: str = None) ->
         }
     """
     try:
-        # Sistema prompt para conversación natural con cliente
-        system_prompt = """Eres asistente de ventas de internet ISP. Habla naturalmente como vendedor peruano.
+        history = _get_conversation_history(phone_number, limit=5) if phone_number else []
+        
+        # Preguntas repetidas (ej: "cuánto cuesta") o parecidas ("a cuánto el día")
+        # se responden desde cache
+        prompt, prompt_hash = _clave_cache(mensaje_usuario, history)
+        if prompt_hash:
+            cacheada = buscar_respuesta(prompt_hash) or buscar_respuesta_similar(mensaje_usuario, history)
+            if cacheada is not None:
+                resultado = _respuesta_cacheada(cacheada)
+                _registrar_uso(phone_number, resultado)
+                return resultado
+        
+        messages = _construir_mensajes(mensaje_usuario, history)
+        
+        inicio = time.perf_counter()
+        response = client.chat.completions.create(**_parametros_completion(messages))
+        resultado = _interpretar_respuesta(response)
+        _registrar_uso(phone_number, resultado, time.perf_counter() - inicio)
+        if prompt_hash:
+            _actualizar_cache(prompt, prompt_hash, resultado, phone_number)
+        return resultado
+    
+    except Exception as e:
+        return _respuesta_error(e)
 
-PLANES: S/1 por día (ej: 5 días = S/5, 7 días = S/7, 30 días = S/30)
 
-PRIMERO SIEMPRE PREGUNTA:
-- Si el cliente NO menciona su usuario → Pregunta: "¿Ya eres cliente o eres nuevo?"
-- Si dice que es NUEVO → Sigue flujo de nuevos
-- Si dice que YA ES CLIENTE o menciona su usuario → Sigue flujo de existentes
+async def obtener_respuesta_chatgpt_async(mensaje_usuario: str, phone_number: str = None, estado=None) -> dict:
+    """
+    Versión async de obtener_respuesta_chatgpt (AsyncOpenAI).
+    Mismo prompt, mismas funciones y mismo formato de retorno.
+    
+    El historial sale del buffer en memoria del cliente, recortado al
+    presupuesto de tokens y con el resumen de los turnos viejos
+    (ver app/services/historial.py).
+    
+    Args:
+        estado: EstadoConversacion del cliente (opcional)
+    """
+    try:
+        history = await construir_historial(phone_number, estado) if phone_number else []
+        
+        prompt, prompt_hash = _clave_cache(mensaje_usuario, history)
+        if prompt_hash:
+            cacheada = await buscar_respuesta_async(prompt_hash) or buscar_respuesta_similar(mensaje_usuario, history)
+            if cacheada is not None:
+                resultado = _respuesta_cacheada(cacheada)
+                _registrar_uso(phone_number, resultado)
+                return resultado
+        
+        messages = _construir_mensajes(mensaje_usuario, history)
+        
+        inicio = time.perf_counter()
+        response = await aclient.chat.completions.create(**_parametros_completion(messages))
+        resultado = _interpretar_respuesta(response)
+        _registrar_uso(phone_number, resultado, time.perf_counter() - inicio)
+        if prompt_hash:
+            _actualizar_cache_async(prompt, prompt_hash, resultado, phone_number)
+        return resultado
+    
+    except Exception as e:
+        return _respuesta_error(e)
 
-FLUJO PARA NUEVOS CLIENTES:
-1. Ya confirmó que es nuevo
-2. Pregunta nombre completo
-3. Pregunta usuario deseado (ej: ricky3)
-4. Pregunta zona (Centro/Goza/Cocha)
-5. Di: "Perfecto! Te creo tu usuario con 1 día GRATIS para que pruebes el servicio 🎁"
-6. USA la función crear_usuario_nuevo con los datos
 
-FLUJO PARA CLIENTES EXISTENTES (IMPORTANTE):
-1. Si NO mencionó su usuario → Pregunta: "¿Cuál es tu usuario?"
-2. Si SÍ mencionó usuario (ej: "mi usuario es pepa") → USA función buscar_usuario_existente
-3. Después de encontrar usuario, pregunta: "¿Cuántos días quieres recargar?"
-4. Cliente responde cantidad (ej: "5 días", "quiero 3", etc)
-5. OBLIGATORIO: USA función registrar_pedido(usuario=X, dias=Y)
-   - La función responderá automáticamente al cliente
-   - NO respondas con texto, SOLO llama la función
-6. Cliente envía foto → Sistema guarda automáticamente
-7. Admin aprueba en Telegram → Se activan los días
+# Campos ya completos dentro de los argumentos parciales de una función
+RE_ARG_TEXTO = re.compile(r'"(\w+)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+RE_ARG_NUMERO = re.compile(r'"(\w+)"\s*:\s*(-?\d+)\s*[,}]')
 
-CRÍTICO: Cuando cliente dice cantidad de días, SIEMPRE llamar registrar_pedido, NUNCA responder con texto.
 
-REGLAS CRÍTICAS:
-- USA registrar_pedido cuando el cliente dice cuántos días quiere
-- NO actives internet automáticamente, solo registra el pedido
-- Los días se activan SOLO cuando el admin aprueba el pago en Telegram
-- Sé natural, cercano, usa emojis
-- Máximo 3 líneas por respuesta
+def _argumentos_parciales(argumentos: str) -> Dict:
+    """
+    Argumentos de una function call que todavía se está generando: solo
+    los campos cuyo valor ya llegó completo.
+    """
+    try:
+        return json.loads(argumentos)
+    except ValueError:
+        pass
+    datos = {campo: valor for campo, valor in RE_ARG_TEXTO.findall(argumentos)}
+    datos.update({campo: int(valor) for campo, valor in RE_ARG_NUMERO.findall(argumentos)})
+    return datos
 
-SOPORTE TÉCNICO:
-- Si el cliente tiene problemas técnicos (no puede conectar, lento, etc)
-- Dile: "Para soporte técnico escríbenos al +51987654321 📲"
-- NO intentes resolver problemas técnicos, solo deriva al número
-- Ejemplos de problemas: "no me conecta", "está lento", "se cae", "no carga" """
 
-        # Definir funciones disponibles para ChatGPT
-        functions = [
-            {
-                "name": "crear_usuario_nuevo",
-                "description": "Crea un usuario nuevo en el sistema MikroTik con 3 días gratis",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "nombre_completo": {
-                            "type": "string",
-                            "description": "Nombre completo del cliente"
-                        },
-                        "usuario": {
-                            "type": "string",
-                            "description": "Nombre de usuario elegido (ej: ricky3)"
-                        },
-                        "zona": {
-                            "type": "string",
-                            "description": "Zona del cliente (Centro, Goza, Cocha, etc)"
-                        }
-                    },
-                    "required": ["nombre_completo", "usuario", "zona"]
-                }
-            },
-            {
-                "name": "buscar_usuario_existente",
-                "description": "Busca un usuario existente en el sistema",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "usuario": {
-                            "type": "string",
-                            "description": "Nombre de usuario a buscar"
-                        }
-                    },
-                    "required": ["usuario"]
-                }
-            },
-            {
-                "name": "registrar_pedido",
-                "description": "LLAMAR SIEMPRE cuando cliente dice cuántos días quiere (ej: '5 días', 'quiero 3', '7 dias'). Esta función guarda el pedido y responde automáticamente. NO respondas con texto después de llamar esta función.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "dias": {
-                            "type": "integer",
-                            "description": "Cantidad de días que el cliente quiere comprar"
-                        }
-                    },
-                    "required": ["dias"]
-                }
-            }
-        ]
-        
-        # Construir mensajes con historial
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Agregar historial de conversación si existe
-        if phone_number:
-            history = _get_conversation_history(phone_number, limit=5)
-            if history:
-                print(f"📚 Historial recuperado: {len(history)} mensajes previos")
-            messages.extend(history)
+async def obtener_respuesta_chatgpt_streaming_async(
+    mensaje_usuario: str,
+    phone_number: str = None,
+    estado=None,
+    al_detectar_funcion: Callable[[str, Dict], None] = None
+) -> dict:
+    """
+    Igual que obtener_respuesta_chatgpt_async (mismo prompt, funciones,
+    cache y formato de retorno) pero leyendo la respuesta en streaming.
+    
+    La function call se detecta en los primeros chunks: apenas llega el
+    nombre, y cada vez que un argumento termina de llegar, se llama a
+    `al_detectar_funcion(nombre, datos_parciales)`. Así el webhook puede
+    empezar la búsqueda en MikroTik mientras el modelo sigue generando.
+    
+    Args:
+        al_detectar_funcion: Callback síncrono (no debe bloquear el event loop)
+    """
+    try:
+        history = await construir_historial(phone_number, estado) if phone_number else []
         
-        # Agregar mensaje actual
-        messages.append({"role": "user", "content": mensaje_usuario})
+        prompt, prompt_hash = _clave_cache(mensaje_usuario, history)
+        if prompt_hash:
+            cacheada = await buscar_respuesta_async(prompt_hash) or buscar_respuesta_similar(mensaje_usuario, history)
+            if cacheada is not None:
+                resultado = _respuesta_cacheada(cacheada)
+                _registrar_uso(phone_number, resultado)
+                return resultado
         
-        print(f"💬 Total mensajes a ChatGPT: {len(messages)} (system + historial + actual)")
+        messages = _construir_mensajes(mensaje_usuario, history)
         
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            functions=functions,
-            function_call="auto",
-            temperature=0.7,
-            max_tokens=150,
+        inicio = time.perf_counter()
+        stream = await aclient.chat.completions.create(
+            **_parametros_completion(messages),
+            stream=True,
+            stream_options={"include_usage": True},
         )
         
-        message = response.choices[0].message
+        textos: List[str] = []
+        funcion, argumentos = "", ""
+        modelo, usage = None, None
+        avisados = set()
         
-        # Si ChatGPT quiere llamar una función
-        if message.function_call:
-            import json
-            function_name = message.function_call.name
-            function_args = json.loads(message.function_call.arguments)
+        async for chunk in stream:
+            modelo = modelo or getattr(chunk, "model", None)
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
             
-            print(f"🤖 ChatGPT llama función: {function_name} con {function_args}")
+            if not textos and not funcion:
+                latencias.registrar("openai.primer_chunk", time.perf_counter() - inicio)
             
-            return {
-                "respuesta": None,  # Se generará después de ejecutar la función
-                "accion": function_name,
-                "datos": function_args
-            }
+            delta = chunk.choices[0].delta
+            if delta.content:
+                textos.append(delta.content)
+            
+            if delta.function_call:
+                funcion += delta.function_call.name or ""
+                argumentos += delta.function_call.arguments or ""
+                
+                if al_detectar_funcion and funcion:
+                    datos = _argumentos_parciales(argumentos)
+                    clave = (funcion, tuple(sorted(datos.items())))
+                    if clave not in avisados:
+                        if not avisados:
+                            latencias.registrar("openai.funcion_detectada", time.perf_counter() - inicio)
+                        avisados.add(clave)
+                        al_detectar_funcion(funcion, datos)
         
-        # Respuesta normal sin función
-        response_text = message.content
-        print(f"✅ ChatGPT respondió: {response_text[:50]}...")
+        # Misma forma que una respuesta sin streaming para reutilizar _interpretar_respuesta
+        message = SimpleNamespace(
+            content="".join(textos),
+            function_call=SimpleNamespace(name=funcion, arguments=argumentos or "{}") if funcion else None,
+        )
+        response = SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage, model=modelo)
         
-        return {
-            "respuesta": response_text,
-            "accion": None,
-            "datos": None
-        }
-    
-    except RateLimitError:
-        print("❌ Rate limit de OpenAI excedido")
-        return {
-            "respuesta": "Estoy recibiendo muchas solicitudes. Intenta en un momento.",
-            "accion": None,
-            "datos": None
-        }
-    
-    except APIError as e:
-        print(f"❌ Error de API OpenAI: {e}")
-        return {
-            "respuesta": "Tengo un problema técnico. Intenta más tarde.",
-            "accion": None,
-            "datos": None
-        }
+        resultado = _interpretar_respuesta(response)
+        _registrar_uso(phone_number, resultado, time.perf_counter() - inicio)
+        if prompt_hash:
+            _actualizar_cache_async(prompt, prompt_hash, resultado, phone_number)
+        return resultado
     
     except Exception as e:
-        print(f"❌ Error en ChatGPT: {e}")
-        return {
-            "respuesta": "Lo siento, tengo un problema técnico. Intenta de nuevo.",
-            "accion": None,
-            "datos": None
-        }
+        return _respuesta_error(e)
 
 
-def obtener_respuesta_chatgpt_streaming(mensaje_usuario: str):
-    """
-    Obtiene respuesta de ChatGPT con streaming (para futuro uso en WebSockets).
-    Usa prompt optimizado igual que la versión no-streaming.
-    
-    Args:
-        mensaje_usuario: Texto del mensaje del cliente
-    
-    Yields:
-        Chunks de la respuesta
-    """
-    try:
-        stream = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "system",
-                    "content": """Eres Bot ISP, asistente de internet amable y breve.
-Vende planes (hora, día, mes). Para compras, pide foto del comprobante.
-Responde en 1-2 líneas máximo. Sé directo."""
-                },
-                {
-                    "role": "user",
-                    "content": mensaje_usuario
-                }
-            ],
-            temperature=0.7,
-            max_tokens=120,
-            stream=True,
-        )
-        
-        for chunk in stream:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
-    
-    except RateLimitError:
-        yield "❌ Estoy recibiendo muchas solicitudes. Intenta en un momento."
-    except APIError as e:
-        yield f"❌ Error técnico: {str(e)}"
-    except Exception as e:
-        yield f"❌ Error: {str(e)}"
-    except Exception as e:
-        print(f"❌ Error en ChatGPT streaming: {e}")
-        yield "Lo siento, tengo un problema técnico."
+def _fila_conversacion(phone_number: str, user_message: str, ai_response: str, tokens_used: int, funcion: str = None) -> Dict:
+    return {
+        "phone_number": phone_number,
+        "user_message": user_message,
+        "ai_response": ai_response,
+        "tokens_used": tokens_used,
+        # Los turnos con función no entran al cache semántico (construir_cache_semantico.py)
+        "conversation_topic": funcion or "general"
+    }
 
 
-def guardar_conversacion_cache(phone_number: str, user_message: str, ai_response: str, tokens_used: int = 0):
+def guardar_conversacion_cache(phone_number: str, user_message: str, ai_response: str, tokens_used: int = 0, funcion: str = None):
     """
     Guarda la conversación en Supabase para cache/historial.
     
@@ -303,16 +519,32 @@ def guardar_conversacion_cache(phone_number: str, user_message: str, ai_response
         user_message: Mensaje del usuario
         ai_response: Respuesta de la IA
         tokens_used: Tokens consumidos (opcional)
+        funcion: Acción que ejecutó el turno (opcional, ej: "registrar_pedido")
     """
     try:
         from app.services.supabase import supabase
         
-        supabase.table("conversation_cache").insert({
-            "phone_number": phone_number,
-            "user_message": user_message,
-            "ai_response": ai_response,
-            "tokens_used": tokens_used,
-            "conversation_topic": "general"
-        }).execute()
+        supabase.table("conversation_cache").insert(
+            _fila_conversacion(phone_number, user_message, ai_response, tokens_used, funcion)
+        ).execute()
+    except Exception as e:
+        print(f"Error guardando cache de conversación: {e}")
+
+
+async def guardar_conversacion_cache_async(phone_number: str, user_message: str, ai_response: str, tokens_used: int = 0, funcion: str = None):
+    """
+    Versión async de guardar_conversacion_cache.
+    
+    La fila va al buffer de escritura diferida (se inserta en lote); si el
+    buffer no está activo se inserta directamente.
+    """
+    fila = _fila_conversacion(phone_number, user_message, ai_response, tokens_used, funcion)
+    if buffer_conversaciones.agregar(fila):
+        return
+    try:
+        from app.services.supabase import obtener_supabase_async
+        
+        supabase_async = await obtener_supabase_async()
+        await supabase_async.table("conversation_cache").insert(fila).execute()
     except Exception as e:
         print(f"Error guardando cache de conversación: {e}")
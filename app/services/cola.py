@@ -0,0 +1,159 @@
+"""
+Cola de trabajos en segundo plano para los webhooks.
+
+El endpoint solo valida y encola; un grupo acotado de workers asyncio
+procesa cada trabajo. Si la función de proceso es async se espera
+directamente en el event loop; si es síncrona se ejecuta en un hilo con
+asyncio.to_thread para no bloquearlo.
+
+Con `clave` la cola se divide en carriles: cada trabajo va al carril
+hash(clave) % workers y cada carril tiene un único worker. Así los mensajes
+de un mismo cliente se procesan estrictamente en orden (sin pisarse el
+contexto de conversación) mientras clientes distintos avanzan en paralelo.
+El orden se garantiza dentro de un proceso: con varios procesos de uvicorn
+cada uno tiene sus propios carriles.
+"""
+
+import asyncio
+import time
+import zlib
+from typing import Any, Callable, Dict, List
+from app.core.metricas import latencias
+
+
+class ColaTrabajos:
+    """
+    Cola acotada + N workers (compartida o por carriles).
+
+    Args:
+        nombre: Nombre para logs y métricas (ej: "whatsapp")
+        procesar: Función (async o síncrona) que recibe el trabajo (dict)
+        workers: Cantidad de workers concurrentes (= carriles si hay clave)
+        maxsize: Trabajos máximos en espera (repartidos entre carriles)
+        clave: Función que extrae del trabajo la clave de orden
+               (ej: el número del cliente). None = cola compartida sin orden.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        procesar: Callable[[Dict], Any],
+        workers: int = 4,
+        maxsize: int = 500,
+        clave: Callable[[Dict], str] = None
+    ):
+        self.nombre = nombre
+        self.procesar = procesar
+        self._es_async = asyncio.iscoroutinefunction(procesar)
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.clave = clave
+
+        self._colas: List[asyncio.Queue] = []
+        self._tareas: List[asyncio.Task] = []
+        self._en_proceso = 0
+        self._procesados = 0
+        self._errores = 0
+        self._rechazados = 0
+
+    @property
+    def activa(self) -> bool:
+        return bool(self._colas) and bool(self._tareas)
+
+    def iniciar(self):
+        """Crea la(s) cola(s) y lanza los workers (llamar dentro del event loop)"""
+        if self.activa:
+            return
+        if self.clave:
+            por_carril = max(1, self.maxsize // self.workers)
+            self._colas = [asyncio.Queue(maxsize=por_carril) for _ in range(self.workers)]
+        else:
+            self._colas = [asyncio.Queue(maxsize=self.maxsize)]
+        self._tareas = [
+            asyncio.create_task(
+                self._worker(i, self._colas[i % len(self._colas)]),
+                name=f"{self.nombre}-worker-{i}"
+            )
+            for i in range(self.workers)
+        ]
+        modo = "carriles por clave" if self.clave else "cola compartida"
+        print(f"🧵 Cola '{self.nombre}' iniciada con {self.workers} workers ({modo})")
+
+    async def detener(self, timeout_secs: float = 10):
+        """Espera a que se vacíen las colas (con timeout) y detiene los workers"""
+        if not self.activa:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(cola.join() for cola in self._colas)),
+                timeout=timeout_secs
+            )
+        except asyncio.TimeoutError:
+            print(f"⚠️ Cola '{self.nombre}': {self.profundidad()} trabajos sin procesar al detener")
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+    def _cola_para(self, trabajo: Dict) -> asyncio.Queue:
+        if not self.clave:
+            return self._colas[0]
+        clave = str(self.clave(trabajo) or "")
+        # crc32 es estable entre reinicios (hash() de str no lo es)
+        return self._colas[zlib.crc32(clave.encode()) % len(self._colas)]
+
+    def encolar(self, trabajo: Dict) -> bool:
+        """
+        Encola un trabajo sin esperar.
+
+        Returns:
+            True si quedó encolado, False si la cola no está activa o está llena
+        """
+        if not self.activa:
+            return False
+        try:
+            self._cola_para(trabajo).put_nowait((time.perf_counter(), trabajo))
+            return True
+        except asyncio.QueueFull:
+            self._rechazados += 1
+            print(f"⚠️ Cola '{self.nombre}' llena")
+            return False
+
+    async def _worker(self, numero: int, cola: asyncio.Queue):
+        while True:
+            encolado_en, trabajo = await cola.get()
+            inicio = time.perf_counter()
+            latencias.registrar(f"{self.nombre}.espera", inicio - encolado_en)
+            self._en_proceso += 1
+            try:
+                if self._es_async:
+                    await self.procesar(trabajo)
+                else:
+                    await asyncio.to_thread(self.procesar, trabajo)
+                self._procesados += 1
+            except Exception as e:
+                self._errores += 1
+                print(f"❌ Worker {self.nombre}-{numero}: error procesando trabajo: {e}")
+            finally:
+                self._en_proceso -= 1
+                latencias.registrar(f"{self.nombre}.total", time.perf_counter() - inicio)
+                cola.task_done()
+
+    def profundidad(self) -> int:
+        return sum(cola.qsize() for cola in self._colas)
+
+    def estadisticas(self) -> Dict:
+        datos = {
+            "nombre": self.nombre,
+            "activa": self.activa,
+            "profundidad": self.profundidad(),
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "en_proceso": self._en_proceso,
+            "procesados": self._procesados,
+            "errores": self._errores,
+            "rechazados": self._rechazados,
+        }
+        if self.clave:
+            datos["carriles"] = [cola.qsize() for cola in self._colas]
+        return datos
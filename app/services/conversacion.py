@@ -0,0 +1,161 @@
+"""
+Máquina de estados de la conversación de ventas.
+
+Antes cada paso reescribía context_data con un dict nuevo (perdiendo campos
+como plan_solicitado) y un mismo mensaje leía el contexto 2-3 veces. Ahora:
+
+  - El estado es un objeto compacto (__slots__) con los campos del flujo
+  - Los cambios se aplican con actualizar(): fusión parcial, nunca reemplazo
+  - Cada mensaje hace una sola lectura (cargar_estado) y, si hubo cambios,
+    una sola escritura al final (guardar_estado)
+  - Un cache local write-through evita la lectura a Supabase en los mensajes
+    siguientes del mismo cliente
+
+Estados:
+
+    nuevo -> registrando -> eligiendo_dias -> esperando_pago -> pago_enviado
+         \\-> pidiendo_usuario -/
+
+El estado se guarda en context_data["estado"] y también en current_topic.
+"""
+
+from typing import Dict, Optional
+from app.core.config import settings
+from app.services.cache_respuestas import CacheLRU
+from app.services.supabase import (
+    obtener_contexto_conversacion_async,
+    guardar_contexto_conversacion_async,
+)
+
+NUEVO = "nuevo"
+REGISTRANDO = "registrando"            # cliente nuevo dando sus datos
+PIDIENDO_USUARIO = "pidiendo_usuario"  # dijo que ya es cliente, falta el usuario
+ELIGIENDO_DIAS = "eligiendo_dias"      # usuario identificado, falta cuántos días
+ESPERANDO_PAGO = "esperando_pago"      # pedido registrado, falta el comprobante
+PAGO_ENVIADO = "pago_enviado"          # comprobante recibido, en revisión del admin
+
+TRANSICIONES = {
+    # Un comprobante puede llegar en cualquier momento
+    NUEVO: {REGISTRANDO, PIDIENDO_USUARIO, ELIGIENDO_DIAS, PAGO_ENVIADO},
+    REGISTRANDO: {PIDIENDO_USUARIO, ELIGIENDO_DIAS, PAGO_ENVIADO},
+    PIDIENDO_USUARIO: {REGISTRANDO, ELIGIENDO_DIAS, PAGO_ENVIADO},
+    ELIGIENDO_DIAS: {PIDIENDO_USUARIO, ELIGIENDO_DIAS, ESPERANDO_PAGO, PAGO_ENVIADO},
+    ESPERANDO_PAGO: {PIDIENDO_USUARIO, ELIGIENDO_DIAS, ESPERANDO_PAGO, PAGO_ENVIADO},
+    PAGO_ENVIADO: {PIDIENDO_USUARIO, ELIGIENDO_DIAS, ESPERANDO_PAGO, PAGO_ENVIADO},
+}
+
+
+class EstadoConversacion:
+    """Estado de un cliente; se modifica solo con transicion() / actualizar()"""
+
+    __slots__ = (
+        "telefono", "estado", "ultimo_usuario", "plan_solicitado",
+        "dias_solicitados", "pendiente_pago", "venta_id", "resumen", "zona", "_modificado",
+    )
+
+    CAMPOS = ("ultimo_usuario", "plan_solicitado", "dias_solicitados", "pendiente_pago", "venta_id", "resumen", "zona")
+
+    def __init__(self, telefono: str, estado: str = NUEVO):
+        self.telefono = telefono
+        self.estado = estado
+        self.ultimo_usuario: Optional[str] = None
+        self.plan_solicitado: Optional[str] = None
+        self.dias_solicitados: Optional[int] = None
+        self.pendiente_pago = False
+        self.venta_id = None
+        self.resumen: Optional[str] = None  # turnos viejos condensados (ver historial.py)
+        self.zona: Optional[str] = None     # campamento del cliente (elige el router MikroTik)
+        self._modificado = False
+
+    @classmethod
+    def desde_dict(cls, telefono: str, datos: Optional[Dict]) -> "EstadoConversacion":
+        """Arma el estado desde context_data (también los guardados antes de la máquina de estados)"""
+        datos = datos or {}
+        estado = cls(telefono)
+        for campo in cls.CAMPOS:
+            if datos.get(campo) is not None:
+                setattr(estado, campo, datos[campo])
+
+        if datos.get("estado") in TRANSICIONES:
+            estado.estado = datos["estado"]
+        elif estado.pendiente_pago:
+            estado.estado = ESPERANDO_PAGO
+        elif estado.ultimo_usuario:
+            estado.estado = ELIGIENDO_DIAS
+        return estado
+
+    def a_dict(self) -> Dict:
+        datos = {campo: getattr(self, campo) for campo in self.CAMPOS}
+        datos["estado"] = self.estado
+        return datos
+
+    def get(self, campo: str, default=None):
+        """Acceso tipo dict (compatibilidad con código que leía context_data)"""
+        valor = getattr(self, campo, None) if campo in self.CAMPOS or campo == "estado" else None
+        return default if valor is None else valor
+
+    @property
+    def modificado(self) -> bool:
+        return self._modificado
+
+    def transicion(self, nuevo_estado: str) -> bool:
+        """
+        Cambia de estado si la transición es válida.
+
+        Returns:
+            True si se aplicó (o ya estaba en ese estado)
+        """
+        if nuevo_estado == self.estado:
+            return True
+        if nuevo_estado not in TRANSICIONES.get(self.estado, ()):
+            print(f"⚠️ Transición inválida {self.estado} -> {nuevo_estado} para {self.telefono}")
+            return False
+        print(f"🔀 {self.telefono}: {self.estado} -> {nuevo_estado}")
+        self.estado = nuevo_estado
+        self._modificado = True
+        return True
+
+    def actualizar(self, estado: str = None, **campos):
+        """Fusiona los campos indicados (los demás se conservan)"""
+        if estado is not None:
+            self.transicion(estado)
+        for campo, valor in campos.items():
+            if campo not in self.CAMPOS:
+                raise AttributeError(f"Campo de conversación desconocido: {campo}")
+            if getattr(self, campo) != valor:
+                setattr(self, campo, valor)
+                self._modificado = True
+
+    def _guardado(self):
+        self._modificado = False
+
+    def __repr__(self):
+        return f"EstadoConversacion({self.telefono}, {self.estado}, usuario={self.ultimo_usuario})"
+
+
+# Cache write-through: cada escritura actualiza Supabase y la copia local.
+# El TTL acota cuánto puede durar una copia desactualizada si otro proceso
+# atiende al mismo cliente.
+_cache = CacheLRU(
+    max_items=settings.CONVERSACION_CACHE_MAX,
+    ttl_secs=settings.CONVERSACION_CACHE_TTL_SECS,
+)
+
+
+async def cargar_estado(telefono: str) -> EstadoConversacion:
+    """Estado del cliente: de la copia local o con una sola lectura a Supabase"""
+    datos = _cache.obtener(telefono)
+    if datos is None:
+        datos = await obtener_contexto_conversacion_async(telefono) or {}
+        _cache.guardar(telefono, datos)
+    return EstadoConversacion.desde_dict(telefono, datos)
+
+
+async def guardar_estado(estado: EstadoConversacion):
+    """Una sola escritura al final del mensaje, solo si algo cambió"""
+    if not estado.modificado:
+        return
+    datos = estado.a_dict()
+    _cache.guardar(estado.telefono, datos)
+    await guardar_contexto_conversacion_async(estado.telefono, datos, current_topic=estado.estado)
+    estado._guardado()
@@ -0,0 +1,134 @@
+"""
+Contabilidad de uso de OpenAI.
+
+Cada respuesta de ChatGPT (y cada respuesta servida desde cache) se registra
+con sus tokens reales (response.usage), latencia, modelo, si vino de cache y
+la función llamada:
+
+  - En memoria: acumulados para /metrics/ai (latencia p50/p95, tokens por
+    conversación, costo por venta aprobada)
+  - En ai_cost_tracking: una fila por llamada vía el buffer de escritura
+    diferida (inserciones en lote)
+
+Los acumulados en memoria cuentan desde que arrancó el proceso; los tokens
+por conversación, solo de los últimos MAX_TELEFONOS clientes activos (LRU,
+igual que historial.py) para que la memoria no crezca con cada cliente.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from app.core.metricas import latencias, percentil
+from app.services.buffer_escritura import buffer_costos
+
+# USD por 1K tokens (entrada, salida)
+PRECIOS = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+}
+PRECIO_DEFAULT = PRECIOS["gpt-3.5-turbo"]
+
+# Conversaciones con tokens acumulados en memoria
+MAX_TELEFONOS = 10000
+
+
+def calcular_costo(modelo: str, input_tokens: int, output_tokens: int):
+    """(costo_entrada, costo_salida) en USD"""
+    precio_in, precio_out = PRECIOS.get(modelo, PRECIO_DEFAULT)
+    return input_tokens / 1000 * precio_in, output_tokens / 1000 * precio_out
+
+
+class RegistroUsoAI:
+    """Acumulados de uso de OpenAI (thread-safe: lo usan la ruta síncrona y la async)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._llamadas = 0
+        self._cacheadas = 0
+        self._input_tokens = 0
+        self._output_tokens = 0
+        self._costo = 0.0
+        self._por_funcion: Dict[str, int] = {}
+        self._tokens_por_telefono: "OrderedDict[str, int]" = OrderedDict()
+        self._ventas_aprobadas = 0
+
+    def registrar(
+        self,
+        phone_number: Optional[str],
+        modelo: str,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        latencia_secs: float = None,
+        cacheada: bool = False,
+        funcion: str = None
+    ):
+        costo_in, costo_out = calcular_costo(modelo, input_tokens, output_tokens)
+        total = input_tokens + output_tokens
+
+        with self._lock:
+            if cacheada:
+                self._cacheadas += 1
+            else:
+                self._llamadas += 1
+            self._input_tokens += input_tokens
+            self._output_tokens += output_tokens
+            self._costo += costo_in + costo_out
+            if funcion:
+                self._por_funcion[funcion] = self._por_funcion.get(funcion, 0) + 1
+            if phone_number:
+                self._tokens_por_telefono[phone_number] = self._tokens_por_telefono.get(phone_number, 0) + total
+                self._tokens_por_telefono.move_to_end(phone_number)
+                while len(self._tokens_por_telefono) > MAX_TELEFONOS:
+                    self._tokens_por_telefono.popitem(last=False)
+
+        if latencia_secs is not None and not cacheada:
+            latencias.registrar("openai", latencia_secs)
+
+        buffer_costos.agregar({
+            "phone_number": phone_number,
+            "request_type": "function_call" if funcion else "chat_completion",
+            "model_used": modelo,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": total,
+            "input_cost": round(costo_in, 6),
+            "output_cost": round(costo_out, 6),
+            "total_cost": round(costo_in + costo_out, 6),
+            "was_cached": cacheada,
+            "function_called": funcion,
+        })
+
+    def registrar_venta_aprobada(self):
+        with self._lock:
+            self._ventas_aprobadas += 1
+
+    def resumen(self) -> Dict:
+        with self._lock:
+            tokens_conversacion = sorted(self._tokens_por_telefono.values())
+            costo = self._costo
+            ventas = self._ventas_aprobadas
+            datos = {
+                "llamadas_openai": self._llamadas,
+                "respuestas_cacheadas": self._cacheadas,
+                "input_tokens": self._input_tokens,
+                "output_tokens": self._output_tokens,
+                "costo_usd": round(costo, 4),
+                "funciones": dict(self._por_funcion),
+            }
+
+        openai = latencias.resumen().get("openai", {})
+        datos.update({
+            "latencia_p50_ms": openai.get("p50_ms", 0.0),
+            "latencia_p95_ms": openai.get("p95_ms", 0.0),
+            "conversaciones": len(tokens_conversacion),
+            "tokens_por_conversacion": {
+                "promedio": round(sum(tokens_conversacion) / len(tokens_conversacion), 1) if tokens_conversacion else 0,
+                "p50": percentil(tokens_conversacion, 50),
+                "p95": percentil(tokens_conversacion, 95),
+            },
+            "ventas_aprobadas": ventas,
+            "costo_por_venta_aprobada_usd": round(costo / ventas, 4) if ventas else None,
+        })
+        return datos
+
+
+uso_ai = RegistroUsoAI()
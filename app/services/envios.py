@@ -0,0 +1,270 @@
+"""
+Cola de envíos salientes de WhatsApp.
+
+Las respuestas del bot no se mandan a Twilio en el acto: se encolan aquí y
+un despachador las envía respetando el límite de mensajes por segundo de
+cada número remitente (token bucket). Así una ráfaga de clientes no choca
+con el rate limit de Twilio y ninguna respuesta se pierde en silencio:
+
+  - Si un cliente ya tiene un mensaje esperando, el nuevo texto se une a ese
+    mismo mensaje (un solo envío en lugar de varios)
+  - Un cliente nunca tiene dos envíos en vuelo: sus mensajes salen en orden
+  - Un envío que Twilio rechaza por saturación (429) o por un error suyo
+    (5xx) se reintenta con backoff antes de darlo por perdido. Los demás
+    4xx (número inválido, 21211) no se reintentan: fallarían igual. Tampoco
+    un error de red: Twilio pudo haber recibido el mensaje y reintentar lo
+    duplicaría
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+from app.core.config import settings
+from app.core.metricas import latencias
+from app.services.whatsapp import enviar_mensaje_whatsapp_async, enviar_whatsapp_twilio_async
+
+# Largo máximo del cuerpo de un mensaje de WhatsApp en Twilio
+MAX_CARACTERES = 1600
+SEPARADOR = "\n\n"
+
+
+def es_reintentable(status: Optional[int]) -> bool:
+    """429 (rate limit) y 5xx: Twilio no aceptó el mensaje y puede aceptarlo luego"""
+    return status is not None and (status == 429 or status >= 500)
+
+
+class TokenBucket:
+    """
+    Limitador de tasa: `tasa` envíos por segundo con ráfagas de hasta
+    `capacidad` envíos seguidos.
+    """
+
+    def __init__(self, tasa: float, capacidad: int):
+        self.tasa = tasa
+        self.capacidad = max(1, capacidad)
+        self._tokens = float(self.capacidad)
+        self._ts = time.monotonic()
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ts) * self.tasa)
+        self._ts = ahora
+
+    async def tomar(self):
+        """Espera hasta que haya un token disponible y lo consume"""
+        while True:
+            self._recargar()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.tasa)
+
+
+class _Envio:
+    __slots__ = ("numero", "remitente", "textos", "encolado_en", "intentos")
+
+    def __init__(self, numero: str, remitente: str, texto: str):
+        self.numero = numero
+        self.remitente = remitente
+        self.textos: List[str] = [texto]
+        self.encolado_en = time.perf_counter()
+        self.intentos = 0
+
+    @property
+    def texto(self) -> str:
+        return SEPARADOR.join(self.textos)
+
+    def admite(self, texto: str) -> bool:
+        return len(self.texto) + len(SEPARADOR) + len(texto) <= MAX_CARACTERES
+
+
+class ColaEnvios:
+    """
+    Envíos salientes con rate limit por remitente, reintentos y unión de
+    mensajes pendientes al mismo destinatario.
+
+    Args:
+        tasa: Envíos por segundo permitidos por número remitente
+        rafaga: Envíos seguidos permitidos antes de limitar
+        reintentos: Reintentos de un envío fallido antes de descartarlo
+        backoff_secs: Espera base entre reintentos (crece exponencialmente)
+    """
+
+    def __init__(
+        self,
+        tasa: float = 10,
+        rafaga: int = 20,
+        reintentos: int = 3,
+        backoff_secs: float = 2
+    ):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.reintentos = reintentos
+        self.backoff_secs = backoff_secs
+
+        self._pendientes: Dict[str, Deque[_Envio]] = {}
+        self._listos: Optional[asyncio.Queue] = None
+        self._en_vuelo: Set[str] = set()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._despachador: Optional[asyncio.Task] = None
+        self._tareas: Set[asyncio.Task] = set()
+
+        self._enviados = 0
+        self._unidos = 0
+        self._reintentos = 0
+        self._perdidos = 0
+
+    @property
+    def activa(self) -> bool:
+        return self._despachador is not None and not self._despachador.done()
+
+    def iniciar(self):
+        """Lanza el despachador (llamar dentro del event loop)"""
+        if self.activa:
+            return
+        self._listos = asyncio.Queue()
+        self._despachador = asyncio.create_task(self._despachar(), name="envios-despachador")
+        print(f"📤 Cola de envíos iniciada ({self.tasa}/s por remitente, ráfaga {self.rafaga})")
+
+    async def detener(self, timeout_secs: float = 10):
+        """Intenta vaciar los envíos pendientes (con timeout) y detiene el despachador"""
+        if not self.activa:
+            return
+        limite = time.monotonic() + timeout_secs
+        while (self._pendientes or self._tareas) and time.monotonic() < limite:
+            await asyncio.sleep(0.1)
+        if self._pendientes:
+            print(f"⚠️ Cola de envíos: {self.profundidad()} mensajes sin enviar al detener")
+        self._despachador.cancel()
+        for tarea in list(self._tareas):
+            tarea.cancel()
+        await asyncio.gather(self._despachador, *self._tareas, return_exceptions=True)
+        self._despachador = None
+
+    def encolar(self, numero: str, texto: str, remitente: str = None) -> bool:
+        """
+        Encola un mensaje. Si el destinatario ya tiene un mensaje esperando,
+        el texto se agrega a ese mensaje.
+
+        Returns:
+            True si quedó encolado, False si la cola no está activa
+        """
+        if not self.activa:
+            return False
+        remitente = remitente or settings.TWILIO_FROM_NUMBER
+
+        cola = self._pendientes.get(numero)
+        if cola:
+            ultimo = cola[-1]
+            if ultimo.remitente == remitente and ultimo.admite(texto):
+                ultimo.textos.append(texto)
+                self._unidos += 1
+                return True
+            cola.append(_Envio(numero, remitente, texto))
+            return True
+
+        self._pendientes[numero] = deque([_Envio(numero, remitente, texto)])
+        if numero not in self._en_vuelo:
+            self._listos.put_nowait(numero)
+        return True
+
+    def encolar_lote(self, mensajes: Iterable[Tuple[str, str]], remitente: str = None) -> int:
+        """
+        Encola varios mensajes (numero, texto) de una vez, por ejemplo los
+        avisos de una ronda del barredor de vencimientos.
+
+        Returns:
+            Mensajes encolados (0 si la cola no está activa)
+        """
+        if not self.activa:
+            return 0
+        return sum(self.encolar(numero, texto, remitente) for numero, texto in mensajes)
+
+    def _bucket(self, remitente: str) -> TokenBucket:
+        bucket = self._buckets.get(remitente)
+        if bucket is None:
+            bucket = self._buckets[remitente] = TokenBucket(self.tasa, self.rafaga)
+        return bucket
+
+    async def _despachar(self):
+        while True:
+            numero = await self._listos.get()
+            cola = self._pendientes.get(numero)
+            if not cola or numero in self._en_vuelo:
+                continue
+
+            await self._bucket(cola[0].remitente).tomar()
+            envio = cola.popleft()
+            if not cola:
+                del self._pendientes[numero]
+
+            self._en_vuelo.add(numero)
+            latencias.registrar("envios.espera", time.perf_counter() - envio.encolado_en)
+            tarea = asyncio.create_task(self._enviar(envio))
+            self._tareas.add(tarea)
+            tarea.add_done_callback(self._tareas.discard)
+
+    async def _enviar(self, envio: _Envio):
+        numero = envio.numero
+        try:
+            status = await enviar_whatsapp_twilio_async(numero, envio.texto, remitente=envio.remitente)
+            if status in (200, 201):
+                self._enviados += 1
+                latencias.registrar("envios.total", time.perf_counter() - envio.encolado_en)
+            elif es_reintentable(status) and envio.intentos < self.reintentos:
+                envio.intentos += 1
+                self._reintentos += 1
+                espera = self.backoff_secs * (2 ** (envio.intentos - 1)) + random.uniform(0, 1)
+                print(f"🔁 Reintentando envío a {numero} en {espera:.1f}s (intento {envio.intentos})")
+                await asyncio.sleep(espera)
+                # Vuelve al frente para no adelantarse a mensajes posteriores
+                self._pendientes.setdefault(numero, deque()).appendleft(envio)
+            else:
+                self._perdidos += 1
+                motivo = f"{envio.intentos} reintentos" if es_reintentable(status) else f"error {status or 'de red'}, sin reintento"
+                print(f"❌ Mensaje a {numero} descartado ({motivo})")
+        finally:
+            self._en_vuelo.discard(numero)
+            if self._pendientes.get(numero):
+                self._listos.put_nowait(numero)
+
+    def profundidad(self) -> int:
+        return sum(len(cola) for cola in self._pendientes.values())
+
+    def estadisticas(self) -> Dict:
+        return {
+            "nombre": "envios",
+            "activa": self.activa,
+            "profundidad": self.profundidad(),
+            "en_vuelo": len(self._en_vuelo),
+            "enviados": self._enviados,
+            "unidos": self._unidos,
+            "reintentos": self._reintentos,
+            "perdidos": self._perdidos,
+        }
+
+
+cola_envios = ColaEnvios(
+    tasa=settings.WA_ENVIO_TASA,
+    rafaga=settings.WA_ENVIO_RAFAGA,
+    reintentos=settings.WA_ENVIO_REINTENTOS,
+)
+
+
+async def responder_whatsapp(numero: str, texto: str):
+    """
+    Encola una respuesta al cliente; si la cola de envíos no está activa
+    (ej: scripts fuera de la app) la envía directamente.
+    """
+    if not cola_envios.encolar(numero, texto):
+        await enviar_mensaje_whatsapp_async(numero, texto)
+
+
+async def responder_whatsapp_lote(mensajes: List[Tuple[str, str]]):
+    """Varias respuestas (numero, texto) con un solo encolado (o directas, sin cola)"""
+    if not mensajes or cola_envios.encolar_lote(mensajes):
+        return
+    for numero, texto in mensajes:
+        await enviar_mensaje_whatsapp_async(numero, texto)
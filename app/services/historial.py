@@ -0,0 +1,183 @@
+"""
+Historial de conversación para ChatGPT con presupuesto de tokens.
+
+  - Buffer circular en memoria por teléfono con los últimos turnos
+    (mensaje del cliente + respuesta del bot): el historial no necesita una
+    query a Supabase en cada mensaje, solo la primera vez que se atiende a
+    un cliente en este proceso
+  - Los turnos más recientes se incluyen completos mientras quepan en
+    HISTORIAL_PRESUPUESTO_TOKENS
+  - Los turnos que salen del buffer se condensan en un resumen corto que se
+    guarda en conversation_context (campo `resumen` del estado), así
+    ChatGPT no pierde el hilo aunque el cliente sea muy verboso
+
+Los tokens se cuentan localmente con tiktoken si está instalado; si no, con
+una aproximación de 4 caracteres por token.
+"""
+
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+try:
+    import tiktoken
+    _codificador = tiktoken.encoding_for_model("gpt-3.5-turbo")
+except Exception:  # no instalado o sin acceso al archivo de vocabulario
+    _codificador = None
+
+# Tokens fijos que agrega cada mensaje del chat (rol y separadores)
+TOKENS_POR_MENSAJE = 4
+# Caracteres de cada lado de un turno que se conservan en el resumen
+CARACTERES_RESUMEN = 80
+
+
+def contar_tokens(texto: str) -> int:
+    if not texto:
+        return 0
+    if _codificador is not None:
+        return len(_codificador.encode(texto))
+    return max(1, len(texto) // 4)
+
+
+Turno = Tuple[str, str]  # (mensaje del cliente, respuesta del bot)
+
+
+class _Historial:
+    __slots__ = ("turnos", "resumen")
+
+    def __init__(self, turnos: List[Turno], resumen: str):
+        self.turnos: Deque[Turno] = deque(turnos, maxlen=settings.HISTORIAL_TURNOS)
+        self.resumen = resumen or ""
+
+
+_historiales: "OrderedDict[str, _Historial]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _recordar(telefono: str, historial: _Historial):
+    with _lock:
+        _historiales[telefono] = historial
+        _historiales.move_to_end(telefono)
+        while len(_historiales) > settings.HISTORIAL_TELEFONOS_MAX:
+            _historiales.popitem(last=False)
+
+
+def _recortar(texto: str) -> str:
+    texto = " ".join((texto or "").split())
+    return texto if len(texto) <= CARACTERES_RESUMEN else texto[:CARACTERES_RESUMEN - 1] + "…"
+
+
+def _condensar(resumen: str, turno: Turno) -> str:
+    """Agrega un turno al resumen; si se pasa del límite se descartan las líneas más viejas"""
+    lineas = [l for l in resumen.split("\n") if l]
+    lineas.append(f"- Cliente: {_recortar(turno[0])} / Bot: {_recortar(turno[1])}")
+    while len(lineas) > 1 and contar_tokens("\n".join(lineas)) > settings.HISTORIAL_RESUMEN_TOKENS:
+        lineas.pop(0)
+    return "\n".join(lineas)
+
+
+async def _cargar_desde_supabase(telefono: str) -> List[Turno]:
+    """Últimos turnos de conversation_cache (más los que esperan en el buffer de escritura)"""
+    from app.services.supabase import obtener_supabase_async
+    from app.services.buffer_escritura import buffer_conversaciones
+
+    filas = []
+    try:
+        cliente = await obtener_supabase_async()
+        response = await cliente.table("conversation_cache")\
+            .select("user_message, ai_response, created_at")\
+            .eq("phone_number", telefono)\
+            .order("created_at", desc=True)\
+            .limit(settings.HISTORIAL_TURNOS)\
+            .execute()
+        filas = response.data or []
+    except Exception as e:
+        print(f"Error obteniendo historial: {e}")
+
+    filas = sorted(
+        filas + buffer_conversaciones.pendientes("phone_number", telefono),
+        key=lambda fila: fila.get("created_at") or ""
+    )[-settings.HISTORIAL_TURNOS:]
+    return [(fila["user_message"], fila["ai_response"]) for fila in filas]
+
+
+async def _obtener(telefono: str, estado=None) -> _Historial:
+    with _lock:
+        historial = _historiales.get(telefono)
+        if historial is not None:
+            _historiales.move_to_end(telefono)
+            return historial
+
+    turnos = await _cargar_desde_supabase(telefono)
+    historial = _Historial(turnos, estado.resumen if estado is not None else "")
+    _recordar(telefono, historial)
+    return historial
+
+
+def _datos_conocidos(estado) -> Optional[str]:
+    if estado is None or not estado.ultimo_usuario:
+        return None
+    texto = f"Usuario del cliente: {estado.ultimo_usuario}."
+    if estado.dias_solicitados:
+        texto += f" Pidió {estado.dias_solicitados} días."
+    return texto + f" Estado: {estado.estado}."
+
+
+async def construir_historial(telefono: str, estado=None) -> List[Dict]:
+    """
+    Mensajes previos para ChatGPT dentro del presupuesto de tokens.
+
+    Args:
+        telefono: Número del cliente
+        estado: EstadoConversacion (aporta el resumen y los datos conocidos)
+
+    Returns:
+        [{role, content}] en orden cronológico; si hay resumen va primero
+        como mensaje de sistema
+    """
+    historial = await _obtener(telefono, estado)
+
+    previos: List[Dict] = []
+    contexto = "\n".join(p for p in (
+        _datos_conocidos(estado),
+        f"Resumen de la conversación anterior:\n{historial.resumen}" if historial.resumen else None,
+    ) if p)
+    presupuesto = settings.HISTORIAL_PRESUPUESTO_TOKENS
+    if contexto:
+        presupuesto -= contar_tokens(contexto) + TOKENS_POR_MENSAJE
+
+    # Del turno más reciente al más viejo mientras quepan
+    incluidos: List[Turno] = []
+    for turno in reversed(historial.turnos):
+        costo = contar_tokens(turno[0]) + contar_tokens(turno[1]) + 2 * TOKENS_POR_MENSAJE
+        if costo > presupuesto:
+            break
+        presupuesto -= costo
+        incluidos.append(turno)
+
+    if contexto:
+        previos.append({"role": "system", "content": contexto})
+    for mensaje, respuesta in reversed(incluidos):
+        previos.append({"role": "user", "content": mensaje})
+        previos.append({"role": "assistant", "content": respuesta})
+    return previos
+
+
+def agregar_turno(telefono: str, mensaje: str, respuesta: str, estado=None):
+    """
+    Agrega el turno recién respondido al buffer del cliente. El turno que
+    sale del buffer se condensa en el resumen (guardado en el estado).
+    """
+    with _lock:
+        historial = _historiales.get(telefono)
+    if historial is None:
+        historial = _Historial([], estado.resumen if estado is not None else "")
+        _recordar(telefono, historial)
+
+    if len(historial.turnos) == historial.turnos.maxlen:
+        historial.resumen = _condensar(historial.resumen, historial.turnos[0])
+        if estado is not None:
+            estado.actualizar(resumen=historial.resumen)
+    historial.turnos.append((mensaje, respuesta))
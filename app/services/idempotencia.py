@@ -0,0 +1,246 @@
+"""
+Idempotencia de webhooks entrantes.
+
+Twilio y Telegram reintentan el webhook cuando la respuesta tarda o falla.
+Sin deduplicar, un comprobante reintentado crea otra fila en ventas y otra
+alerta al admin, y una aprobación reintentada llama dos veces a
+reemplazar_plan_usuario.
+
+Cada evento se identifica por su id (MessageSid de Twilio, callback_query.id
+o update_id de Telegram):
+
+  - Conjunto acotado en memoria (LRU) con los eventos vistos por este
+    proceso: los reintentos se descartan sin tocar la red
+  - Tabla webhook_eventos en Supabase (migración 009): el INSERT con la
+    clave como PRIMARY KEY reclama el evento de forma atómica, así que un
+    reintento que llega a otro proceso (o después de un reinicio) también
+    se reconoce
+
+El reintento recibe el resultado guardado del primer procesamiento. Si
+Supabase no responde se sigue solo con la memoria: preferimos procesar un
+duplicado improbable antes que perder un mensaje. Por lo mismo, un evento
+que se ignoró o cuyo procesamiento falló se libera (liberar): su reintento
+se procesa como nuevo en lugar de recibir EN_PROCESO para siempre.
+
+Los eventos vencidos (expires_at, 3 días) se borran cada
+IDEMPOTENCIA_LIMPIEZA_SECS con cleanup_webhook_eventos().
+"""
+
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from app.core.config import settings
+
+TABLA = "webhook_eventos"
+
+# Resultado para un reintento que llega mientras el original se procesa
+EN_PROCESO = {"status": "duplicate", "detail": "en_proceso"}
+
+
+def _es_clave_duplicada(error: Exception) -> bool:
+    """Violación de PRIMARY KEY (código 23505 de Postgres vía PostgREST)"""
+    return getattr(error, "code", None) == "23505" or "duplicate key" in str(error)
+
+
+class RegistroIdempotencia:
+    """
+    Eventos de webhook ya vistos.
+
+    Args:
+        max_items: Eventos recordados en memoria
+        limpieza_secs: Cada cuánto se borran de Supabase los eventos vencidos
+    """
+
+    def __init__(self, max_items: int = 10000, limpieza_secs: float = 6 * 3600):
+        self.max_items = max_items
+        self.limpieza_secs = limpieza_secs
+        # clave -> resultado (None mientras se procesa)
+        self._vistos: "OrderedDict[str, Optional[Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._nuevos = 0
+        self._duplicados = 0
+        self._liberados = 0
+        self._errores = 0
+        self._tarea: Optional[asyncio.Task] = None
+
+    def _recordar(self, clave: str, resultado: Optional[Dict]):
+        with self._lock:
+            self._vistos[clave] = resultado
+            self._vistos.move_to_end(clave)
+            while len(self._vistos) > self.max_items:
+                self._vistos.popitem(last=False)
+
+    def _duplicado(self, clave: str, resultado: Optional[Dict]) -> Dict:
+        with self._lock:
+            self._duplicados += 1
+        print(f"♻️ Evento repetido {clave}, se responde con el resultado guardado")
+        return resultado or EN_PROCESO
+
+    async def reclamar(self, clave: Optional[str]) -> Optional[Dict]:
+        """
+        Reclama un evento antes de procesarlo.
+
+        Args:
+            clave: Id del evento (None = sin id, no se deduplica)
+
+        Returns:
+            None si el evento es nuevo y hay que procesarlo; si ya se vio,
+            el resultado guardado (o EN_PROCESO)
+        """
+        if not clave:
+            return None
+
+        # Revisar y marcar sin ceder el event loop: dos reintentos simultáneos
+        # en este proceso no pueden reclamar los dos
+        with self._lock:
+            if clave in self._vistos:
+                visto = True
+                resultado = self._vistos[clave]
+                self._vistos.move_to_end(clave)
+            else:
+                visto = False
+                self._vistos[clave] = None
+                while len(self._vistos) > self.max_items:
+                    self._vistos.popitem(last=False)
+        if visto:
+            return self._duplicado(clave, resultado)
+
+        try:
+            from app.services.supabase import obtener_supabase_async
+            cliente = await obtener_supabase_async()
+            await cliente.table(TABLA).insert({"clave": clave, "estado": "procesando"}).execute()
+        except Exception as e:
+            if not _es_clave_duplicada(e):
+                with self._lock:
+                    self._errores += 1
+                print(f"⚠️ Idempotencia sin Supabase para {clave}, se usa solo memoria: {e}")
+            else:
+                # Otro proceso (o una ejecución anterior) ya lo reclamó
+                resultado = await self._resultado_guardado(clave)
+                self._recordar(clave, resultado)
+                return self._duplicado(clave, resultado)
+
+        with self._lock:
+            self._nuevos += 1
+        return None
+
+    async def _resultado_guardado(self, clave: str) -> Optional[Dict]:
+        try:
+            from app.services.supabase import obtener_supabase_async
+            cliente = await obtener_supabase_async()
+            response = await cliente.table(TABLA)\
+                .select("resultado")\
+                .eq("clave", clave)\
+                .limit(1)\
+                .execute()
+            return response.data[0].get("resultado") if response.data else None
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el resultado de {clave}: {e}")
+            return None
+
+    async def completar(self, clave: Optional[str], resultado: Dict):
+        """Guarda el resultado del evento para responder a sus reintentos"""
+        if not clave:
+            return
+        self._recordar(clave, resultado)
+        try:
+            from app.services.supabase import obtener_supabase_async
+            cliente = await obtener_supabase_async()
+            await cliente.table(TABLA)\
+                .update({"estado": "completado", "resultado": resultado})\
+                .eq("clave", clave)\
+                .execute()
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el resultado de {clave}: {e}")
+
+    async def liberar(self, clave: Optional[str]):
+        """
+        Suelta un evento reclamado que no se completó (ignorado o con error):
+        su próximo reintento se procesa como nuevo.
+        """
+        if not clave:
+            return
+        with self._lock:
+            self._vistos.pop(clave, None)
+            self._liberados += 1
+        try:
+            from app.services.supabase import obtener_supabase_async
+            cliente = await obtener_supabase_async()
+            await cliente.table(TABLA)\
+                .delete()\
+                .eq("clave", clave)\
+                .eq("estado", "procesando")\
+                .execute()
+        except Exception as e:
+            print(f"⚠️ No se pudo liberar {clave}: {e}")
+
+    # ------------------------------------------------------------------
+    # Limpieza de webhook_eventos
+    # ------------------------------------------------------------------
+
+    def iniciar(self):
+        """Lanza la limpieza periódica (dentro del event loop)"""
+        if self._tarea is not None and not self._tarea.done():
+            return
+        self._tarea = asyncio.create_task(self._ciclo_limpieza(), name="limpieza-webhook-eventos")
+
+    async def detener(self):
+        if self._tarea is None:
+            return
+        self._tarea.cancel()
+        await asyncio.gather(self._tarea, return_exceptions=True)
+        self._tarea = None
+
+    async def _ciclo_limpieza(self):
+        while True:
+            await self.limpiar()
+            await asyncio.sleep(self.limpieza_secs)
+
+    async def limpiar(self) -> int:
+        """Borra los eventos vencidos (cleanup_webhook_eventos, migración 009)"""
+        try:
+            from app.services.supabase import obtener_supabase_async
+            cliente = await obtener_supabase_async()
+            response = await cliente.rpc("cleanup_webhook_eventos", {}).execute()
+        except Exception as e:
+            print(f"⚠️ No se pudieron limpiar los eventos de webhook: {e}")
+            return 0
+        borrados = response.data or 0
+        if borrados:
+            print(f"🧹 {borrados} eventos de webhook vencidos eliminados")
+        return borrados
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            return {
+                "en_memoria": len(self._vistos),
+                "nuevos": self._nuevos,
+                "duplicados": self._duplicados,
+                "liberados": self._liberados,
+                "errores_supabase": self._errores,
+            }
+
+
+def clave_twilio(form_data) -> Optional[str]:
+    """MessageSid (SmsMessageSid en webhooks antiguos)"""
+    sid = form_data.get("MessageSid") or form_data.get("SmsMessageSid")
+    return f"wa:{sid}" if sid else None
+
+
+def clave_telegram(data: Dict) -> Optional[str]:
+    """
+    callback_query.id identifica el clic del admin; los demás updates se
+    identifican por update_id.
+    """
+    callback_id = (data.get("callback_query") or {}).get("id")
+    if callback_id:
+        return f"tg:cb:{callback_id}"
+    update_id = data.get("update_id")
+    return f"tg:upd:{update_id}" if update_id is not None else None
+
+
+eventos_webhook = RegistroIdempotencia(
+    max_items=settings.IDEMPOTENCIA_MAX,
+    limpieza_secs=settings.IDEMPOTENCIA_LIMPIEZA_SECS,
+)
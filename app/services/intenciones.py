@@ -0,0 +1,136 @@
+"""
+Pre-router de intenciones: resuelve localmente los mensajes mecánicos del
+flujo de ventas sin pasar por ChatGPT.
+
+  - "5 días", "quiero 3", "una semana"  -> registrar_pedido (solo si el bot
+                                           preguntó los días: estado eligiendo_dias)
+  - "mi usuario es pepa", "usuario: pepa" -> buscar_usuario_existente
+  - "soy nuevo", "ya soy cliente"        -> la pregunta que sigue en el flujo
+
+Las reglas están ancladas al mensaje completo: "hace 3 días no me conecta"
+no es un pedido. Lo que no encaja en ninguna regla (texto libre) sigue
+yendo a ChatGPT. El resultado tiene el mismo formato que
+obtener_respuesta_chatgpt, así el webhook lo trata igual.
+"""
+
+import re
+import unicodedata
+from typing import Dict, Optional
+from app.services.conversacion import REGISTRANDO, PIDIENDO_USUARIO, ELIGIENDO_DIAS
+
+# Días máximos que aceptamos en un pedido reconocido localmente
+MAX_DIAS = 60
+
+NUMEROS = {
+    "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "quince": 15,
+    "veinte": 20, "treinta": 30,
+}
+PERIODOS = {"semana": 7, "semanas": 7, "mes": 30, "meses": 30}
+
+_CANTIDAD = r"(?P<cantidad>\d{1,2}|" + "|".join(NUMEROS) + r")"
+
+RE_PEDIDO_DIAS = re.compile(
+    r"^(?:(?:quiero|dame|deme|ponme|recargame|recarga|recargar|necesito|seria|serian|son|para|por)\s+)*"
+    + _CANTIDAD +
+    r"(?:\s+(?P<unidad>dias?|semanas?|mes|meses))?"
+    r"(?:\s+(?:por favor|porfa|pls|nomas|no mas))?$"
+)
+
+# Se aplica al mensaje original (no al normalizado): el usuario de Userman
+# distingue mayúsculas y tildes ("Pepa3" no es "pepa3")
+RE_USUARIO = re.compile(
+    r"(?:^|\s)(?:mi\s+)?(?:usuario|user)(?:\s+es\s*:\s*|\s+es\s+|\s*:\s*)(?P<usuario>[^\W_][\w.-]{1,30})[^\w]*$",
+    re.IGNORECASE,
+)
+
+RE_NUEVO = re.compile(
+    r"^(?:hola\s+)?(?:soy\s+(?:cliente\s+)?nuev[oa]|es\s+mi\s+primera\s+vez|no\s+tengo\s+usuario|nuev[oa])$"
+)
+
+RE_YA_CLIENTE = re.compile(r"^(?:si\s+)?(?:ya\s+)?soy\s+cliente$")
+
+# Palabras que nunca son un nombre de usuario
+NO_USUARIOS = {"nuevo", "nueva", "correcto", "incorrecto", "bloqueado", "ese", "este"}
+
+RESPUESTA_NUEVO = (
+    "¡Bienvenido! 🎉 Te creo tu usuario con 1 día GRATIS para que pruebes.\n"
+    "¿Me dices tu nombre completo?"
+)
+RESPUESTA_YA_CLIENTE = "¡Genial! 😊 ¿Cuál es tu usuario?"
+
+
+def _normalizar(texto: str) -> str:
+    """Minúsculas y sin tildes; conserva . _ - : (útiles en nombres de usuario)"""
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^a-z0-9ñ._:\- ]+", " ", texto)
+    return " ".join(texto.split()).strip(" .")
+
+
+def _resultado(accion: str = None, datos: Dict = None, respuesta: str = None, estado: str = None) -> Dict:
+    resultado = {
+        "respuesta": respuesta,
+        "accion": accion,
+        "datos": datos,
+        "tokens_used": 0,
+        "intencion_local": True,
+    }
+    if estado:
+        # Estado al que pasa la conversación con esta respuesta
+        resultado["estado"] = estado
+    return resultado
+
+
+def _dias_pedidos(match) -> Optional[int]:
+    cantidad = match.group("cantidad")
+    cantidad = int(cantidad) if cantidad.isdigit() else NUMEROS[cantidad]
+    unidad = match.group("unidad")
+    if unidad in PERIODOS:
+        cantidad *= PERIODOS[unidad]
+    return cantidad if 1 <= cantidad <= MAX_DIAS else None
+
+
+def detectar_intencion(mensaje: str, contexto: Optional[Dict]) -> Optional[Dict]:
+    """
+    Reconoce intenciones estructuradas del cliente.
+
+    Args:
+        mensaje: Texto del cliente
+        contexto: Estado de la conversación (EstadoConversacion o dict, puede ser None)
+
+    Returns:
+        dict con el formato de obtener_respuesta_chatgpt, o None si el
+        mensaje es texto libre y debe ir a ChatGPT
+    """
+    texto = _normalizar(mensaje)
+    if not texto:
+        return None
+    contexto = contexto or {}
+
+    match = RE_PEDIDO_DIAS.match(texto)
+    if match:
+        dias = _dias_pedidos(match)
+        usuario = contexto.get("ultimo_usuario")
+        # Un número suelto solo es un pedido si el bot está esperando los
+        # días de un usuario ya identificado (no, por ejemplo, tras el pago)
+        if dias and usuario and contexto.get("estado") == ELIGIENDO_DIAS:
+            print(f"🎯 Intención local: registrar_pedido ({dias} días)")
+            return _resultado("registrar_pedido", {"usuario": usuario, "dias": dias})
+        return None
+
+    match = RE_USUARIO.search(" ".join(mensaje.split()))
+    if match and match.group("usuario").lower() not in NO_USUARIOS:
+        usuario = match.group("usuario").rstrip(".-_")
+        print(f"🎯 Intención local: buscar_usuario_existente ({usuario})")
+        return _resultado("buscar_usuario_existente", {"usuario": usuario})
+
+    if RE_NUEVO.match(texto):
+        print("🎯 Intención local: cliente nuevo")
+        return _resultado(respuesta=RESPUESTA_NUEVO, estado=REGISTRANDO)
+
+    if RE_YA_CLIENTE.match(texto):
+        print("🎯 Intención local: cliente existente")
+        return _resultado(respuesta=RESPUESTA_YA_CLIENTE, estado=PIDIENDO_USUARIO)
+
+    return None
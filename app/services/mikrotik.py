@@ -6,6 +6,16 @@ FUNCIONES PRINCIPALES:
   2. buscar_usuario_existente(usuario) - Busca si existe el usuario
   3. crear_usuario_userman(usuario, password, nombre, plan) - Crea nuevo usuario
   4. actualizar_usuario_plan(usuario, nuevo_plan) - Cambia plan del usuario
+
+Todas las funciones piden una sesión prestada al pool persistente
+(app/services/mikrotik_pool.py) en lugar de conectar y hacer login cada vez,
+y buscan usuarios/perfiles en el índice local (app/services/mikrotik_indice.py)
+en lugar de descargar y recorrer toda la tabla de Userman.
+
+Cada operación va al router del campamento del cliente
+(app/services/mikrotik_routers.py). El parámetro `zona` acepta el nombre de
+la zona o el id del campamento; si no se indica se usa el router donde ya
+se vio al usuario o se lo busca en todos los routers.
 """
 
 try:
@@ -17,8 +27,17 @@ except ImportError:
 import random
 import string
 import socket
-from typing import Tuple, Optional, Dict, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Tuple, Optional, Dict, List, Union
 from app.core.config import settings
+from app.services.mikrotik_pool import obtener_pool, RouterOsApiCommunicationError, RouterOsApiConnectionError
+from app.services.mikrotik_indice import (
+    RECURSO_USUARIOS,
+    RECURSO_PERFILES_USUARIO,
+)
+from app.services.mikrotik_routers import RouterMikrotik, catalogo_routers, resolver_router
+
+Zona = Union[str, int, None]
 
 
 def generar_credenciales() -> Tuple[str, str]:
@@ -33,6 +52,9 @@ def conectar_mikrotik(timeout_secs: int = 10):
     """
     Conecta a MikroTik y retorna (conexión, api).
     
+    Conexión dedicada (fuera del pool) para scripts de diagnóstico.
+    Las operaciones del bot deben usar sesion_mikrotik().
+    
     Returns:
         (conexión, api) o (None, None) si falla
     """
@@ -40,6 +62,10 @@ def conectar_mikrotik(timeout_secs: int = 10):
         print("⚠️ routeros_api no disponible")
         return None, None
     
+    if not obtener_pool().circuito.disponible:
+        print(f"❌ MikroTik {settings.MIKROTIK_HOST}:{settings.MIKROTIK_PORT} marcado como no disponible")
+        return None, None
+    
     try:
         # Verificar conectividad antes de intentar
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -68,10 +94,74 @@ def conectar_mikrotik(timeout_secs: int = 10):
         return None, None
 
 
-def obtener_planes_disponibles() -> List[Dict]:
+def sesion_mikrotik(router: RouterMikrotik = None):
+    """
+    Presta una sesión persistente del pool de MikroTik.
+    
+    Uso:
+        with sesion_mikrotik(router) as api:
+            if not api:
+                ...  # router no disponible
+    
+    La sesión vuelve al pool al salir del bloque; si el socket se rompió
+    se descarta y la próxima operación reconecta automáticamente.
+    
+    Args:
+        router: Router del campamento (None = el principal)
+    """
+    return (router or catalogo_routers.principal()).pool().sesion()
+
+
+def _buscar_en_router(router: RouterMikrotik, usuario: str) -> Optional[Dict]:
+    with sesion_mikrotik(router) as api:
+        if not api:
+            return None
+        return router.indice().buscar(api, usuario)
+
+
+def _localizar_usuario(usuario: str) -> Tuple[Optional[RouterMikrotik], Optional[Dict]]:
+    """
+    Busca al usuario en todos los routers a la vez; gana el primero que lo
+    encuentra (no se espera a los routers lentos).
+    
+    Returns:
+        (router, fila de Userman) o (None, None) si no está en ninguno
+    """
+    routers = catalogo_routers.routers()
+    print(f"🗺️ Buscando '{usuario}' en {len(routers)} routers...")
+    executor = ThreadPoolExecutor(max_workers=len(routers), thread_name_prefix="mikrotik-localizar")
+    try:
+        futuros = {executor.submit(_buscar_en_router, router, usuario): router for router in routers}
+        for futuro in as_completed(futuros):
+            try:
+                user = futuro.result()
+            except Exception as e:
+                print(f"⚠️ Error buscando '{usuario}' en {futuros[futuro].nombre}: {e}")
+                continue
+            if user:
+                router = futuros[futuro]
+                catalogo_routers.recordar(usuario, router)
+                return router, user
+        return None, None
+    finally:
+        executor.shutdown(wait=False)
+
+
+def _router_de_usuario(usuario: str, zona: Zona = None) -> RouterMikrotik:
+    """Router donde está (o debería estar) el usuario"""
+    router = resolver_router(zona, usuario)
+    if router is None:
+        router, _ = _localizar_usuario(usuario)
+    return router or catalogo_routers.principal()
+
+
+def obtener_planes_disponibles(zona: Zona = None) -> List[Dict]:
     """
     Obtiene la lista de planes (profiles) disponibles en Userman.
     
+    Args:
+        zona: Campamento cuyo router se consulta (None = el principal)
+    
     Returns:
         Lista de dicts con:
           - nombre: Nombre del plan (ej: "1Dia", "3Dias")
@@ -80,16 +170,15 @@ def obtener_planes_disponibles() -> List[Dict]:
           - velocidad: Rate limit
           - usuarios_compartidos: Número de usuarios simultáneos
     """
-    connection, api = conectar_mikrotik()
-    
-    if not connection or not api:
-        print("⚠️ No se puede conectar a MikroTik para obtener planes")
-        return []
-    
     try:
-        # Obtener perfiles de Userman
-        profiles = api.get_resource('/tool/user-manager/profile').get()
-        connection.disconnect()
+        router = resolver_router(zona)
+        with sesion_mikrotik(router) as api:
+            if not api:
+                print("⚠️ No se puede conectar a MikroTik para obtener planes")
+                return []
+            
+            # Obtener perfiles de Userman
+            profiles = api.get_resource('/tool/user-manager/profile').get()
         
         planes = []
         for profile in profiles:
@@ -109,61 +198,55 @@ def obtener_planes_disponibles() -> List[Dict]:
         
     except Exception as e:
         print(f"❌ Error obteniendo planes: {e}")
-        try:
-            connection.disconnect()
-        except:
-            pass
         return []
 
 
-def buscar_usuario_existente(usuario: str) -> Optional[Dict]:
+def buscar_usuario_existente(usuario: str, zona: Zona = None) -> Optional[Dict]:
     """
     Busca un usuario existente en Userman.
     
     Args:
         usuario: Nombre de usuario a buscar
+        zona: Campamento del cliente (None = donde se lo vio antes, o en todos)
     
     Returns:
         Dict con datos del usuario o None si no existe:
           - nombre: nombre del usuario
           - disabled: si está desactivado
           - comment: comentario/info del usuario
+          - zona: campamento (router) donde está
     """
     print(f"🔍 Buscando usuario '{usuario}' en MikroTik...")
-    connection, api = conectar_mikrotik()
-    
-    if not connection or not api:
-        print(f"❌ No se pudo conectar a MikroTik para buscar usuario")
-        return None
     
     try:
-        users = api.get_resource('/tool/user-manager/user').get()
-        
-        for user in users:
-            # El campo correcto en Userman es 'username'
-            username = user.get('username')
-            
-            if username == usuario:
-                print(f"✅ Usuario '{usuario}' encontrado en MikroTik")
-                connection.disconnect()
-                return {
-                    "nombre": user.get('username'),
-                    "disabled": user.get('disabled'),
-                    "customer": user.get('customer'),
-                }
+        router = resolver_router(zona, usuario)
+        if router is None:
+            router, user = _localizar_usuario(usuario)
+        else:
+            with sesion_mikrotik(router) as api:
+                if not api:
+                    print(f"❌ No se pudo conectar a MikroTik ({router.nombre}) para buscar usuario")
+                    return None
+                
+                user = router.indice().buscar(api, usuario)
+        
+        if user:
+            catalogo_routers.recordar(usuario, router)
+            print(f"✅ Usuario '{usuario}' encontrado en MikroTik ({router.nombre})")
+            return {
+                "nombre": user.get('username'),
+                "disabled": user.get('disabled'),
+                "customer": user.get('customer'),
+                "zona": router.nombre,
+            }
         
         print(f"❌ Usuario '{usuario}' no encontrado en MikroTik")
-        connection.disconnect()
         return None
         
     except Exception as e:
         print(f"❌ Error buscando usuario: {e}")
         import traceback
         traceback.print_exc()
-        try:
-            connection.disconnect()
-        except:
-            pass
         return None
 
 
@@ -171,7 +254,8 @@ def crear_usuario_userman(
     usuario: str,
     password: str,
     nombre_completo: str,
-    plan: str = None
+    plan: str = None,
+    zona: Zona = None
 ) -> Tuple[bool, str]:
     """
     Crea un usuario en Userman.
@@ -182,59 +266,176 @@ def crear_usuario_userman(
         nombre_completo: Nombre del cliente
         plan: Nombre del plan en Userman (ej: "3Dias"). Si es None, el usuario 
               se crea sin plan (debe configurarse después)
+        zona: Campamento del cliente (None = el router principal)
     
     Returns:
         (éxito, mensaje)
     """
-    connection, api = conectar_mikrotik()
-    
-    if not connection or not api:
-        return False, "No se puede conectar a MikroTik"
-    
     try:
-        print(f"📝 Creando usuario '{usuario}' en Userman...")
-        
-        # Crear usuario en /tool/user-manager/user
-        api.get_resource('/tool/user-manager/user').add(
-            name=usuario,
-            password=password,
-            disabled='no',
-            comment=f"Bot: {nombre_completo}"
-        )
-        
-        print(f"✅ Usuario {usuario} creado")
-        
-        # Si se especifica plan, asignarlo
-        if plan:
-            try:
-                print(f"   Asignando plan '{plan}'...")
-                api.get_resource('/tool/user-manager/user').set(
-                    numbers=usuario,
-                    profile=plan
-                )
-                print(f"✅ Plan {plan} asignado")
-                mensaje = f"Usuario {usuario} creado con plan {plan}"
-            except Exception as e:
-                print(f"⚠️  No se pudo asignar plan: {e}")
-                mensaje = f"Usuario {usuario} creado (plan pendiente)"
-        else:
-            mensaje = f"Usuario {usuario} creado (sin plan)"
-        
-        connection.disconnect()
-        return True, mensaje
+        router = resolver_router(zona)
+        with sesion_mikrotik(router) as api:
+            if not api:
+                return False, "No se puede conectar a MikroTik"
+            
+            print(f"📝 Creando usuario '{usuario}' en Userman...")
+            
+            # Crear usuario en /tool/user-manager/user
+            api.get_resource('/tool/user-manager/user').add(
+                name=usuario,
+                password=password,
+                disabled='no',
+                comment=f"Bot: {nombre_completo}"
+            )
+            
+            print(f"✅ Usuario {usuario} creado")
+            
+            # Si se especifica plan, asignarlo
+            if plan:
+                try:
+                    print(f"   Asignando plan '{plan}'...")
+                    api.get_resource('/tool/user-manager/user').set(
+                        numbers=usuario,
+                        profile=plan
+                    )
+                    print(f"✅ Plan {plan} asignado")
+                    mensaje = f"Usuario {usuario} creado con plan {plan}"
+                except Exception as e:
+                    print(f"⚠️  No se pudo asignar plan: {e}")
+                    mensaje = f"Usuario {usuario} creado (plan pendiente)"
+            else:
+                mensaje = f"Usuario {usuario} creado (sin plan)"
+            
+            router.indice().invalidar(usuario)
+            catalogo_routers.recordar(usuario, router)
+            return True, mensaje
         
     except Exception as e:
         print(f"❌ Error creando usuario: {e}")
-        try:
-            connection.disconnect()
-        except:
-            pass
         return False, f"Error: {e}"
 
 
+def _perfiles_asignados(api, indice, usuario: str) -> Optional[List[str]]:
+    """
+    Nombres de los perfiles que el usuario tiene asignados (una sola lectura ?user=).
+    
+    Returns:
+        Lista de nombres (sin repetidos) o None si el router no expone
+        /tool/user-manager/user-profile
+    """
+    try:
+        filas = indice.consultar(api, RECURSO_PERFILES_USUARIO, {'user': usuario}, ('.id', 'profile'))
+    except RouterOsApiCommunicationError as e:
+        print(f"⚠️ No se pudieron leer perfiles asignados de '{usuario}': {e}")
+        return None
+    
+    nombres = []
+    for fila in filas:
+        nombre = fila.get('profile')
+        if nombre and nombre not in nombres:
+            nombres.append(nombre)
+    return nombres
+
+
+def _quitar_perfiles(api, indice, usuario_data: Dict, usuario: str) -> int:
+    """
+    Quita al usuario sus perfiles asignados usando la sesión recibida.
+    
+    Solo envía 'remove-profile-from-user' por los perfiles que realmente tiene.
+    Si el router no permite leerlos, se recurre a intentarlo con todos los
+    perfiles del sistema (comportamiento anterior).
+    
+    Returns:
+        Cantidad de perfiles eliminados
+    """
+    usuario_id = usuario_data.get('id') or usuario_data.get('.id')
+    user_resource = api.get_resource(RECURSO_USUARIOS)
+    
+    asignados = _perfiles_asignados(api, indice, usuario)
+    if asignados is None:
+        asignados = sorted(indice.perfiles(api))
+        print(f"   Perfiles del sistema: {asignados}")
+    else:
+        print(f"   Perfiles asignados: {asignados}")
+    
+    eliminados = 0
+    for profile_name in asignados:
+        try:
+            user_resource.call('remove-profile-from-user', {
+                '.id': usuario_id,
+                'profile': profile_name
+            })
+            print(f"   ✅ Removido perfil '{profile_name}' de usuario")
+            eliminados += 1
+        except RouterOsApiCommunicationError as e:
+            # Si no tiene ese perfil, ignorar
+            error_str = str(e).lower()
+            if 'no such' in error_str or 'not found' in error_str or 'does not have' in error_str:
+                pass  # Normal, el usuario no tiene ese perfil
+            else:
+                print(f"   ⚠️ Error removiendo '{profile_name}': {e}")
+    
+    indice.invalidar(usuario)
+    return eliminados
+
+
+def _activar_perfil(api, indice, usuario_data: Dict, usuario: str, nuevo_plan: str) -> Tuple[bool, str]:
+    """
+    Activa un perfil con 'create-and-activate-profile' usando la sesión recibida.
+    El perfil ya debe estar verificado.
+    
+    Returns:
+        (éxito, mensaje)
+    """
+    usuario_id = usuario_data.get('id') or usuario_data.get('.id')
+    customer = usuario_data.get('customer', 'admin')
+    
+    print(f"📌 ID: {usuario_id}, Customer: {customer}")
+    
+    # En RouterOS 6 User Manager, el comando correcto es:
+    # /tool/user-manager/user/create-and-activate-profile
+    # Requiere: .id (ID del usuario), profile (nombre del perfil), customer
+    user_resource = api.get_resource(RECURSO_USUARIOS)
+    
+    try:
+        result = user_resource.call('create-and-activate-profile', {
+            '.id': usuario_id,
+            'profile': nuevo_plan,
+            'customer': customer
+        })
+        print(f"✅ Resultado: {result}")
+        print(f"✅ Usuario '{usuario}' actualizado al plan '{nuevo_plan}'")
+        indice.invalidar(usuario)
+        return True, f"Plan {nuevo_plan} activado para {usuario}"
+        
+    except RouterOsApiCommunicationError as e:
+        error_msg = str(e)
+        print(f"❌ Error en create-and-activate-profile: {e}")
+        
+        # Si falla, intentar habilitar el usuario
+        if 'disabled' in usuario_data and usuario_data.get('disabled') == 'true':
+            try:
+                print("🔄 Intentando habilitar usuario primero...")
+                user_resource.set(id=usuario_id, disabled='no')
+                
+                # Reintentar asignación
+                user_resource.call('create-and-activate-profile', {
+                    '.id': usuario_id,
+                    'profile': nuevo_plan,
+                    'customer': customer
+                })
+                print(f"✅ Usuario habilitado y plan asignado")
+                indice.invalidar(usuario)
+                return True, f"Plan {nuevo_plan} activado para {usuario}"
+            except RouterOsApiCommunicationError as e2:
+                print(f"❌ Error habilitando: {e2}")
+        
+        return False, f"Error: {error_msg}"
+
+
 def actualizar_usuario_plan(
     usuario: str,
-    nuevo_plan: str
+    nuevo_plan: str,
+    zona: Zona = None
 ) -> Tuple[bool, str]:
     """
     Actualiza el plan de un usuario existente en User Manager (RouterOS 6).
@@ -243,155 +444,84 @@ def actualizar_usuario_plan(
     Args:
         usuario: Nombre del usuario
         nuevo_plan: Nombre del nuevo plan/perfil
+        zona: Campamento del cliente (None = se ubica al usuario)
     
     Returns:
         (éxito, mensaje)
     """
-    connection, api = conectar_mikrotik()
-    
-    if not connection or not api:
-        return False, "No se puede conectar a MikroTik"
-    
     try:
-        print(f"🔄 Actualizando usuario '{usuario}' al plan '{nuevo_plan}'...")
-        
-        # Buscar el usuario para obtener su ID y customer
-        users = api.get_resource('/tool/user-manager/user').get()
-        usuario_data = None
-        
-        for user in users:
-            if user.get('username') == usuario or user.get('name') == usuario:
-                usuario_data = user
-                print(f"✅ Usuario encontrado: {user.get('username')}")
-                break
-        
-        if not usuario_data:
-            print(f"❌ Usuario '{usuario}' no encontrado en Userman")
-            connection.disconnect()
-            return False, f"Usuario {usuario} no existe"
-        
-        # Obtener datos necesarios
-        usuario_id = usuario_data.get('id') or usuario_data.get('.id')
-        customer = usuario_data.get('customer', 'admin')
-        
-        print(f"📌 ID: {usuario_id}, Customer: {customer}")
-        
-        # Verificar que el perfil existe
-        profiles = api.get_resource('/tool/user-manager/profile').get()
-        profile_exists = False
-        
-        for profile in profiles:
-            if profile.get('name') == nuevo_plan:
-                profile_exists = True
-                print(f"✅ Perfil '{nuevo_plan}' encontrado")
-                break
-        
-        if not profile_exists:
-            print(f"❌ Perfil '{nuevo_plan}' no existe en Userman")
-            # Listar perfiles disponibles para ayudar
-            nombres = [p.get('name') for p in profiles]
-            print(f"   Perfiles disponibles: {nombres}")
-            connection.disconnect()
-            return False, f"Plan {nuevo_plan} no existe"
-        
-        # En RouterOS 6 User Manager, el comando correcto es:
-        # /tool/user-manager/user/create-and-activate-profile
-        # Requiere: .id (ID del usuario), profile (nombre del perfil), customer
-        user_resource = api.get_resource('/tool/user-manager/user')
-        
-        try:
-            result = user_resource.call('create-and-activate-profile', {
-                '.id': usuario_id,
-                'profile': nuevo_plan,
-                'customer': customer
-            })
-            print(f"✅ Resultado: {result}")
-            print(f"✅ Usuario '{usuario}' actualizado al plan '{nuevo_plan}'")
-            connection.disconnect()
-            return True, f"Plan {nuevo_plan} activado para {usuario}"
+        router = _router_de_usuario(usuario, zona)
+        with sesion_mikrotik(router) as api:
+            if not api:
+                return False, "No se puede conectar a MikroTik"
             
-        except Exception as e:
-            error_msg = str(e)
-            print(f"❌ Error en create-and-activate-profile: {e}")
+            print(f"🔄 Actualizando usuario '{usuario}' al plan '{nuevo_plan}'...")
             
-            # Si falla, intentar habilitar el usuario
-            if 'disabled' in usuario_data and usuario_data.get('disabled') == 'true':
-                try:
-                    print("🔄 Intentando habilitar usuario primero...")
-                    user_resource.set(id=usuario_id, disabled='no')
-                    
-                    # Reintentar asignación
-                    result = user_resource.call('create-and-activate-profile', {
-                        '.id': usuario_id,
-                        'profile': nuevo_plan,
-                        'customer': customer
-                    })
-                    print(f"✅ Usuario habilitado y plan asignado")
-                    connection.disconnect()
-                    return True, f"Plan {nuevo_plan} activado para {usuario}"
-                except Exception as e2:
-                    print(f"❌ Error habilitando: {e2}")
+            # Buscar el usuario para obtener su ID y customer
+            indice = router.indice()
+            usuario_data = indice.buscar(api, usuario)
+            
+            if not usuario_data:
+                print(f"❌ Usuario '{usuario}' no encontrado en Userman")
+                return False, f"Usuario {usuario} no existe"
+            
+            print(f"✅ Usuario encontrado: {usuario_data.get('username')}")
+            
+            # Verificar que el perfil existe
+            if not indice.existe_perfil(api, nuevo_plan):
+                print(f"❌ Perfil '{nuevo_plan}' no existe en Userman")
+                # Listar perfiles disponibles para ayudar
+                print(f"   Perfiles disponibles: {sorted(indice.perfiles(api))}")
+                return False, f"Plan {nuevo_plan} no existe"
             
-            connection.disconnect()
-            return False, f"Error: {error_msg}"
+            print(f"✅ Perfil '{nuevo_plan}' encontrado")
+            
+            return _activar_perfil(api, indice, usuario_data, usuario, nuevo_plan)
         
     except Exception as e:
         print(f"❌ Error actualizando usuario: {e}")
-        try:
-            connection.disconnect()
-        except:
-            pass
         return False, f"Error: {e}"
 
 
-def habilitar_usuario(usuario: str) -> Tuple[bool, str]:
+def habilitar_usuario(usuario: str, zona: Zona = None) -> Tuple[bool, str]:
     """
     Habilita un usuario deshabilitado en User Manager.
     
     Args:
         usuario: Nombre del usuario
+        zona: Campamento del cliente (None = se ubica al usuario)
     
     Returns:
         (éxito, mensaje)
     """
-    connection, api = conectar_mikrotik()
-    
-    if not connection or not api:
-        return False, "No se puede conectar a MikroTik"
-    
     try:
-        print(f"🔄 Habilitando usuario '{usuario}'...")
-        
-        users = api.get_resource('/tool/user-manager/user').get()
-        usuario_data = None
-        
-        for user in users:
-            if user.get('username') == usuario or user.get('name') == usuario:
-                usuario_data = user
-                break
-        
-        if not usuario_data:
-            connection.disconnect()
-            return False, f"Usuario {usuario} no existe"
-        
-        usuario_id = usuario_data.get('id') or usuario_data.get('.id')
-        user_resource = api.get_resource('/tool/user-manager/user')
-        user_resource.set(id=usuario_id, disabled='no')
-        
-        print(f"✅ Usuario '{usuario}' habilitado")
-        connection.disconnect()
-        return True, f"Usuario {usuario} habilitado"
+        router = _router_de_usuario(usuario, zona)
+        with sesion_mikrotik(router) as api:
+            if not api:
+                return False, "No se puede conectar a MikroTik"
+            
+            print(f"🔄 Habilitando usuario '{usuario}'...")
+            
+            indice = router.indice()
+            usuario_data = indice.buscar(api, usuario)
+            
+            if not usuario_data:
+                return False, f"Usuario {usuario} no existe"
+            
+            usuario_id = usuario_data.get('id') or usuario_data.get('.id')
+            user_resource = api.get_resource('/tool/user-manager/user')
+            user_resource.set(id=usuario_id, disabled='no')
+            indice.invalidar(usuario)
+            
+            print(f"✅ Usuario '{usuario}' habilitado")
+            return True, f"Usuario {usuario} habilitado"
         
     except Exception as e:
         print(f"❌ Error habilitando usuario: {e}")
-        try:
-            connection.disconnect()
-        except:
-            pass
         return False, f"Error: {e}"
 
 
-def eliminar_perfiles_usuario(usuario: str) -> Tuple[bool, str]:
+def eliminar_perfiles_usuario(usuario: str, zona: Zona = None) -> Tuple[bool, str]:
     """
     Elimina TODOS los perfiles asignados a un usuario en User Manager (RouterOS 6).
     
@@ -400,63 +530,27 @@ def eliminar_perfiles_usuario(usuario: str) -> Tuple[bool, str]:
     
     Args:
         usuario: Nombre del usuario
+        zona: Campamento del cliente (None = se ubica al usuario)
     
     Returns:
         (éxito, mensaje con cantidad eliminados)
     """
-    connection, api = conectar_mikrotik()
-    
-    if not connection or not api:
-        return False, "No se puede conectar a MikroTik"
-    
     try:
-        print(f"🗑️ Eliminando perfiles de usuario '{usuario}'...")
-        
-        # En RouterOS 6, primero buscamos el usuario
-        users = api.get_resource('/tool/user-manager/user').get()
-        usuario_data = None
-        
-        for user in users:
-            if user.get('username') == usuario or user.get('name') == usuario:
-                usuario_data = user
-                break
-        
-        if not usuario_data:
-            connection.disconnect()
-            return False, f"Usuario {usuario} no encontrado"
-        
-        usuario_id = usuario_data.get('id') or usuario_data.get('.id')
-        
-        # Usar el comando remove-user-from-profile para cada perfil activo
-        # Primero obtenemos los perfiles del sistema
-        profiles = api.get_resource('/tool/user-manager/profile').get()
-        profile_names = [p.get('name') for p in profiles]
-        
-        print(f"   Perfiles del sistema: {profile_names}")
-        
-        # Intentar remover el usuario de todos los perfiles conocidos
-        user_resource = api.get_resource('/tool/user-manager/user')
-        eliminados = 0
-        
-        # En RouterOS 6 Userman, usamos "remove-profile-from-user" 
-        for profile_name in profile_names:
-            try:
-                # Intentar remover este perfil del usuario
-                result = user_resource.call('remove-profile-from-user', {
-                    '.id': usuario_id,
-                    'profile': profile_name
-                })
-                print(f"   ✅ Removido perfil '{profile_name}' de usuario")
-                eliminados += 1
-            except Exception as e:
-                # Si no tiene ese perfil, ignorar
-                error_str = str(e).lower()
-                if 'no such' in error_str or 'not found' in error_str or 'does not have' in error_str:
-                    pass  # Normal, el usuario no tiene ese perfil
-                else:
-                    print(f"   ⚠️ Error removiendo '{profile_name}': {e}")
-        
-        connection.disconnect()
+        router = _router_de_usuario(usuario, zona)
+        with sesion_mikrotik(router) as api:
+            if not api:
+                return False, "No se puede conectar a MikroTik"
+            
+            print(f"🗑️ Eliminando perfiles de usuario '{usuario}'...")
+            
+            # En RouterOS 6, primero buscamos el usuario
+            indice = router.indice()
+            usuario_data = indice.buscar(api, usuario)
+            
+            if not usuario_data:
+                return False, f"Usuario {usuario} no encontrado"
+            
+            eliminados = _quitar_perfiles(api, indice, usuario_data, usuario)
         
         if eliminados > 0:
             return True, f"{eliminados} perfiles eliminados"
@@ -465,14 +559,10 @@ def eliminar_perfiles_usuario(usuario: str) -> Tuple[bool, str]:
         
     except Exception as e:
         print(f"❌ Error eliminando perfiles: {e}")
-        try:
-            connection.disconnect()
-        except:
-            pass
         return False, f"Error: {e}"
 
 
-def reemplazar_plan_usuario(usuario: str, nuevo_plan: str) -> Tuple[bool, str]:
+def reemplazar_plan_usuario(usuario: str, nuevo_plan: str, zona: Zona = None) -> Tuple[bool, str]:
     """
     REEMPLAZA el plan de un usuario: elimina perfiles anteriores y asigna el nuevo.
     
@@ -480,25 +570,51 @@ def reemplazar_plan_usuario(usuario: str, nuevo_plan: str) -> Tuple[bool, str]:
     1. Eliminar el perfil temporal (1 día de prueba)
     2. Asignar el plan completo que el cliente pagó
     
+    Todo ocurre en una sola sesión: se lee el usuario una vez, se verifica el
+    plan, se quitan solo los perfiles que tiene asignados y se activa el nuevo.
+    
     Args:
         usuario: Nombre del usuario
         nuevo_plan: Nombre del nuevo plan (ej: "1User5Dia")
+        zona: Campamento del cliente (None = se ubica al usuario)
     
     Returns:
         (éxito, mensaje)
     """
     print(f"🔄 REEMPLAZANDO plan de '{usuario}' a '{nuevo_plan}'...")
     
+    try:
+        router = _router_de_usuario(usuario, zona)
+        with sesion_mikrotik(router) as api:
+            if not api:
+                return False, "No se puede conectar a MikroTik"
+            return _reemplazar_en_sesion(api, router.indice(), usuario, nuevo_plan)
+        
+    except Exception as e:
+        print(f"❌ Error reemplazando plan: {e}")
+        return False, f"Error: {e}"
+
+
+def _reemplazar_en_sesion(api, indice, usuario: str, nuevo_plan: str) -> Tuple[bool, str]:
+    """Cuerpo de reemplazar_plan_usuario sobre una sesión ya prestada"""
+    usuario_data = indice.buscar(api, usuario)
+    
+    if not usuario_data:
+        print(f"❌ Usuario '{usuario}' no encontrado en Userman")
+        return False, f"Usuario {usuario} no existe"
+    
+    # Verificar el plan ANTES de quitar nada, para no dejar al cliente sin perfil
+    if not indice.existe_perfil(api, nuevo_plan):
+        print(f"❌ Perfil '{nuevo_plan}' no existe en Userman")
+        print(f"   Perfiles disponibles: {sorted(indice.perfiles(api))}")
+        return False, f"Plan {nuevo_plan} no existe"
+    
     # Paso 1: Eliminar perfiles existentes
-    exito_eliminar, msg_eliminar = eliminar_perfiles_usuario(usuario)
-    if not exito_eliminar:
-        print(f"⚠️ Error al eliminar perfiles previos: {msg_eliminar}")
-        # Continuar de todas formas, puede que no tenga perfiles
-    else:
-        print(f"   {msg_eliminar}")
+    eliminados = _quitar_perfiles(api, indice, usuario_data, usuario)
+    print(f"   {eliminados} perfiles eliminados" if eliminados else "   Sin perfiles previos")
     
     # Paso 2: Asignar el nuevo plan
-    exito_asignar, msg_asignar = actualizar_usuario_plan(usuario, nuevo_plan)
+    exito_asignar, msg_asignar = _activar_perfil(api, indice, usuario_data, usuario, nuevo_plan)
     
     if exito_asignar:
         print(f"✅ Plan reemplazado exitosamente: {nuevo_plan}")
@@ -508,52 +624,137 @@ def reemplazar_plan_usuario(usuario: str, nuevo_plan: str) -> Tuple[bool, str]:
         return False, msg_asignar
 
 
-def obtener_info_usuario(usuario: str) -> Optional[Dict]:
+def reemplazar_planes_lote(pedidos: List[Tuple[str, str]], zona: Zona = None) -> List[Dict]:
+    """
+    reemplazar_plan_usuario para varios usuarios, agrupados por router: cada
+    router recibe todo su lote en una sola sesión prestada (una ráfaga de
+    aprobaciones no pide una sesión por venta).
+    
+    Si la sesión se rompe a mitad del lote, los pedidos que faltaban fallan
+    con ese error y se reintentan después. Un '!trap' del router (la sesión
+    sigue sana) solo hace fallar al pedido de ese usuario.
+    
+    Args:
+        pedidos: [(usuario, plan), ...]
+        zona: Campamento de todos los pedidos (None = cada usuario en su router)
+    
+    Returns:
+        Un resultado por pedido, en el mismo orden:
+        {"exito": bool, "mensaje": str, "router_caido": bool}
+    """
+    resultados: List[Optional[Dict]] = [None] * len(pedidos)
+    grupos: Dict[str, Tuple[RouterMikrotik, List[int]]] = {}
+    for i, (usuario, _) in enumerate(pedidos):
+        try:
+            router = _router_de_usuario(usuario, zona)
+        except Exception as e:
+            resultados[i] = {"exito": False, "mensaje": f"Error: {e}", "router_caido": False}
+            continue
+        grupos.setdefault(router.clave, (router, []))[1].append(i)
+    
+    for router, indices in grupos.values():
+        print(f"📦 Activando lote de {len(indices)} en {router.nombre}...")
+        pendientes = list(indices)
+        try:
+            with sesion_mikrotik(router) as api:
+                if api:
+                    indice = router.indice()
+                    while pendientes:
+                        usuario, plan = pedidos[pendientes[0]]
+                        try:
+                            exito, msg = _reemplazar_en_sesion(api, indice, usuario, plan)
+                        except (RouterOsApiConnectionError, socket.error):
+                            raise  # conexión perdida: el pool descarta la sesión
+                        except Exception as e:
+                            print(f"❌ Error reemplazando plan de {usuario}: {e}")
+                            exito, msg = False, f"Error: {e}"
+                        resultados[pendientes.pop(0)] = {"exito": exito, "mensaje": msg, "router_caido": False}
+            error = "No se puede conectar a MikroTik"
+        except Exception as e:
+            print(f"❌ Lote interrumpido en {router.nombre}: {e}")
+            error = f"Error: {e}"
+        
+        caido = not router.pool().circuito.disponible
+        for i in pendientes:
+            resultados[i] = {"exito": False, "mensaje": error, "router_caido": caido}
+    
+    return resultados
+
+
+def perfiles_vigentes(zona: Zona = None) -> Optional[Dict[str, List[str]]]:
+    """
+    Perfiles vigentes de todos los usuarios, con una sola lectura de
+    /tool/user-manager/user-profile por router (para conciliar vencimientos).
+    
+    Un perfil con estado 'used' ya se consumió; 'running-active' y 'waiting'
+    (aún no empieza) siguen vigentes. Si el router no informa el estado, la
+    fila cuenta como vigente.
+    
+    Args:
+        zona: Campamento (None = todos los routers)
+    
+    Returns:
+        {usuario: [perfiles vigentes]} o None si algún router no respondió
+        (o la zona no tiene router: mejor no vencer nada que leer otro router)
+    """
+    vigentes: Dict[str, List[str]] = {}
+    
+    try:
+        routers = [resolver_router(zona)] if zona not in (None, "") else catalogo_routers.routers()
+        for router in routers:
+            with sesion_mikrotik(router) as api:
+                if not api:
+                    return None
+                filas = router.indice().consultar(api, RECURSO_PERFILES_USUARIO, campos=('user', 'profile', 'state'))
+            for fila in filas:
+                if fila.get('user') and fila.get('state') != 'used':
+                    vigentes.setdefault(fila['user'], []).append(fila.get('profile'))
+    except Exception as e:
+        print(f"❌ Error leyendo perfiles vigentes: {e}")
+        return None
+    
+    return vigentes
+
+
+def obtener_info_usuario(usuario: str, zona: Zona = None) -> Optional[Dict]:
     """
     Obtiene información detallada de un usuario en User Manager.
     Incluye perfil activo, tiempo restante, etc.
     
     Args:
         usuario: Nombre del usuario
+        zona: Campamento del cliente (None = se ubica al usuario)
     
     Returns:
         Dict con información del usuario o None
     """
-    connection, api = conectar_mikrotik()
-    
-    if not connection or not api:
-        return None
-    
     try:
-        print(f"🔍 Obteniendo info de usuario '{usuario}'...")
-        
-        users = api.get_resource('/tool/user-manager/user').get()
-        usuario_data = None
-        
-        for user in users:
-            if user.get('username') == usuario or user.get('name') == usuario:
-                usuario_data = user
-                break
-        
-        if not usuario_data:
-            connection.disconnect()
-            return None
-        
-        # Obtener perfiles activos del usuario
-        try:
-            user_profiles = api.get_resource('/tool/user-manager/user-profile').get()
-            perfiles_usuario = [p for p in user_profiles if p.get('user') == usuario]
-            usuario_data['perfiles_activos'] = perfiles_usuario
-        except:
-            usuario_data['perfiles_activos'] = []
-        
-        connection.disconnect()
-        return usuario_data
+        router = _router_de_usuario(usuario, zona)
+        with sesion_mikrotik(router) as api:
+            if not api:
+                return None
+            
+            print(f"🔍 Obteniendo info de usuario '{usuario}'...")
+            
+            # Fila completa, pero solo la de este usuario (?username=)
+            indice = router.indice()
+            filas = indice.consultar(api, RECURSO_USUARIOS, {'username': usuario})
+            
+            if not filas:
+                return None
+            
+            usuario_data = filas[0]
+            
+            # Obtener perfiles activos del usuario (?user=)
+            try:
+                usuario_data['perfiles_activos'] = indice.consultar(
+                    api, RECURSO_PERFILES_USUARIO, {'user': usuario}
+                )
+            except RouterOsApiCommunicationError:
+                usuario_data['perfiles_activos'] = []
+            
+            return usuario_data
         
     except Exception as e:
         print(f"❌ Error obteniendo info: {e}")
-        try:
-            connection.disconnect()
-        except:
-            pass
         return None
@@ -0,0 +1,251 @@
+"""
+Índice en memoria de usuarios y perfiles de Userman.
+
+En lugar de descargar /tool/user-manager/user completo y recorrerlo en cada
+búsqueda, se mantiene una foto local indexada por username, más el conjunto
+de nombres de perfiles:
+
+  - Las búsquedas son hits O(1) en un dict
+  - La foto completa se renueva solo cuando vence el TTL
+  - Las escrituras del bot invalidan únicamente al usuario afectado, que se
+    vuelve a leer solo (query ?username=) la próxima vez que se consulte
+  - Un usuario que no está en la foto (creado desde Winbox, por ejemplo) se
+    busca directamente en el router antes de darlo por inexistente
+
+Las lecturas usan queries del lado del router (?username=, ?user=) y
+.proplist para que solo viajen las filas y columnas necesarias. Si el router
+rechaza la query, se cae al recorrido completo de siempre.
+
+El lock del índice solo protege los dicts: las lecturas al router se hacen
+fuera de él, así una consulta lenta no frena las búsquedas que ya son hits.
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+from app.core.config import settings
+from app.services.mikrotik_pool import RouterOsApiCommunicationError
+
+RECURSO_USUARIOS = '/tool/user-manager/user'
+RECURSO_PERFILES = '/tool/user-manager/profile'
+RECURSO_PERFILES_USUARIO = '/tool/user-manager/user-profile'
+
+# Columnas que el bot necesita de cada usuario (búsquedas y cambios de plan)
+COLUMNAS_USUARIO = ('.id', 'username', 'name', 'customer', 'disabled')
+
+# routeros_api entrega '.id' como 'id' en las filas leídas
+ALIAS_CAMPOS = {'.id': 'id'}
+
+
+def _nombre_usuario(user: Dict) -> Optional[str]:
+    """En Userman el campo es 'username'; algunas versiones usan 'name'"""
+    return user.get('username') or user.get('name')
+
+
+def _proyectar(fila: Dict, campos: Iterable[str]) -> Dict:
+    """Columnas pedidas de una fila, con el nombre que trae la fila ('.id' o 'id')"""
+    proyectada = {}
+    for campo in campos:
+        clave = campo if campo in fila else ALIAS_CAMPOS.get(campo)
+        if clave in fila:
+            proyectada[clave] = fila[clave]
+    return proyectada
+
+
+class IndiceUserman:
+    """
+    Foto indexada de Userman para un router.
+
+    Todos los métodos reciben la `api` de una sesión ya prestada por el pool,
+    así una operación usa una sola sesión para leer el índice y escribir.
+    """
+
+    def __init__(self, ttl_usuarios_secs: float = 300, ttl_perfiles_secs: float = 600):
+        self.ttl_usuarios_secs = ttl_usuarios_secs
+        self.ttl_perfiles_secs = ttl_perfiles_secs
+
+        self._por_nombre: Dict[str, Dict] = {}
+        self._perfiles: Set[str] = set()
+        self._invalidados: Set[str] = set()
+        self._ts_usuarios = 0.0
+        self._ts_perfiles = 0.0
+        self._lock = threading.RLock()
+        # Recursos cuyo print filtrado fue rechazado por este router
+        self._sin_filtros: Set[str] = set()
+
+    # ------------------------------------------------------------------
+    # Lecturas filtradas del lado del router
+    # ------------------------------------------------------------------
+
+    def filtros_soportados(self, recurso: str) -> bool:
+        return recurso not in self._sin_filtros
+
+    def consultar(
+        self,
+        api,
+        recurso: str,
+        filtros: Dict[str, str] = None,
+        campos: Iterable[str] = None
+    ) -> List[Dict]:
+        """
+        Ejecuta 'print' con filtros (?campo=valor) y .proplist en el router.
+
+        Si el router rechaza la query ('!trap'), se descarga el recurso
+        completo y se filtra aquí; el rechazo se recuerda para no reintentar.
+
+        Args:
+            api: API de una sesión prestada por el pool
+            recurso: Ruta RouterOS (ej: '/tool/user-manager/user')
+            filtros: Igualdades a aplicar (ej: {'username': 'pepa'})
+            campos: Columnas a traer (None = todas)
+
+        Returns:
+            Lista de filas (dicts)
+        """
+        filtros = filtros or {}
+        campos = tuple(campos) if campos else ()
+        resource = api.get_resource(recurso)
+
+        if recurso not in self._sin_filtros:
+            argumentos = {'.proplist': ','.join(campos)} if campos else {}
+            try:
+                return resource.call('print', argumentos, filtros)
+            except RouterOsApiCommunicationError as e:
+                print(f"⚠️ Router rechazó print filtrado en {recurso} ({e}), usando recorrido completo")
+                self._sin_filtros.add(recurso)
+
+        filas = [
+            fila for fila in resource.get()
+            if all(fila.get(k, fila.get(ALIAS_CAMPOS.get(k))) == v for k, v in filtros.items())
+        ]
+        if campos:
+            filas = [_proyectar(fila, campos) for fila in filas]
+        return filas
+
+    # ------------------------------------------------------------------
+    # Usuarios
+    # ------------------------------------------------------------------
+
+    def _refrescar_usuarios(self, api):
+        """Descarga la foto completa de usuarios (solo al vencer el TTL)"""
+        with self._lock:
+            invalidados = set(self._invalidados)
+        users = self.consultar(api, RECURSO_USUARIOS, campos=COLUMNAS_USUARIO)
+        por_nombre = {}
+        for user in users:
+            nombre = _nombre_usuario(user)
+            if nombre:
+                por_nombre[nombre] = user
+
+        with self._lock:
+            self._por_nombre = por_nombre
+            # Las escrituras que llegaron durante la descarga siguen invalidadas
+            self._invalidados -= invalidados
+            self._ts_usuarios = time.monotonic()
+        print(f"📇 Índice Userman: {len(por_nombre)} usuarios cargados")
+
+    def _releer_usuario(self, api, usuario: str) -> Optional[Dict]:
+        """Vuelve a leer un solo usuario del router y actualiza el índice"""
+        filas = (
+            self.consultar(api, RECURSO_USUARIOS, {'username': usuario}, COLUMNAS_USUARIO)
+            or self.consultar(api, RECURSO_USUARIOS, {'name': usuario}, COLUMNAS_USUARIO)
+        )
+        user = filas[0] if filas else None
+
+        with self._lock:
+            self._por_nombre.pop(usuario, None)
+            if user is not None:
+                self._por_nombre[usuario] = user
+            self._invalidados.discard(usuario)
+        return user
+
+    def buscar(self, api, usuario: str) -> Optional[Dict]:
+        """
+        Busca un usuario por username.
+
+        Returns:
+            Fila de Userman con COLUMNAS_USUARIO o None si no existe
+        """
+        with self._lock:
+            vencido = time.monotonic() - self._ts_usuarios > self.ttl_usuarios_secs
+        if vencido:
+            self._refrescar_usuarios(api)
+
+        with self._lock:
+            user = self._por_nombre.get(usuario)
+            vigente = user is not None and usuario not in self._invalidados
+        if vigente:
+            return user
+
+        # Cambió (o puede haberse creado por fuera): leer solo esa fila
+        if self.filtros_soportados(RECURSO_USUARIOS):
+            return self._releer_usuario(api, usuario)
+        self._refrescar_usuarios(api)
+        with self._lock:
+            return self._por_nombre.get(usuario)
+
+    def invalidar(self, usuario: str = None):
+        """
+        Marca datos como desactualizados tras una escritura.
+
+        Args:
+            usuario: Usuario modificado. Si es None se invalida todo el índice.
+        """
+        with self._lock:
+            if usuario is None:
+                self._ts_usuarios = 0.0
+            else:
+                self._invalidados.add(usuario)
+
+    # ------------------------------------------------------------------
+    # Perfiles
+    # ------------------------------------------------------------------
+
+    def perfiles(self, api) -> Set[str]:
+        """Conjunto de nombres de perfiles (planes) definidos en Userman"""
+        with self._lock:
+            if time.monotonic() - self._ts_perfiles <= self.ttl_perfiles_secs:
+                return self._perfiles
+        profiles = self.consultar(api, RECURSO_PERFILES, campos=('name',))
+        with self._lock:
+            self._perfiles = {p.get('name') for p in profiles if p.get('name')}
+            self._ts_perfiles = time.monotonic()
+            return self._perfiles
+
+    def existe_perfil(self, api, nombre: str) -> bool:
+        if nombre in self.perfiles(api):
+            return True
+        # Puede haberse creado después de la última carga
+        self.invalidar_perfiles()
+        return nombre in self.perfiles(api)
+
+    def invalidar_perfiles(self):
+        with self._lock:
+            self._ts_perfiles = 0.0
+
+
+# ============================================================================
+# Registro de índices (uno por router, igual que los pools)
+# ============================================================================
+
+_indices: Dict[tuple, IndiceUserman] = {}
+_indices_lock = threading.Lock()
+
+
+def obtener_indice(host: str = None, port: int = None) -> IndiceUserman:
+    """Retorna el índice del router indicado (por defecto el de settings)"""
+    clave = (host or settings.MIKROTIK_HOST, port or settings.MIKROTIK_PORT)
+
+    indice = _indices.get(clave)
+    if indice is not None:
+        return indice
+
+    with _indices_lock:
+        indice = _indices.get(clave)
+        if indice is None:
+            indice = IndiceUserman(
+                ttl_usuarios_secs=settings.USERMAN_INDICE_TTL_SECS,
+                ttl_perfiles_secs=settings.USERMAN_PERFILES_TTL_SECS,
+            )
+            _indices[clave] = indice
+        return indice
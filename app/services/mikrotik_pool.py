@@ -0,0 +1,545 @@
+"""
+Pool de conexiones persistentes a la API de RouterOS.
+
+Antes cada operación de Userman abría un socket de prueba, creaba un
+RouterOsApiPool nuevo, hacía login y desconectaba. Este módulo mantiene
+sesiones ya autenticadas y las presta a las funciones de mikrotik.py:
+
+  - max_conexiones: tope de sesiones simultáneas contra el router
+  - keepalive: las sesiones inactivas se verifican con un comando barato
+  - idle: las sesiones sin uso por mucho tiempo se cierran
+  - reconexión: si el socket se rompe, la sesión se descarta y la siguiente
+    operación abre una nueva automáticamente
+  - circuit breaker: tras varios fallos seguidos de conexión el router se
+    marca como no disponible y las operaciones fallan al instante (sin
+    esperar el timeout). El hilo de mantenimiento sondea el router con
+    esperas crecientes y con jitter; cuando responde, el circuito se cierra
+    y se avisa a los interesados (ej: reintento de activaciones pendientes)
+
+Uso:
+    with obtener_pool().sesion() as api:
+        if not api:
+            ...  # router no disponible
+        api.get_resource('/tool/user-manager/user').get()
+"""
+
+try:
+    import routeros_api
+    from routeros_api.exceptions import RouterOsApiCommunicationError, RouterOsApiConnectionError
+except ImportError:
+    routeros_api = None
+
+    class RouterOsApiCommunicationError(Exception):
+        """Placeholder cuando routeros_api no está instalado"""
+
+    class RouterOsApiConnectionError(Exception):
+        """Placeholder cuando routeros_api no está instalado"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from app.core.config import settings
+
+CERRADO = "cerrado"          # router sano: todo pasa
+ABIERTO = "abierto"          # router caído: se falla al instante
+SEMIABIERTO = "semiabierto"  # una sola operación de prueba en curso
+
+
+class _Conexion:
+    """Sesión autenticada contra el router más sus marcas de tiempo"""
+
+    __slots__ = ("connection", "api", "ultimo_uso", "ultimo_ping")
+
+    def __init__(self, connection, api):
+        ahora = time.monotonic()
+        self.connection = connection
+        self.api = api
+        self.ultimo_uso = ahora
+        self.ultimo_ping = ahora
+
+
+class CircuitoRouter:
+    """
+    Circuit breaker de un router (thread-safe).
+
+    Args:
+        nombre: Router (para logs)
+        fallos_max: Fallos seguidos que abren el circuito
+        espera_secs: Espera antes del primer sondeo
+        espera_max_secs: Tope de la espera (se duplica con cada sondeo fallido)
+        al_cerrar: Se llama (fuera del lock) cuando el router vuelve
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        fallos_max: int = 3,
+        espera_secs: float = 15,
+        espera_max_secs: float = 120,
+        al_cerrar: Callable[[], None] = None,
+    ):
+        self.nombre = nombre
+        self.fallos_max = max(1, fallos_max)
+        self.espera_secs = espera_secs
+        self.espera_max_secs = espera_max_secs
+        self.al_cerrar = al_cerrar
+
+        self._estado = CERRADO
+        self._fallos = 0
+        self._aperturas = 0
+        self._espera_actual = espera_secs
+        self._proximo_sondeo = 0.0
+        self._sondeo_desde = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self) -> str:
+        return self._estado
+
+    @property
+    def disponible(self) -> bool:
+        """False mientras el circuito está abierto (sin sondeo pendiente)"""
+        return self._estado != ABIERTO or time.monotonic() >= self._proximo_sondeo
+
+    def segundos_para_sondeo(self) -> float:
+        return max(0.0, self._proximo_sondeo - time.monotonic())
+
+    def permitir(self) -> bool:
+        """
+        ¿Se puede intentar una operación contra el router? Con el circuito
+        abierto responde False en microsegundos; al vencer la espera deja
+        pasar una única operación de prueba.
+        """
+        if self._estado == CERRADO:
+            return True
+        ahora = time.monotonic()
+        with self._lock:
+            if self._estado == ABIERTO and ahora >= self._proximo_sondeo:
+                self._estado = SEMIABIERTO
+                self._sondeo_desde = ahora
+                return True
+            if self._estado == SEMIABIERTO and ahora - self._sondeo_desde > self.espera_max_secs:
+                # La prueba anterior nunca informó su resultado
+                self._sondeo_desde = ahora
+                return True
+            return self._estado == CERRADO
+
+    def liberar_sondeo(self):
+        """
+        La operación de prueba no llegó a tocar el router (ej: pool agotado):
+        el circuito vuelve a abierto con el sondeo disponible de inmediato,
+        sin contar un fallo.
+        """
+        with self._lock:
+            if self._estado == SEMIABIERTO:
+                self._estado = ABIERTO
+                self._proximo_sondeo = time.monotonic()
+
+    def registrar_exito(self):
+        if self._estado == CERRADO and self._fallos == 0:
+            return
+        with self._lock:
+            reabierto = self._estado != CERRADO
+            self._estado = CERRADO
+            self._fallos = 0
+            self._espera_actual = self.espera_secs
+        if reabierto:
+            print(f"🟢 Router {self.nombre} disponible de nuevo, circuito cerrado")
+            if self.al_cerrar:
+                self.al_cerrar()
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self._estado == SEMIABIERTO:
+                self._espera_actual = min(self._espera_actual * 2, self.espera_max_secs)
+            elif self._estado == ABIERTO or self._fallos < self.fallos_max:
+                return
+            else:
+                self._aperturas += 1
+            self._estado = ABIERTO
+            # Jitter: los procesos (y routers) no sondean todos a la vez
+            espera = self._espera_actual * random.uniform(0.8, 1.2)
+            self._proximo_sondeo = time.monotonic() + espera
+        print(f"🔴 Router {self.nombre} no disponible ({self._fallos} fallos), próximo sondeo en {espera:.0f}s")
+
+    def estadisticas(self) -> Dict:
+        return {
+            "estado": self._estado,
+            "fallos_seguidos": self._fallos,
+            "aperturas": self._aperturas,
+            "proximo_sondeo_secs": round(self.segundos_para_sondeo(), 1) if self._estado != CERRADO else None,
+        }
+
+
+# Interesados en saber cuándo vuelve un router (ej: reintento de activaciones)
+_al_recuperarse: List[Callable[["PoolMikrotik"], None]] = []
+
+
+def al_recuperarse_router(callback: Callable[["PoolMikrotik"], None]):
+    """Registra un callback que se llama (desde un hilo) cuando un router vuelve"""
+    _al_recuperarse.append(callback)
+
+
+def _avisar_recuperacion(pool: "PoolMikrotik"):
+    for callback in list(_al_recuperarse):
+        try:
+            callback(pool)
+        except Exception as e:
+            print(f"⚠️ Error avisando recuperación de {pool.host}: {e}")
+
+
+class PoolMikrotik:
+    """
+    Pool thread-safe de sesiones RouterOS para un router.
+
+    Args:
+        host: IP o DDNS del router
+        port: Puerto de la API
+        usuario: Usuario API
+        password: Contraseña del usuario API
+        max_conexiones: Sesiones simultáneas máximas
+        idle_secs: Segundos sin uso tras los que se cierra una sesión
+        keepalive_secs: Cada cuánto se verifica una sesión inactiva
+        timeout_secs: Timeout de socket para conectar y para cada comando
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        usuario: str,
+        password: str,
+        max_conexiones: int = 4,
+        idle_secs: float = 300,
+        keepalive_secs: float = 30,
+        timeout_secs: float = 10,
+    ):
+        self.host = host
+        self.port = port
+        self.usuario = usuario
+        self.password = password
+        self.max_conexiones = max(1, max_conexiones)
+        self.idle_secs = idle_secs
+        self.keepalive_secs = keepalive_secs
+        self.timeout_secs = timeout_secs
+
+        self._libres: List[_Conexion] = []
+        self._en_uso = 0
+        self._cond = threading.Condition()
+        self._hilo_mantenimiento: Optional[threading.Thread] = None
+        self._cerrado = False
+        self.circuito = CircuitoRouter(
+            f"{host}:{port}",
+            fallos_max=settings.MIKROTIK_BREAKER_FALLOS,
+            espera_secs=settings.MIKROTIK_BREAKER_ESPERA_SECS,
+            espera_max_secs=settings.MIKROTIK_BREAKER_ESPERA_MAX_SECS,
+            al_cerrar=lambda: _avisar_recuperacion(self),
+        )
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida de una sesión
+    # ------------------------------------------------------------------
+
+    def _conectar(self) -> Optional[_Conexion]:
+        """Abre y autentica una sesión nueva (un solo handshake TCP + login)"""
+        if not routeros_api:
+            print("⚠️ routeros_api no disponible")
+            return None
+
+        try:
+            connection = routeros_api.RouterOsApiPool(
+                host=self.host,
+                username=self.usuario,
+                password=self.password,
+                port=self.port,
+                plaintext_login=True
+            )
+            if hasattr(connection, "set_timeout"):
+                connection.set_timeout(self.timeout_secs)
+            api = connection.get_api()
+            print(f"🔌 Nueva sesión MikroTik {self.host}:{self.port}")
+            self.circuito.registrar_exito()
+            return _Conexion(connection, api)
+        except Exception as e:
+            print(f"❌ MikroTik {self.host}:{self.port} no accesible: {e}")
+            self.circuito.registrar_fallo()
+            return None
+
+    @staticmethod
+    def _cerrar(conexion: _Conexion):
+        try:
+            conexion.connection.disconnect()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _esta_viva(conexion: _Conexion) -> bool:
+        """Keepalive: comando mínimo para confirmar que el socket sigue sano"""
+        try:
+            conexion.api.get_resource('/system/identity').get()
+            conexion.ultimo_ping = time.monotonic()
+            return True
+        except Exception:
+            return False
+
+    # ------------------------------------------------------------------
+    # Préstamo y devolución
+    # ------------------------------------------------------------------
+
+    def adquirir(self, espera_secs: Optional[float] = None) -> Optional[_Conexion]:
+        """
+        Presta una sesión sana del pool (o abre una nueva si hay cupo).
+
+        Args:
+            espera_secs: Cuánto esperar si todas las sesiones están en uso
+                         (default: timeout_secs)
+
+        Returns:
+            _Conexion o None si el router no está disponible
+        """
+        self._iniciar_mantenimiento()
+        if not self.circuito.permitir():
+            return None  # circuito abierto: fallar ya, sin esperar el timeout
+        sondeo = self.circuito.estado == SEMIABIERTO
+        espera = self.timeout_secs if espera_secs is None else espera_secs
+        limite = time.monotonic() + espera
+        conexion = None
+
+        with self._cond:
+            while True:
+                if self._libres:
+                    conexion = self._libres.pop()  # LIFO: la más reciente está más "caliente"
+                    self._en_uso += 1
+                    break
+                if self._en_uso < self.max_conexiones:
+                    self._en_uso += 1
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    print(f"⚠️ Pool MikroTik agotado ({self.max_conexiones} sesiones en uso)")
+                    if sondeo:
+                        self.circuito.liberar_sondeo()
+                    return None
+                self._cond.wait(restante)
+
+        # Fuera del lock: verificar o abrir la sesión
+        if conexion is not None:
+            ahora = time.monotonic()
+            if ahora - conexion.ultimo_uso > self.idle_secs:
+                self._cerrar(conexion)
+                conexion = None
+            elif ahora - conexion.ultimo_ping > self.keepalive_secs and not self._esta_viva(conexion):
+                print("🔄 Sesión MikroTik rota, reconectando...")
+                self._cerrar(conexion)
+                conexion = None
+
+        if conexion is None:
+            conexion = self._conectar()
+            if conexion is None:
+                with self._cond:
+                    self._en_uso -= 1
+                    self._cond.notify()
+                return None
+
+        return conexion
+
+    def liberar(self, conexion: _Conexion, rota: bool = False, usada: bool = True):
+        """Devuelve una sesión al pool (o la cierra si quedó rota)"""
+        if rota or self._cerrado:
+            self._cerrar(conexion)
+        elif usada:
+            conexion.ultimo_uso = time.monotonic()
+            conexion.ultimo_ping = conexion.ultimo_uso
+
+        with self._cond:
+            self._en_uso -= 1
+            if not rota and not self._cerrado:
+                self._libres.append(conexion)
+            self._cond.notify()
+
+    @contextmanager
+    def sesion(self):
+        """
+        Context manager que presta la API de una sesión del pool.
+
+        Entrega None si el router no está disponible. Si dentro del bloque
+        ocurre un error que no sea una respuesta '!trap' del router, la
+        sesión se considera rota y se descarta.
+        """
+        conexion = self.adquirir()
+        if conexion is None:
+            yield None
+            return
+
+        rota = False
+        try:
+            yield conexion.api
+        except RouterOsApiCommunicationError:
+            # El router respondió con error: el socket sigue sano
+            raise
+        except BaseException:
+            rota = True
+            raise
+        finally:
+            self.liberar(conexion, rota=rota)
+            if rota:
+                self.circuito.registrar_fallo()
+            else:
+                self.circuito.registrar_exito()
+
+    # ------------------------------------------------------------------
+    # Mantenimiento (keepalive + desalojo de inactivas)
+    # ------------------------------------------------------------------
+
+    def _iniciar_mantenimiento(self):
+        if self._hilo_mantenimiento is not None or self.keepalive_secs <= 0:
+            return
+        with self._cond:
+            if self._hilo_mantenimiento is not None:
+                return
+            self._hilo_mantenimiento = threading.Thread(
+                target=self._bucle_mantenimiento,
+                name=f"mikrotik-pool-{self.host}",
+                daemon=True
+            )
+            self._hilo_mantenimiento.start()
+
+    def _bucle_mantenimiento(self):
+        while not self._cerrado:
+            if self.circuito.estado == CERRADO:
+                time.sleep(self.keepalive_secs)
+            else:
+                time.sleep(max(0.5, min(self.keepalive_secs, self.circuito.segundos_para_sondeo())))
+            try:
+                if self.circuito.estado == CERRADO:
+                    self.mantenimiento()
+                else:
+                    self.sondear()
+            except Exception as e:
+                print(f"⚠️ Error en mantenimiento del pool MikroTik: {e}")
+
+    def sondear(self):
+        """
+        Con el circuito abierto: si ya venció la espera, intenta una conexión
+        de prueba. Si responde, el circuito se cierra y la sesión queda en el pool.
+        """
+        if not self.circuito.permitir():
+            return
+        with self._cond:
+            if self._en_uso + len(self._libres) >= self.max_conexiones:
+                # Sin cupo para otra sesión: probar una de las libres
+                conexion = self._libres.pop() if self._libres else None
+                if conexion is None:
+                    return
+                self._en_uso += 1
+            else:
+                conexion = None
+                self._en_uso += 1
+
+        if conexion is not None:
+            viva = self._esta_viva(conexion)
+            self.liberar(conexion, rota=not viva, usada=False)
+            if viva:
+                self.circuito.registrar_exito()
+            else:
+                self.circuito.registrar_fallo()
+            return
+
+        conexion = self._conectar()  # registra éxito o fallo en el circuito
+        if conexion is None:
+            with self._cond:
+                self._en_uso -= 1
+                self._cond.notify()
+            return
+        self.liberar(conexion)
+
+    def mantenimiento(self):
+        """Cierra sesiones inactivas y hace ping a las que lo necesitan"""
+        ahora = time.monotonic()
+        with self._cond:
+            expiradas = [c for c in self._libres if ahora - c.ultimo_uso > self.idle_secs]
+            por_verificar = [
+                c for c in self._libres
+                if c not in expiradas and ahora - c.ultimo_ping > self.keepalive_secs
+            ]
+            tomadas = expiradas + por_verificar
+            self._libres = [c for c in self._libres if c not in tomadas]
+            self._en_uso += len(por_verificar)
+
+        for conexion in expiradas:
+            self._cerrar(conexion)
+        if expiradas:
+            print(f"🧹 Pool MikroTik: {len(expiradas)} sesiones inactivas cerradas")
+
+        for conexion in por_verificar:
+            self.liberar(conexion, rota=not self._esta_viva(conexion), usada=False)
+
+    def cerrar_todo(self):
+        """Cierra todas las sesiones libres (al apagar la aplicación)"""
+        with self._cond:
+            self._cerrado = True
+            libres, self._libres = self._libres, []
+            self._cond.notify_all()
+        for conexion in libres:
+            self._cerrar(conexion)
+
+    def estadisticas(self) -> Dict:
+        with self._cond:
+            return {
+                "host": self.host,
+                "port": self.port,
+                "libres": len(self._libres),
+                "en_uso": self._en_uso,
+                "max_conexiones": self.max_conexiones,
+                "circuito": self.circuito.estadisticas(),
+            }
+
+
+# ============================================================================
+# Registro de pools (uno por router)
+# ============================================================================
+
+_pools: Dict[Tuple[str, int], PoolMikrotik] = {}
+_pools_lock = threading.Lock()
+
+
+def obtener_pool(host: str = None, port: int = None) -> PoolMikrotik:
+    """
+    Retorna el pool del router indicado (por defecto el de settings),
+    creándolo la primera vez.
+    """
+    host = host or settings.MIKROTIK_HOST
+    port = port or settings.MIKROTIK_PORT
+    clave = (host, port)
+
+    pool = _pools.get(clave)
+    if pool is not None:
+        return pool
+
+    with _pools_lock:
+        pool = _pools.get(clave)
+        if pool is None:
+            pool = PoolMikrotik(
+                host=host,
+                port=port,
+                usuario=settings.MIKROTIK_USER,
+                password=settings.MIKROTIK_PASS,
+                max_conexiones=settings.MIKROTIK_POOL_MAX,
+                idle_secs=settings.MIKROTIK_POOL_IDLE_SECS,
+                keepalive_secs=settings.MIKROTIK_KEEPALIVE_SECS,
+                timeout_secs=settings.MIKROTIK_TIMEOUT_SECS,
+            )
+            _pools[clave] = pool
+        return pool
+
+
+def cerrar_pools():
+    """Cierra todas las sesiones de todos los routers"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.cerrar_todo()
@@ -0,0 +1,226 @@
+"""
+Catálogo de routers MikroTik (uno por campamento/zona).
+
+El router principal es siempre el de MIKROTIK_HOST/MIKROTIK_PORT. Con
+MIKROTIK_MULTI_ROUTER=true se suman los campamentos activos de la tabla
+campamentos (router_ip/router_puerto); un campamento que apunta al mismo
+host:puerto que el principal es el principal. Sin la opción, toda zona va
+al principal (un solo router, como antes). Cada
+operación de mikrotik.py se dirige al router del cliente y cada router
+tiene su propio pool de sesiones (mikrotik_pool.py) y su propio índice de
+Userman (mikrotik_indice.py): un router lento o caído no ocupa las
+sesiones ni bloquea el índice de los demás.
+
+Cómo se elige el router:
+
+  1. Zona explícita (nombre como "Cocha" o id de campamento). Si la zona
+     no tiene router se lanza ZonaSinRouter: operar en otro router
+     crearía o vencería usuarios en el campamento equivocado.
+  2. Router donde ya se vio al usuario en este proceso
+  3. Si hay un solo router, ese; si hay varios, se busca al usuario en
+     todos en paralelo (ver mikrotik.py)
+
+Si Supabase no responde la primera vez, se trabaja solo con el principal.
+
+La lectura de campamentos es síncrona (cliente sync de Supabase) porque se
+hace desde los hilos donde ya corren las llamadas a routeros_api.
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+from app.core.config import settings
+from app.services.mikrotik_pool import PoolMikrotik, obtener_pool
+from app.services.mikrotik_indice import IndiceUserman, obtener_indice
+
+# Palabras que no distinguen una zona de otra ("Campamento Cocha" == "cocha")
+PALABRAS_GENERICAS = {"campamento", "zona", "sede"}
+
+# Usuarios recordados con su router
+MAX_USUARIOS_RECORDADOS = 20000
+
+
+def normalizar_zona(zona: str) -> str:
+    texto = unicodedata.normalize("NFKD", (zona or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    palabras = re.findall(r"[a-z0-9]+", texto)
+    return " ".join(p for p in palabras if p not in PALABRAS_GENERICAS)
+
+
+class ZonaSinRouter(LookupError):
+    """La zona pedida no corresponde a ningún router configurado"""
+
+
+class RouterMikrotik:
+    """Un router de campamento: su pool de sesiones y su índice de Userman"""
+
+    __slots__ = ("id", "nombre", "host", "port")
+
+    def __init__(self, id: Optional[int], nombre: str, host: str, port: int):
+        self.id = id
+        self.nombre = nombre
+        self.host = host
+        self.port = port
+
+    @property
+    def clave(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def pool(self) -> PoolMikrotik:
+        return obtener_pool(self.host, self.port)
+
+    def indice(self) -> IndiceUserman:
+        return obtener_indice(self.host, self.port)
+
+    def __repr__(self):
+        return f"RouterMikrotik({self.nombre}, {self.clave})"
+
+
+def router_por_defecto() -> RouterMikrotik:
+    return RouterMikrotik(None, "principal", settings.MIKROTIK_HOST, settings.MIKROTIK_PORT)
+
+
+class CatalogoRouters:
+    """
+    Routers activos (el principal más los campamentos, con TTL) y el router
+    donde se encontró a cada usuario.
+    """
+
+    def __init__(self, ttl_secs: float = 600, multi_router: bool = False):
+        self.ttl_secs = ttl_secs
+        self.multi_router = multi_router
+        self._campamentos: List[RouterMikrotik] = []
+        self._ts = 0.0
+        self._lock = threading.Lock()
+        self._usuarios: "OrderedDict[str, str]" = OrderedDict()  # usuario -> clave del router
+
+    def _leer_campamentos(self) -> List[RouterMikrotik]:
+        from app.services.supabase import supabase
+        response = supabase.table("campamentos")\
+            .select("id, nombre, router_ip, router_puerto")\
+            .eq("estado", "activo")\
+            .execute()
+        return [
+            RouterMikrotik(fila["id"], fila["nombre"], fila["router_ip"], int(fila.get("router_puerto") or settings.MIKROTIK_PORT))
+            for fila in response.data or []
+            if fila.get("router_ip")
+        ]
+
+    def campamentos(self, refrescar: bool = True) -> List[RouterMikrotik]:
+        """
+        Routers de los campamentos activos (vacío sin MIKROTIK_MULTI_ROUTER).
+
+        Args:
+            refrescar: Releer campamentos si venció el TTL (hace I/O: no
+                       usar desde el event loop)
+        """
+        if not self.multi_router:
+            return []
+        if refrescar and time.monotonic() - self._ts > self.ttl_secs:
+            with self._lock:
+                if time.monotonic() - self._ts > self.ttl_secs:
+                    try:
+                        campamentos = self._leer_campamentos()
+                        if len(campamentos) != len(self._campamentos):
+                            print(f"🗺️ Campamentos con router: {', '.join(r.nombre for r in campamentos) or 'ninguno'}")
+                        self._campamentos = campamentos
+                    except Exception as e:
+                        print(f"⚠️ No se pudieron leer los campamentos, se mantienen los routers conocidos: {e}")
+                    self._ts = time.monotonic()
+        return self._campamentos
+
+    def routers(self, refrescar: bool = True) -> List[RouterMikrotik]:
+        """Routers distintos: el principal primero y luego los de campamentos"""
+        routers = [self.principal()]
+        claves = {routers[0].clave}
+        for router in self.campamentos(refrescar):
+            if router.clave not in claves:
+                claves.add(router.clave)
+                routers.append(router)
+        return routers
+
+    def principal(self) -> RouterMikrotik:
+        return router_por_defecto()
+
+    def por_zona(self, zona: Union[str, int, None], refrescar: bool = True) -> Optional[RouterMikrotik]:
+        """
+        Router de una zona.
+
+        Args:
+            zona: Nombre de la zona ("Cocha", "Campamento Cocha") o id del campamento
+
+        Returns:
+            El router, o None si la zona no tiene router (sin
+            MIKROTIK_MULTI_ROUTER toda zona es del principal)
+        """
+        if zona is None or zona == "":
+            return None
+        if not self.multi_router:
+            return self.principal()
+        routers = self.campamentos(refrescar)
+        if isinstance(zona, int) or str(zona).isdigit():
+            return next((r for r in routers if r.id == int(zona)), None)
+
+        buscada = normalizar_zona(str(zona))
+        if not buscada:
+            return None
+        for router in routers:
+            if normalizar_zona(router.nombre) == buscada:
+                return router
+        # "cocha" también encuentra "Campamento Cocha Alta" si es el único que coincide
+        parecidos = [r for r in routers if buscada in normalizar_zona(r.nombre)]
+        return parecidos[0] if len(parecidos) == 1 else None
+
+    def recordar(self, usuario: str, router: RouterMikrotik):
+        with self._lock:
+            self._usuarios[usuario] = router.clave
+            self._usuarios.move_to_end(usuario)
+            while len(self._usuarios) > MAX_USUARIOS_RECORDADOS:
+                self._usuarios.popitem(last=False)
+
+    def de_usuario(self, usuario: str) -> Optional[RouterMikrotik]:
+        """Router donde ya se vio al usuario (None si no se sabe)"""
+        clave = self._usuarios.get(usuario)
+        if clave is None:
+            return None
+        return next((r for r in self.routers() if r.clave == clave), None)
+
+    def estadisticas(self) -> List[Dict]:
+        """Estado de cada router (sin I/O: usa la última lista leída)"""
+        return [
+            {"zona": router.nombre, **router.pool().estadisticas()}
+            for router in self.routers(refrescar=False)
+        ]
+
+
+catalogo_routers = CatalogoRouters(
+    ttl_secs=settings.ROUTERS_TTL_SECS,
+    multi_router=settings.MIKROTIK_MULTI_ROUTER,
+)
+
+
+def resolver_router(zona: Union[str, int, None] = None, usuario: str = None) -> Optional[RouterMikrotik]:
+    """
+    Router para una operación (pasos 1-3 del docstring del módulo, salvo la
+    búsqueda en todos los routers, que hace mikrotik.py).
+
+    Returns:
+        El router, o None si hay varios y no se sabe en cuál está el usuario
+
+    Raises:
+        ZonaSinRouter: Si se indicó una zona y no tiene router
+    """
+    if zona not in (None, ""):
+        router = catalogo_routers.por_zona(zona)
+        if router is None:
+            raise ZonaSinRouter(f"Zona '{zona}' sin router configurado")
+        return router
+    if usuario:
+        router = catalogo_routers.de_usuario(usuario)
+        if router is not None:
+            return router
+    routers = catalogo_routers.routers()
+    return routers[0] if len(routers) == 1 or not usuario else None
@@ -1,8 +1,34 @@
-from supabase import create_client, Client
+from datetime import datetime, timezone
+from typing import Optional
+from supabase import create_client, Client, acreate_client, AsyncClient
 from app.core.config import settings
 
 supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
 
+# Cliente async (PostgREST sobre httpx): se crea al primer uso dentro del event loop
+_supabase_async: Optional[AsyncClient] = None
+
+
+async def obtener_supabase_async() -> AsyncClient:
+    """Retorna el cliente async de Supabase (lo crea la primera vez)"""
+    global _supabase_async
+    if _supabase_async is None:
+        _supabase_async = await acreate_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+    return _supabase_async
+
+
+def _datos_venta(whatsapp_id, plan, foto_url, usuario_mikrotik, plan_solicitado, dias_solicitados, campamento_id=None):
+    return {
+        "whatsapp_id": whatsapp_id,
+        "campamento_id": campamento_id,
+        "dias_solicitados": dias_solicitados,
+        "estado": "pendiente",
+        "foto_comprobante": foto_url,
+        "usuario_mikrotik": usuario_mikrotik,
+        "plan_solicitado": plan_solicitado or plan
+    }
+
+
 def guardar_venta_pendiente(whatsapp_id, plan, foto_url, usuario_mikrotik=None, plan_solicitado=None, dias_solicitados=1):
     """
     Guarda una venta pendiente de aprobación.
@@ -15,14 +41,7 @@ def guardar_venta_pendiente(whatsapp_id, plan, foto_url, usuario_mikrotik=None,
         plan_solicitado: Nombre del plan solicitado
         dias_solicitados: Cantidad de días a activar
     """
-    data = {
-        "whatsapp_id": whatsapp_id,
-        "dias_solicitados": dias_solicitados,
-        "estado": "pendiente",
-        "foto_comprobante": foto_url,
-        "usuario_mikrotik": usuario_mikrotik,
-        "plan_solicitado": plan_solicitado or plan
-    }
+    data = _datos_venta(whatsapp_id, plan, foto_url, usuario_mikrotik, plan_solicitado, dias_solicitados)
     
     try:
         # Insertamos en la tabla 'ventas'
@@ -58,14 +77,266 @@ def obtener_contexto_conversacion(phone_number: str) -> dict:
         return None
 
 
-def guardar_contexto_conversacion(phone_number: str, context_data: dict):
+def guardar_contexto_conversacion(phone_number: str, context_data: dict, current_topic: str = "idle"):
     """Guarda o actualiza el contexto de conversación en Supabase"""
     try:
         # Usar upsert con on_conflict para insertar o actualizar basado en phone_number
         supabase.table("conversation_context").upsert({
             "phone_number": phone_number,
             "context_data": context_data,
-            "current_topic": "idle"
+            "current_topic": current_topic
+        }, on_conflict="phone_number").execute()
+    except Exception as e:
+        print(f"Error guardando contexto: {e}")
+
+
+# ============================================================================
+# Versiones async (mismo comportamiento, sin bloquear el event loop)
+# ============================================================================
+
+async def guardar_venta_pendiente_async(whatsapp_id, plan, foto_url, usuario_mikrotik=None, plan_solicitado=None, dias_solicitados=1, campamento_id=None):
+    """Versión async de guardar_venta_pendiente (campamento_id: router donde se activará)"""
+    data = _datos_venta(whatsapp_id, plan, foto_url, usuario_mikrotik, plan_solicitado, dias_solicitados, campamento_id)
+    
+    try:
+        cliente = await obtener_supabase_async()
+        response = await cliente.table("ventas").insert(data).execute()
+        return response.data[0]['id'] if response.data else None
+    except Exception as e:
+        print(f"❌ Error guardando venta: {e}")
+        return None
+
+
+async def obtener_venta_async(venta_id):
+    cliente = await obtener_supabase_async()
+    response = await cliente.table("ventas").select("*").eq("id", venta_id).execute()
+    return response.data[0] if response.data else None
+
+
+async def actualizar_estado_venta_async(venta_id, nuevo_estado):
+    cliente = await obtener_supabase_async()
+    await cliente.table("ventas").update({"estado": nuevo_estado}).eq("id", venta_id).execute()
+
+
+async def actualizar_venta_async(venta_id, campos: dict):
+    """Actualiza columnas sueltas de una venta (seguimiento de la aprobación)"""
+    cliente = await obtener_supabase_async()
+    await cliente.table("ventas").update(campos).eq("id", venta_id).execute()
+
+
+async def reclamar_venta_para_aprobacion_async(venta_id, campos: dict) -> bool:
+    """
+    Actualiza la venta solo si sigue 'pendiente' y sin aprobación terminada
+    (un segundo clic del admin no puede reaprobarla ni rechazarla).
+
+    Returns:
+        True si la venta se actualizó
+    """
+    cliente = await obtener_supabase_async()
+    response = await cliente.table("ventas")\
+        .update(campos)\
+        .eq("id", venta_id)\
+        .eq("estado", "pendiente")\
+        .or_("aprobacion_estado.is.null,aprobacion_estado.not.in.(completado,pendiente_activacion)")\
+        .execute()
+    return bool(response.data)
+
+
+async def obtener_ventas_por_aprobacion_async(estados) -> list:
+    """Ventas cuyo trabajo de aprobación está en alguno de los estados dados"""
+    cliente = await obtener_supabase_async()
+    response = await cliente.table("ventas")\
+        .select("*")\
+        .in_("aprobacion_estado", list(estados))\
+        .execute()
+    return response.data or []
+
+
+async def obtener_ventas_async(venta_ids) -> list:
+    """Varias ventas en una sola consulta"""
+    cliente = await obtener_supabase_async()
+    response = await cliente.table("ventas")\
+        .select("*")\
+        .in_("id", list(venta_ids))\
+        .execute()
+    return response.data or []
+
+
+async def aprobar_venta_con_activacion_async(venta_id, usuario: str, plan: str, dias: int = 1, campamento_id=None):
+    """
+    Aprueba la venta y deja su activación en MikroTik en el outbox
+    (activaciones_pendientes) en una sola transacción (migración 012).
+
+    Returns:
+        id de la activación pendiente
+    """
+    cliente = await obtener_supabase_async()
+    response = await cliente.rpc("aprobar_venta_con_activacion", {
+        "p_venta_id": venta_id,
+        "p_usuario": usuario,
+        "p_plan": plan,
+        "p_dias": dias,
+        "p_campamento_id": campamento_id,
+    }).execute()
+    return response.data
+
+
+async def obtener_ventas_pendientes_async(limite: int = 200) -> list:
+    """Ventas con pago por revisar y sin trabajo de aprobación en curso (una consulta)"""
+    cliente = await obtener_supabase_async()
+    response = await cliente.table("ventas")\
+        .select("*")\
+        .eq("estado", "pendiente")\
+        .or_("aprobacion_estado.is.null,aprobacion_estado.eq.error")\
+        .order("id")\
+        .limit(limite)\
+        .execute()
+    return response.data or []
+
+
+async def aprobar_ventas_con_activacion_async(ventas: list) -> list:
+    """
+    Aprobación masiva: aprueba las ventas y encola sus activaciones en una
+    sola transacción (migración 013).
+
+    Args:
+        ventas: [{"venta_id", "usuario", "plan", "dias", "campamento_id"}, ...]
+
+    Returns:
+        ids de las ventas aprobadas (las que seguían 'pendiente')
+    """
+    cliente = await obtener_supabase_async()
+    response = await cliente.rpc("aprobar_ventas_con_activacion", {"p_ventas": ventas}).execute()
+    return [fila["aprobada_id"] for fila in response.data or []]
+
+
+async def tomar_activaciones_async(limite: int, plazo_secs: int = 300) -> list:
+    """Reclama un lote de activaciones vencidas (quedan 'procesando')"""
+    cliente = await obtener_supabase_async()
+    response = await cliente.rpc("tomar_activaciones", {"p_limite": limite, "p_plazo_secs": plazo_secs}).execute()
+    return response.data or []
+
+
+async def registrar_resultados_activaciones_async(resultados: list):
+    """Guarda estado/intentos/próximo intento de un lote de activaciones"""
+    cliente = await obtener_supabase_async()
+    await cliente.rpc("registrar_resultados_activaciones", {"p_resultados": resultados}).execute()
+
+
+async def registrar_avance_ventas_async(avances: list):
+    """Avance de aprobación/activación de un lote de ventas en una sola llamada (migración 016)"""
+    cliente = await obtener_supabase_async()
+    await cliente.rpc("registrar_avance_ventas", {"p_ventas": avances}).execute()
+
+
+async def adelantar_activaciones_async():
+    """Vuelve inmediatas todas las activaciones pendientes (al volver un router)"""
+    cliente = await obtener_supabase_async()
+    await cliente.table("activaciones_pendientes")\
+        .update({"proximo_intento": datetime.now(timezone.utc).isoformat()})\
+        .eq("estado", "pendiente")\
+        .execute()
+
+
+async def registrar_activaciones_async(filas: list) -> list:
+    """
+    Registra en activaciones los planes recién activados. La activación
+    vigente anterior de cada usuario (renovación) queda 'cancelada'; todo en
+    una transacción (RPC registrar_activaciones, migración 014).
+
+    Args:
+        filas: [{"venta_id", "usuario_hotspot", "fecha_inicio", "fecha_fin"}, ...]
+
+    Returns:
+        Filas vigentes registradas (con id), una por usuario
+    """
+    cliente = await obtener_supabase_async()
+    response = await cliente.rpc("registrar_activaciones", {"p_activaciones": filas}).execute()
+    return response.data or []
+
+
+async def obtener_activaciones_activas_async(pagina: int = 1000) -> list:
+    """Activaciones vigentes con el WhatsApp y campamento de su venta"""
+    cliente = await obtener_supabase_async()
+    filas, desde = [], 0
+    while True:
+        response = await cliente.table("activaciones")\
+            .select("id, venta_id, usuario_hotspot, fecha_fin, recordatorio_enviado_at, ventas(whatsapp_id, campamento_id)")\
+            .eq("estado", "activa")\
+            .order("id")\
+            .range(desde, desde + pagina - 1)\
+            .execute()
+        filas.extend(response.data or [])
+        if len(response.data or []) < pagina:
+            return filas
+        desde += pagina
+
+
+async def marcar_recordatorios_async(activacion_ids) -> list:
+    """
+    Marca el recordatorio de vencimiento como enviado (solo las que no lo
+    tenían: otro proceso pudo ganarle).
+
+    Returns:
+        ids marcados por esta llamada
+    """
+    cliente = await obtener_supabase_async()
+    response = await cliente.table("activaciones")\
+        .update({"recordatorio_enviado_at": datetime.now(timezone.utc).isoformat()})\
+        .in_("id", list(activacion_ids))\
+        .is_("recordatorio_enviado_at", "null")\
+        .execute()
+    return [fila["id"] for fila in response.data or []]
+
+
+async def marcar_activaciones_expiradas_async(activacion_ids) -> list:
+    """
+    Marca en lote las activaciones vencidas y desactiva sus ventas.
+
+    Returns:
+        Filas marcadas por esta llamada (las que seguían 'activa')
+    """
+    ahora = datetime.now(timezone.utc).isoformat()
+    cliente = await obtener_supabase_async()
+    response = await cliente.table("activaciones")\
+        .update({"estado": "expirada", "fecha_expiracion_real": ahora, "updated_at": ahora})\
+        .in_("id", list(activacion_ids))\
+        .eq("estado", "activa")\
+        .execute()
+    marcadas = response.data or []
+    if marcadas:
+        await cliente.table("ventas")\
+            .update({"activo": False, "updated_at": ahora})\
+            .in_("id", [fila["venta_id"] for fila in marcadas])\
+            .execute()
+    return marcadas
+
+
+async def obtener_contexto_conversacion_async(phone_number: str) -> dict:
+    """Versión async de obtener_contexto_conversacion"""
+    try:
+        cliente = await obtener_supabase_async()
+        response = await cliente.table("conversation_context")\
+            .select("context_data")\
+            .eq("phone_number", phone_number)\
+            .execute()
+        
+        if response.data:
+            return response.data[0].get("context_data", {})
+        return None
+    except Exception as e:
+        print(f"Error obteniendo contexto: {e}")
+        return None
+
+
+async def guardar_contexto_conversacion_async(phone_number: str, context_data: dict, current_topic: str = "idle"):
+    """Versión async de guardar_contexto_conversacion"""
+    try:
+        cliente = await obtener_supabase_async()
+        await cliente.table("conversation_context").upsert({
+            "phone_number": phone_number,
+            "context_data": context_data,
+            "current_topic": current_topic
         }, on_conflict="phone_number").execute()
     except Exception as e:
-        print(f"Error guardando contexto: {e}")
\ No newline at end of file
+        print(f"Error guardando contexto: {e}")
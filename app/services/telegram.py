@@ -1,16 +1,10 @@
 import requests
 from app.core.config import settings
+from app.core.http import obtener_cliente_http
 
-def enviar_alerta_pago(venta_id, whatsapp_id, plan, foto_url):
-    """
-    Envía una alerta a Telegram con botones inline cuando se recibe un comprobante de pago.
-    
-    Args:
-        venta_id: ID de la venta en Supabase
-        whatsapp_id: Número de WhatsApp del cliente
-        plan: Nombre del plan contratado
-        foto_url: URL pública de la imagen del comprobante (provista por Twilio)
-    """
+
+def _payload_alerta_pago(venta_id, whatsapp_id, plan, foto_url):
+    """Mensaje HTML + botones inline para la alerta de pago"""
     mensaje = (
         f"🚨 <b>NUEVA SOLICITUD DE PAGO</b> 🚨\n\n"
         f"👤 <b>Cliente:</b> {whatsapp_id}\n"
@@ -19,8 +13,6 @@ def enviar_alerta_pago(venta_id, whatsapp_id, plan, foto_url):
         f"¿Aprobar y crear ficha?"
     )
     
-    url = f"https://api.telegram.org/bot{settings.TG_BOT_TOKEN}/sendMessage"
-    
     # Botones Inline
     teclado = {
         "inline_keyboard": [
@@ -31,15 +23,79 @@ def enviar_alerta_pago(venta_id, whatsapp_id, plan, foto_url):
         ]
     }
     
-    payload = {
+    return {
         "chat_id": settings.TG_ADMIN_ID,
         "text": mensaje,
         "parse_mode": "HTML",
         "reply_markup": teclado
     }
+
+
+def enviar_alerta_pago(venta_id, whatsapp_id, plan, foto_url):
+    """
+    Envía una alerta a Telegram con botones inline cuando se recibe un comprobante de pago.
+    
+    Args:
+        venta_id: ID de la venta en Supabase
+        whatsapp_id: Número de WhatsApp del cliente
+        plan: Nombre del plan contratado
+        foto_url: URL pública de la imagen del comprobante (provista por Twilio)
+    """
+    url = f"https://api.telegram.org/bot{settings.TG_BOT_TOKEN}/sendMessage"
+    payload = _payload_alerta_pago(venta_id, whatsapp_id, plan, foto_url)
     
     try:
         requests.post(url, json=payload)
         print("✅ Alerta enviada a Telegram")
     except Exception as e:
-        print(f"❌ Error Telegram: {e}")
\ No newline at end of file
+        print(f"❌ Error Telegram: {e}")
+
+
+async def enviar_alerta_pago_async(venta_id, whatsapp_id, plan, foto_url):
+    """Versión async de enviar_alerta_pago (AsyncClient compartido)"""
+    url = f"https://api.telegram.org/bot{settings.TG_BOT_TOKEN}/sendMessage"
+    payload = _payload_alerta_pago(venta_id, whatsapp_id, plan, foto_url)
+    
+    try:
+        await obtener_cliente_http().post(url, json=payload)
+        print("✅ Alerta enviada a Telegram")
+    except Exception as e:
+        print(f"❌ Error Telegram: {e}")
+
+
+async def editar_mensaje_telegram_async(chat_id, message_id, texto: str):
+    """
+    Reemplaza el texto de un mensaje ya enviado (y quita sus botones).
+    
+    Se usa para dejar en la alerta de pago el resultado de la aprobación.
+    """
+    if not (chat_id and message_id):
+        return
+    url = f"https://api.telegram.org/bot{settings.TG_BOT_TOKEN}/editMessageText"
+    payload = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": texto,
+        "reply_markup": {"inline_keyboard": []},
+    }
+    
+    try:
+        response = await obtener_cliente_http().post(url, json=payload, timeout=5)
+        if response.status_code != 200:
+            print(f"⚠️ Error editando mensaje de Telegram: {response.text}")
+    except Exception as e:
+        print(f"❌ Error Telegram: {e}")
+
+
+async def enviar_mensaje_telegram_async(chat_id, texto: str):
+    """Mensaje de texto simple (respuestas a comandos del admin)"""
+    if not chat_id:
+        return
+    url = f"https://api.telegram.org/bot{settings.TG_BOT_TOKEN}/sendMessage"
+    
+    try:
+        response = await obtener_cliente_http().post(url, json={"chat_id": chat_id, "text": texto}, timeout=5)
+        if response.status_code != 200:
+            print(f"⚠️ Error enviando mensaje de Telegram: {response.text}")
+    except Exception as e:
+        print(f"❌ Error Telegram: {e}")
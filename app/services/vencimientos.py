@@ -0,0 +1,295 @@
+"""
+Barredor de vencimientos de planes.
+
+activaciones.fecha_fin y ventas.activo no los mantenía nadie. Ahora el
+outbox de MikroTik registra cada plan activado (activaciones.py) y este
+barredor:
+
+  - Guarda en memoria dos min-heaps con las activaciones vigentes: uno por
+    fecha del recordatorio y otro por fecha de vencimiento. Cada ronda solo
+    saca lo que ya venció (O(log n) por activación) en lugar de recorrer la
+    tabla
+  - Encola los recordatorios "tu plan vence en N horas" en cola_envios
+    (mismo rate limit que el resto de los mensajes salientes)
+  - Concilia los vencidos con el router: una lectura de user-profile por
+    router (perfiles_vigentes). Si el usuario ya no tiene perfil vigente se
+    marca 'expirada' (todas en una sola actualización) y se avisa al
+    cliente; si el router aún lo tiene (el perfil empieza a contar desde el
+    primer login) o no responde, se vuelve a mirar más tarde
+
+Al arrancar se cargan las activaciones vigentes una vez. Las marcas en
+Supabase son condicionales (recordatorio_enviado_at IS NULL, estado =
+'activa'): con varios procesos, solo el que gana la marca envía el mensaje.
+"""
+
+import asyncio
+import heapq
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.services.supabase import (
+    obtener_activaciones_activas_async,
+    marcar_recordatorios_async,
+    marcar_activaciones_expiradas_async,
+)
+from app.services.mikrotik import perfiles_vigentes
+from app.services.envios import responder_whatsapp_lote
+
+
+def _timestamp(fecha) -> float:
+    if isinstance(fecha, datetime):
+        return fecha.timestamp()
+    return datetime.fromisoformat(str(fecha).replace("Z", "+00:00")).timestamp()
+
+
+class _Activa:
+    """Activación vigente en los heaps"""
+
+    __slots__ = ("id", "venta_id", "usuario", "whatsapp_id", "campamento_id", "fin", "chequeo", "recordada")
+
+    def __init__(self, id: int, venta_id: int, usuario: str, whatsapp_id: Optional[str],
+                 campamento_id: Optional[int], fin: float, recordada: bool):
+        self.id = id
+        self.venta_id = venta_id
+        self.usuario = usuario
+        self.whatsapp_id = whatsapp_id
+        self.campamento_id = campamento_id
+        self.fin = fin
+        self.chequeo = fin  # cuándo conciliar con el router
+        self.recordada = recordada
+
+
+class BarredorVencimientos:
+    """
+    Args:
+        intervalo_secs: Cada cuánto se revisan los heaps
+        aviso_secs: Anticipación del recordatorio
+        rechequeo_secs: Espera antes de volver a mirar un plan que el router
+                        aún tiene vigente (o un router que no respondió)
+    """
+
+    def __init__(self, intervalo_secs: float = 60, aviso_secs: float = 12 * 3600, rechequeo_secs: float = 900):
+        self.intervalo_secs = intervalo_secs
+        self.aviso_secs = aviso_secs
+        self.rechequeo_secs = rechequeo_secs
+
+        self._activas: Dict[int, _Activa] = {}
+        self._por_usuario: Dict[str, int] = {}
+        # (fecha, id): las entradas que ya no coinciden con _activas se descartan al salir
+        self._avisos: List[Tuple[float, int]] = []
+        self._vencen: List[Tuple[float, int]] = []
+        self._cargado = False
+        self._tarea: Optional[asyncio.Task] = None
+        self._recordatorios = 0
+        self._expiradas = 0
+        self._rechequeos = 0
+        self._errores = 0
+
+    @property
+    def activo(self) -> bool:
+        return self._tarea is not None and not self._tarea.done()
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def iniciar(self):
+        """Lanza el barredor (dentro del event loop)"""
+        if self.activo:
+            return
+        self._tarea = asyncio.create_task(self._ciclo(), name="barredor-vencimientos")
+
+    async def detener(self):
+        if not self.activo:
+            return
+        self._tarea.cancel()
+        await asyncio.gather(self._tarea, return_exceptions=True)
+        self._tarea = None
+
+    async def _ciclo(self):
+        while True:
+            try:
+                if not self._cargado:
+                    await self.cargar()
+                await self.barrer()
+            except Exception as e:
+                self._errores += 1
+                print(f"❌ Error en el barredor de vencimientos: {e}")
+            await asyncio.sleep(self.intervalo_secs)
+
+    async def cargar(self):
+        """Carga las activaciones vigentes (una vez, al arrancar)"""
+        filas = await obtener_activaciones_activas_async()
+        for fila in filas:
+            venta = fila.get("ventas") or {}
+            self.agregar(fila, venta.get("whatsapp_id"), venta.get("campamento_id"))
+        self._cargado = True
+        print(f"⏰ Barredor de vencimientos: {len(self._activas)} activaciones vigentes")
+
+    # ------------------------------------------------------------------
+    # Heaps
+    # ------------------------------------------------------------------
+
+    def agregar(self, fila: Dict, whatsapp_id: str = None, campamento_id: int = None):
+        """
+        Agrega una activación vigente (fila de activaciones). Reemplaza a la
+        anterior del mismo usuario (renovación).
+        """
+        anterior = self._por_usuario.get(fila["usuario_hotspot"])
+        if anterior is not None:
+            self.quitar(anterior)
+
+        activa = _Activa(
+            fila["id"], fila["venta_id"], fila["usuario_hotspot"], whatsapp_id, campamento_id,
+            _timestamp(fila["fecha_fin"]), bool(fila.get("recordatorio_enviado_at")),
+        )
+        self._activas[activa.id] = activa
+        self._por_usuario[activa.usuario] = activa.id
+        if not activa.recordada:
+            heapq.heappush(self._avisos, (activa.fin - self.aviso_secs, activa.id))
+        heapq.heappush(self._vencen, (activa.chequeo, activa.id))
+
+    def quitar(self, activacion_id: int):
+        activa = self._activas.pop(activacion_id, None)
+        if activa and self._por_usuario.get(activa.usuario) == activacion_id:
+            del self._por_usuario[activa.usuario]
+
+    def _reprogramar(self, activa: _Activa, cuando: float):
+        activa.chequeo = cuando
+        heapq.heappush(self._vencen, (cuando, activa.id))
+
+    def _sacar(self, heap: List[Tuple[float, int]], ahora: float, fecha_de=None) -> List[_Activa]:
+        """
+        Saca del heap las activaciones cuya fecha ya pasó.
+
+        Args:
+            fecha_de: Fecha vigente de la activación en este heap; las
+                      entradas que no coinciden (reprogramadas) se descartan
+        """
+        sacadas = []
+        while heap and heap[0][0] <= ahora:
+            fecha, activacion_id = heapq.heappop(heap)
+            activa = self._activas.get(activacion_id)
+            if activa is not None and (fecha_de is None or fecha == fecha_de(activa)):
+                sacadas.append(activa)
+        return sacadas
+
+    # ------------------------------------------------------------------
+    # Ronda
+    # ------------------------------------------------------------------
+
+    async def barrer(self, ahora: float = None) -> Dict:
+        """
+        Una ronda: recordatorios y vencimientos que ya tocan.
+
+        Returns:
+            {"recordatorios", "expiradas", "rechequeos"} de esta ronda
+        """
+        ahora = ahora or time.time()
+        resumen = {"recordatorios": 0, "expiradas": 0, "rechequeos": 0}
+
+        por_avisar = [
+            a for a in self._sacar(self._avisos, ahora)
+            if not a.recordada and a.fin > ahora
+        ]
+        if por_avisar:
+            resumen["recordatorios"] = await self._recordar(por_avisar, ahora)
+
+        por_vencer = self._sacar(self._vencen, ahora, lambda a: a.chequeo)
+        if por_vencer:
+            resumen["expiradas"], resumen["rechequeos"] = await self._conciliar(por_vencer, ahora)
+        return resumen
+
+    async def _recordar(self, activas: List[_Activa], ahora: float) -> int:
+        try:
+            marcadas = set(await marcar_recordatorios_async([a.id for a in activas]))
+        except Exception as e:
+            print(f"⚠️ No se pudieron marcar los recordatorios, se reintentan: {e}")
+            for activa in activas:
+                heapq.heappush(self._avisos, (ahora + self.rechequeo_secs, activa.id))
+            return 0
+
+        mensajes = []
+        for activa in activas:
+            activa.recordada = True
+            if activa.id in marcadas and activa.whatsapp_id:
+                horas = max(1, round((activa.fin - ahora) / 3600))
+                mensajes.append((activa.whatsapp_id, (
+                    f"⏰ Tu internet vence en {horas} {'hora' if horas == 1 else 'horas'}.\n\n"
+                    f"Para renovar, envía tu comprobante de pago por aquí. 🌐"
+                )))
+        await responder_whatsapp_lote(mensajes)
+        self._recordatorios += len(mensajes)
+        return len(mensajes)
+
+    async def _conciliar(self, activas: List[_Activa], ahora: float) -> Tuple[int, int]:
+        """
+        Compara los vencidos con los perfiles vigentes de su router y marca
+        los confirmados.
+
+        Returns:
+            (expiradas, reprogramadas)
+        """
+        grupos: Dict[Optional[int], List[_Activa]] = {}
+        for activa in activas:
+            grupos.setdefault(activa.campamento_id, []).append(activa)
+
+        # Una lectura por router, en paralelo (routeros_api es síncrono)
+        lecturas = await asyncio.gather(*(
+            asyncio.to_thread(perfiles_vigentes, campamento_id) for campamento_id in grupos
+        ), return_exceptions=True)
+
+        vencidas, rechequeo = [], []
+        for grupo, vigentes in zip(grupos.values(), lecturas):
+            for activa in grupo:
+                if isinstance(vigentes, dict) and not vigentes.get(activa.usuario):
+                    vencidas.append(activa)
+                else:
+                    rechequeo.append(activa)  # router sin responder o plan aún vigente
+
+        marcadas = {}
+        if vencidas:
+            try:
+                marcadas = {fila["id"]: fila for fila in await marcar_activaciones_expiradas_async([a.id for a in vencidas])}
+            except Exception as e:
+                print(f"⚠️ No se pudieron marcar las activaciones vencidas, se reintentan: {e}")
+                rechequeo.extend(vencidas)
+                vencidas = []
+
+        for activa in rechequeo:
+            self._reprogramar(activa, ahora + self.rechequeo_secs)
+
+        mensajes = []
+        for activa in vencidas:
+            self.quitar(activa.id)
+            if activa.id in marcadas and activa.whatsapp_id:
+                mensajes.append((activa.whatsapp_id, (
+                    "⌛ Tu plan de internet venció.\n\n"
+                    "Si quieres seguir conectado, envía tu comprobante de pago por aquí. 🌐"
+                )))
+        await responder_whatsapp_lote(mensajes)
+
+        self._expiradas += len(marcadas)
+        self._rechequeos += len(rechequeo)
+        if vencidas or rechequeo:
+            print(f"⌛ Vencimientos: {len(marcadas)} expiradas, {len(rechequeo)} se vuelven a revisar")
+        return len(marcadas), len(rechequeo)
+
+    def estadisticas(self) -> Dict:
+        return {
+            "activo": self.activo,
+            "vigentes": len(self._activas),
+            "proxima_revision": datetime.fromtimestamp(self._vencen[0][0], timezone.utc).isoformat() if self._vencen else None,
+            "recordatorios": self._recordatorios,
+            "expiradas": self._expiradas,
+            "rechequeos": self._rechequeos,
+            "errores": self._errores,
+        }
+
+
+barredor_vencimientos = BarredorVencimientos(
+    intervalo_secs=settings.VENCIMIENTOS_INTERVALO_SECS,
+    aviso_secs=settings.VENCIMIENTOS_AVISO_HORAS * 3600,
+    rechequeo_secs=settings.VENCIMIENTOS_RECHEQUEO_SECS,
+)
@@ -1,36 +1,136 @@
+"""
+Envío de mensajes de WhatsApp vía Twilio.
+
+Los envíos del bot van por enviar_mensaje_whatsapp_async: un AsyncClient
+de httpx dedicado a Twilio, con pool de hasta TWILIO_POOL_SIZE conexiones
+keepalive (la conexión TLS se reutiliza entre envíos).
+
+Cada llamada hace un solo POST: los reintentos viven en una sola capa, la
+cola de envíos (app/services/envios.py), que decide con el código HTTP de
+enviar_whatsapp_twilio_async. Reintentar también aquí multiplicaba los
+intentos por mensaje y el riesgo de enviarlo dos veces.
+"""
+
+import asyncio
+from typing import Optional
+import httpx
 from twilio.rest import Client
 from app.core.config import settings
+from app.core.http import HTTP2_DISPONIBLE
+
+_cliente_async: Optional[httpx.AsyncClient] = None
+_semaforo_async: Optional[asyncio.Semaphore] = None
+
+
+def _formatear_destino(numero):
+    """
+    Formatea el número destino con prefijo "whatsapp:".
+    Si el número no empieza con "+", lo agregamos.
+    """
+    numero_formateado = numero if numero.startswith('+') else f'+{numero}'
+    return f"whatsapp:{numero_formateado}"
+
 
 def enviar_mensaje_whatsapp(numero, texto):
     """
-    Envía un mensaje de WhatsApp usando Twilio API.
-    
+    Envía un mensaje de WhatsApp usando Twilio API (versión síncrona, para
+    scripts como tests/verificar_sistema.py; la app usa la versión async).
+
     Args:
         numero (str): Número del destinatario (puede venir como "+51999..." o "51999...")
         texto (str): Contenido del mensaje
-    
+
     Returns:
         bool: True si se envió correctamente, False en caso de error
     """
     try:
-        # Inicializar cliente de Twilio
         client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-        
-        # Formatear el número destino con prefijo "whatsapp:"
-        # Si el número no empieza con "+", lo agregamos
-        numero_formateado = numero if numero.startswith('+') else f'+{numero}'
-        to_number = f"whatsapp:{numero_formateado}"
-        
-        # Enviar mensaje
         message = client.messages.create(
             body=texto,
             from_=settings.TWILIO_FROM_NUMBER,  # Ya debe venir como "whatsapp:+14155238886"
-            to=to_number
+            to=_formatear_destino(numero)
         )
-        
+
         print(f"✅ Mensaje enviado a {numero} (SID: {message.sid})")
         return True
-        
+
     except Exception as e:
         print(f"❌ Error al enviar mensaje con Twilio: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+def _obtener_cliente_async() -> httpx.AsyncClient:
+    """AsyncClient de Twilio (lo crea la primera vez): pool keepalive y credenciales fijas"""
+    global _cliente_async
+    if _cliente_async is None or _cliente_async.is_closed:
+        _cliente_async = httpx.AsyncClient(
+            base_url=f"https://api.twilio.com/2010-04-01/Accounts/{settings.TWILIO_ACCOUNT_SID}",
+            auth=(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN),
+            http2=HTTP2_DISPONIBLE,
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT_SECS),
+            limits=httpx.Limits(
+                max_connections=settings.TWILIO_POOL_SIZE,
+                max_keepalive_connections=settings.TWILIO_POOL_SIZE,
+                keepalive_expiry=60,
+            ),
+        )
+    return _cliente_async
+
+
+def _obtener_semaforo() -> asyncio.Semaphore:
+    """Limita los envíos async simultáneos a TWILIO_POOL_SIZE (uno por conexión del pool)"""
+    global _semaforo_async
+    if _semaforo_async is None:
+        _semaforo_async = asyncio.Semaphore(settings.TWILIO_POOL_SIZE)
+    return _semaforo_async
+
+
+async def enviar_whatsapp_twilio_async(numero, texto, remitente=None) -> Optional[int]:
+    """
+    Un POST al endpoint REST de Twilio (Messages.json) con el AsyncClient
+    de Twilio.
+
+    Args:
+        remitente: Número Twilio de origen (por defecto TWILIO_FROM_NUMBER)
+
+    Returns:
+        Código HTTP de Twilio (200/201 = enviado), o None si no hubo
+        respuesta (error de red: Twilio pudo haberlo recibido igual)
+    """
+    datos = {
+        "From": remitente or settings.TWILIO_FROM_NUMBER,
+        "To": _formatear_destino(numero),
+        "Body": texto,
+    }
+
+    async with _obtener_semaforo():
+        try:
+            response = await _obtener_cliente_async().post("/Messages.json", data=datos)
+        except Exception as e:
+            print(f"⚠️ Error de red con Twilio para {numero}: {e}")
+            return None
+
+    if response.status_code in (200, 201):
+        print(f"✅ Mensaje enviado a {numero} (SID: {response.json().get('sid')})")
+    else:
+        print(f"❌ Error al enviar mensaje con Twilio: {response.status_code} {response.text}")
+    return response.status_code
+
+
+async def enviar_mensaje_whatsapp_async(numero, texto, remitente=None):
+    """
+    Versión async de enviar_mensaje_whatsapp. Un solo intento: quien
+    necesite reintentos encola el mensaje en cola_envios (responder_whatsapp).
+
+    Returns:
+        bool: True si se envió correctamente, False en caso de error
+    """
+    return await enviar_whatsapp_twilio_async(numero, texto, remitente) in (200, 201)
+
+
+async def cerrar_cliente_twilio():
+    """Cierra el pool de conexiones a Twilio (al apagar la aplicación)"""
+    global _cliente_async
+    if _cliente_async is not None:
+        await _cliente_async.aclose()
+        _cliente_async = None
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Construye el índice del cache semántico desde el historial de
+conversation_cache (ver app/services/cache_semantico.py).
+
+Solo entran preguntas frecuentes: mensajes que (normalizados) enviaron al
+menos --min-telefonos clientes distintos en el mismo estado de la
+conversación (último mensaje del bot), respondidos con texto del bot. Se
+descartan los turnos que ejecutaron una función (conversation_topic), los
+resultados de acciones ("✅ Usuario creado", errores) y las respuestas con
+precios o cantidad de días. Para cada pregunta se usa la respuesta más
+repetida.
+
+Uso:
+    python construir_cache_semantico.py
+    python construir_cache_semantico.py --min-telefonos 3 --probar "a cuanto el dia"
+"""
+
+import argparse
+import sys
+from collections import Counter, defaultdict
+
+from app.core.config import settings
+from app.services.cache_respuestas import normalizar_mensaje, estado_conversacion
+from app.services.cache_semantico import NUMPY_DISPONIBLE, IndiceSemantico, es_respuesta_indexable
+
+# Respuestas generadas por acciones (datos de un cliente): nunca reutilizables.
+# Las filas anteriores a conversation_topic = función se reconocen por el prefijo
+PREFIJOS_ACCION = ("✅", "❌")
+TEMA_SIN_FUNCION = "general"
+MIN_CARACTERES_PREGUNTA = 6
+PAGINA = 1000
+
+
+def leer_historial(limite: int):
+    """Filas (phone_number, user_message, ai_response, conversation_topic) más recientes primero"""
+    from app.services.supabase import supabase
+
+    filas = []
+    while len(filas) < limite:
+        desde = len(filas)
+        hasta = min(desde + PAGINA, limite) - 1
+        response = supabase.table("conversation_cache")\
+            .select("phone_number, user_message, ai_response, conversation_topic")\
+            .order("created_at", desc=True)\
+            .range(desde, hasta)\
+            .execute()
+        if not response.data:
+            break
+        filas.extend(response.data)
+        if len(response.data) < hasta - desde + 1:
+            break
+    return filas
+
+
+def _con_estado(filas):
+    """
+    (estado, fila) de cada fila: el estado es la respuesta anterior del bot
+    al mismo cliente, igual que en el historial en vivo.
+    """
+    por_telefono = defaultdict(list)
+    for fila in filas:
+        por_telefono[fila.get("phone_number")].append(fila)
+    for turnos in por_telefono.values():
+        anterior = []
+        for fila in reversed(turnos):  # orden cronológico
+            yield estado_conversacion(anterior), fila
+            anterior = [{"role": "assistant", "content": fila.get("ai_response") or ""}]
+
+
+def _reutilizable(fila) -> bool:
+    respuesta = (fila.get("ai_response") or "").strip()
+    if (fila.get("conversation_topic") or TEMA_SIN_FUNCION) != TEMA_SIN_FUNCION:
+        return False
+    return not respuesta.startswith(PREFIJOS_ACCION) and es_respuesta_indexable(respuesta)
+
+
+def seleccionar_pares(filas, min_telefonos: int):
+    """[(estado, pregunta, respuesta)] de las preguntas frecuentes"""
+    telefonos = defaultdict(set)
+    respuestas = defaultdict(Counter)
+    ejemplo = {}
+
+    for estado, fila in _con_estado(filas):
+        pregunta = normalizar_mensaje(fila.get("user_message"))
+        if len(pregunta) < MIN_CARACTERES_PREGUNTA or pregunta.isdigit():
+            continue
+        if not _reutilizable(fila):
+            continue
+        clave = (estado, pregunta)
+        telefonos[clave].add(fila.get("phone_number"))
+        respuestas[clave][fila["ai_response"].strip()] += 1
+        ejemplo.setdefault(clave, fila["user_message"].strip())
+
+    return [
+        (clave[0], ejemplo[clave], respuestas[clave].most_common(1)[0][0])
+        for clave, tels in telefonos.items()
+        if len(tels) >= min_telefonos
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el índice del cache semántico")
+    parser.add_argument("--min-telefonos", type=int, default=2, help="clientes distintos que deben haber hecho la pregunta")
+    parser.add_argument("--limite", type=int, default=20000, help="filas de conversation_cache a leer")
+    parser.add_argument("--salida", default=settings.CACHE_SEMANTICO_RUTA, help="archivo .npz del índice")
+    parser.add_argument("--probar", help="mensaje para probar el índice recién construido")
+    parser.add_argument("--estado", default="inicio", help="último mensaje del bot para --probar (default: inicio de la conversación)")
+    args = parser.parse_args()
+
+    if not NUMPY_DISPONIBLE:
+        print("❌ Se necesita numpy: pip install numpy")
+        return 1
+
+    print("📥 Leyendo conversation_cache...")
+    filas = leer_historial(args.limite)
+    pares = seleccionar_pares(filas, args.min_telefonos)
+    print(f"   {len(filas)} mensajes → {len(pares)} preguntas frecuentes")
+    if not pares:
+        print("⚠️ No hay preguntas frecuentes suficientes, no se generó el índice")
+        return 1
+
+    indice = IndiceSemantico.construir(pares)
+    indice.guardar(args.salida)
+    print(f"✅ Índice guardado en {args.salida}")
+
+    if args.probar:
+        resultado = indice.buscar(args.probar, estado_conversacion([{"role": "assistant", "content": args.estado}]))
+        if resultado is None:
+            print(f"\n🔎 No hay preguntas frecuentes en el estado '{args.estado}'")
+            return 0
+        respuesta, similitud, pregunta = resultado
+        estado = "✅ hit" if similitud >= settings.CACHE_SEMANTICO_UMBRAL else "❌ bajo el umbral"
+        print(f"\n🔎 '{args.probar}' ≈ '{pregunta}' ({similitud:.2f}, {estado})")
+        print(f"   → {respuesta}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
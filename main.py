@@ -1,11 +1,55 @@
 from fastapi import FastAPI
-from app.routers import webhook_wa, webhook_tg
+from app.routers import webhook_wa, webhook_tg, metricas, admin
+from app.services.mikrotik_pool import cerrar_pools
+from app.core.http import cerrar_cliente_http
+from app.services.whatsapp import cerrar_cliente_twilio
+from app.services.envios import cola_envios
+from app.services.cache_respuestas import vaciar_hits_async
+from app.services.buffer_escritura import BUFFERS
+from app.services.aprobaciones import cola_aprobaciones, recuperar_aprobaciones_pendientes
+from app.services.activaciones import outbox_activaciones
+from app.services.vencimientos import barredor_vencimientos
+from app.services.idempotencia import eventos_webhook
 
 app = FastAPI(title="Bot ISP v1.0")
 
 # Incluimos los routers (las "rutas" separadas)
 app.include_router(webhook_wa.router)
 app.include_router(webhook_tg.router)
+app.include_router(metricas.router)
+app.include_router(admin.router)
+
+
+@app.on_event("startup")
+async def iniciar_workers():
+    """Lanza los workers que procesan los mensajes en segundo plano"""
+    webhook_wa.cola_whatsapp.iniciar()
+    cola_envios.iniciar()
+    cola_aprobaciones.iniciar()
+    for buffer in BUFFERS:
+        buffer.iniciar()
+    outbox_activaciones.iniciar()
+    barredor_vencimientos.iniciar()
+    eventos_webhook.iniciar()
+    await recuperar_aprobaciones_pendientes()
+
+
+@app.on_event("shutdown")
+async def cerrar_conexiones():
+    """Termina los trabajos pendientes y cierra las conexiones persistentes"""
+    await webhook_wa.cola_whatsapp.detener()
+    await cola_aprobaciones.detener()
+    await outbox_activaciones.detener()
+    await barredor_vencimientos.detener()
+    await eventos_webhook.detener()
+    await cola_envios.detener()
+    await vaciar_hits_async(forzar=True)
+    for buffer in BUFFERS:
+        await buffer.detener()
+    await cerrar_cliente_http()
+    await cerrar_cliente_twilio()
+    cerrar_pools()
+
 
 @app.get("/")
 def home():
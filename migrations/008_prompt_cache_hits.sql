@@ -0,0 +1,37 @@
+-- 008_prompt_cache_hits.sql
+-- Uso real de prompt_cache como segundo nivel del cache de respuestas
+-- (el primer nivel es un LRU en memoria, ver app/services/cache_respuestas.py)
+-- Los hits se acumulan en el proceso y se registran en lote con una sola llamada
+
+-- =============================================================================
+-- COLUMNAS
+-- =============================================================================
+-- Tokens que costó generar la respuesta: cada hit ahorra esa cantidad
+ALTER TABLE prompt_cache
+    ADD COLUMN IF NOT EXISTS tokens_respuesta INTEGER DEFAULT 0;
+
+COMMENT ON COLUMN prompt_cache.tokens_respuesta IS 'Tokens consumidos al generar la respuesta (ahorro por cada hit)';
+
+-- =============================================================================
+-- FUNCIÓN: registrar_hits_prompt_cache
+-- =============================================================================
+-- Suma un lote de hits en una sola llamada (PostgREST no permite "col = col + n")
+-- p_hits: [{"prompt_hash": "...", "hits": 3, "tokens": 240}, ...]
+CREATE OR REPLACE FUNCTION registrar_hits_prompt_cache(p_hits JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_filas INTEGER;
+BEGIN
+    UPDATE prompt_cache pc
+    SET hit_count = pc.hit_count + h.hits,
+        tokens_saved = pc.tokens_saved + h.tokens
+    FROM jsonb_to_recordset(p_hits) AS h(prompt_hash TEXT, hits INTEGER, tokens INTEGER)
+    WHERE pc.prompt_hash = h.prompt_hash;
+
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = pg_catalog, public;
+
+COMMENT ON FUNCTION registrar_hits_prompt_cache IS 'Incrementa hit_count y tokens_saved de varias entradas de prompt_cache en lote';
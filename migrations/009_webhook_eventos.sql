@@ -0,0 +1,49 @@
+-- 009_webhook_eventos.sql
+-- Idempotencia de webhooks (ver app/services/idempotencia.py)
+-- Twilio y Telegram reintentan un webhook si la respuesta tarda o falla: cada
+-- evento se registra por su id (MessageSid, callback_query.id, update_id) y
+-- los reintentos se responden con el resultado guardado sin repetir el trabajo
+
+-- =============================================================================
+-- TABLA: webhook_eventos
+-- =============================================================================
+CREATE TABLE IF NOT EXISTS webhook_eventos (
+    clave TEXT PRIMARY KEY,             -- ej: "wa:SM123...", "tg:cb:456...", "tg:upd:789"
+    estado VARCHAR(20) NOT NULL DEFAULT 'procesando',  -- procesando | completado
+    resultado JSONB,                    -- respuesta HTTP entregada la primera vez
+
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP + INTERVAL '3 days',
+
+    CONSTRAINT valid_estado_evento CHECK (estado IN ('procesando', 'completado'))
+);
+
+COMMENT ON TABLE webhook_eventos IS 'Eventos de webhook ya recibidos (deduplicación de reintentos de Twilio/Telegram)';
+COMMENT ON COLUMN webhook_eventos.clave IS 'Origen + id del evento: wa:<MessageSid>, tg:cb:<callback_query.id>, tg:upd:<update_id>';
+COMMENT ON COLUMN webhook_eventos.resultado IS 'Resultado devuelto al procesar el evento; se repite en los reintentos';
+
+-- Los reintentos llegan en minutos: unos días de historia alcanzan
+CREATE INDEX IF NOT EXISTS idx_webhook_eventos_expires
+    ON webhook_eventos(expires_at);
+
+-- =============================================================================
+-- FUNCIÓN: cleanup_webhook_eventos
+-- =============================================================================
+CREATE OR REPLACE FUNCTION cleanup_webhook_eventos()
+RETURNS BIGINT AS $$
+DECLARE
+    v_filas BIGINT;
+BEGIN
+    DELETE FROM webhook_eventos WHERE expires_at < CURRENT_TIMESTAMP;
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = pg_catalog, public;
+
+COMMENT ON FUNCTION cleanup_webhook_eventos IS 'Elimina eventos de webhook vencidos';
+
+-- =============================================================================
+-- RLS: solo el backend (service role) lee y escribe
+-- =============================================================================
+ALTER TABLE webhook_eventos ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,36 @@
+-- 010_ventas_aprobacion.sql
+-- Seguimiento del trabajo de aprobación de cada venta
+-- (ver app/services/aprobaciones.py)
+-- El clic del admin en Telegram se responde al instante y la aprobación
+-- (MikroTik + Supabase + WhatsApp) corre como trabajo en segundo plano con
+-- reintentos; su avance queda en la propia fila de ventas
+
+-- =============================================================================
+-- COLUMNAS
+-- =============================================================================
+ALTER TABLE ventas
+    ADD COLUMN IF NOT EXISTS aprobacion_estado TEXT,          -- en_cola | procesando | completado | error
+    ADD COLUMN IF NOT EXISTS aprobacion_accion TEXT,          -- aprobar | rechazar
+    ADD COLUMN IF NOT EXISTS aprobacion_intentos INT DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS aprobacion_error TEXT,
+    ADD COLUMN IF NOT EXISTS aprobacion_actualizada TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS tg_chat_id TEXT,                 -- mensaje del admin a editar al terminar
+    ADD COLUMN IF NOT EXISTS tg_message_id BIGINT;
+
+ALTER TABLE ventas
+    DROP CONSTRAINT IF EXISTS valid_aprobacion_estado;
+ALTER TABLE ventas
+    ADD CONSTRAINT valid_aprobacion_estado
+    CHECK (aprobacion_estado IS NULL OR aprobacion_estado IN ('en_cola', 'procesando', 'completado', 'error'));
+
+COMMENT ON COLUMN ventas.aprobacion_estado IS 'Avance del trabajo de aprobación/rechazo lanzado desde Telegram';
+COMMENT ON COLUMN ventas.aprobacion_intentos IS 'Intentos de activación en MikroTik realizados';
+COMMENT ON COLUMN ventas.aprobacion_error IS 'Último error del trabajo de aprobación';
+
+-- =============================================================================
+-- ÍNDICES
+-- =============================================================================
+-- Al arrancar se retoman los trabajos que quedaron a medias
+CREATE INDEX IF NOT EXISTS idx_ventas_aprobacion_pendiente
+    ON ventas(aprobacion_estado)
+    WHERE aprobacion_estado IN ('en_cola', 'procesando');
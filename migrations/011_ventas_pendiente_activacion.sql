@@ -0,0 +1,19 @@
+-- 011_ventas_pendiente_activacion.sql
+-- Ventas aprobadas mientras el router del cliente estaba caído
+-- (circuit breaker abierto, ver app/services/mikrotik_pool.py)
+-- Quedan 'pendiente_activacion' y se activan cuando el router vuelve
+
+ALTER TABLE ventas
+    DROP CONSTRAINT IF EXISTS valid_aprobacion_estado;
+ALTER TABLE ventas
+    ADD CONSTRAINT valid_aprobacion_estado
+    CHECK (aprobacion_estado IS NULL OR aprobacion_estado IN (
+        'en_cola', 'procesando', 'completado', 'error', 'pendiente_activacion'
+    ));
+
+COMMENT ON COLUMN ventas.aprobacion_estado IS 'Avance del trabajo de aprobación: en_cola | procesando | completado | error | pendiente_activacion';
+
+-- Al volver un router se buscan las ventas que esperan activación
+CREATE INDEX IF NOT EXISTS idx_ventas_pendiente_activacion
+    ON ventas(aprobacion_estado)
+    WHERE aprobacion_estado = 'pendiente_activacion';
@@ -0,0 +1,150 @@
+-- 012_activaciones_pendientes.sql
+-- Outbox de activaciones en MikroTik (ver app/services/activaciones.py)
+-- Aprobar una venta y dejar su activación pendiente ocurren en la misma
+-- transacción: si el router falla, la activación sigue en la tabla y un
+-- worker la reintenta con backoff exponencial, agrupando por router
+
+-- =============================================================================
+-- TABLA: activaciones_pendientes
+-- =============================================================================
+CREATE TABLE IF NOT EXISTS activaciones_pendientes (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    venta_id BIGINT NOT NULL UNIQUE REFERENCES ventas(id) ON DELETE CASCADE,
+    usuario TEXT NOT NULL,                  -- usuario de Userman
+    plan TEXT NOT NULL,                     -- perfil a activar (ej: "1User5Dia")
+    dias INT NOT NULL DEFAULT 1,
+    campamento_id BIGINT,                   -- router del cliente (NULL = se ubica al usuario)
+
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',  -- pendiente | procesando | completado | fallido
+    intentos INT NOT NULL DEFAULT 0,
+    proximo_intento TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    ultimo_error TEXT,
+
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT valid_estado_activacion CHECK (estado IN ('pendiente', 'procesando', 'completado', 'fallido'))
+);
+
+COMMENT ON TABLE activaciones_pendientes IS 'Cambios de plan en MikroTik pendientes de aplicar (outbox de las aprobaciones)';
+COMMENT ON COLUMN activaciones_pendientes.proximo_intento IS 'No se intenta antes de esta hora (backoff exponencial tras cada fallo)';
+COMMENT ON COLUMN activaciones_pendientes.updated_at IS 'En estado procesando: cuándo se tomó (pasado el plazo la retoma otro worker)';
+
+-- El worker solo mira las que vencieron
+CREATE INDEX IF NOT EXISTS idx_activaciones_pendientes_proximo
+    ON activaciones_pendientes(proximo_intento)
+    WHERE estado IN ('pendiente', 'procesando');
+
+-- =============================================================================
+-- FUNCIÓN: aprobar_venta_con_activacion
+-- =============================================================================
+-- Marca la venta aprobada y encola su activación en una sola transacción.
+-- Solo aprueba ventas que siguen 'pendiente' (una venta rechazada no se
+-- reaprueba). Repetirla para una venta ya aprobada no crea otra activación:
+-- devuelve la existente (NULL si la venta no estaba pendiente ni aprobada).
+CREATE OR REPLACE FUNCTION aprobar_venta_con_activacion(
+    p_venta_id BIGINT,
+    p_usuario TEXT,
+    p_plan TEXT,
+    p_dias INT,
+    p_campamento_id BIGINT
+)
+RETURNS BIGINT AS $$
+DECLARE
+    v_id BIGINT;
+BEGIN
+    UPDATE ventas
+    SET estado = 'aprobado',
+        fecha_aprobacion = COALESCE(fecha_aprobacion, CURRENT_TIMESTAMP),
+        aprobacion_estado = 'pendiente_activacion',
+        aprobacion_error = NULL,
+        aprobacion_actualizada = CURRENT_TIMESTAMP,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = p_venta_id
+      AND estado = 'pendiente';
+
+    IF NOT FOUND THEN
+        SELECT id INTO v_id FROM activaciones_pendientes WHERE venta_id = p_venta_id;
+        RETURN v_id;
+    END IF;
+
+    INSERT INTO activaciones_pendientes (venta_id, usuario, plan, dias, campamento_id)
+    VALUES (p_venta_id, p_usuario, p_plan, COALESCE(p_dias, 1), p_campamento_id)
+    ON CONFLICT (venta_id) DO NOTHING
+    RETURNING id INTO v_id;
+
+    IF v_id IS NULL THEN
+        SELECT id INTO v_id FROM activaciones_pendientes WHERE venta_id = p_venta_id;
+    END IF;
+    RETURN v_id;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = pg_catalog, public;
+
+COMMENT ON FUNCTION aprobar_venta_con_activacion IS 'Aprueba una venta y deja su activación en MikroTik en el outbox (misma transacción)';
+
+-- =============================================================================
+-- FUNCIÓN: tomar_activaciones
+-- =============================================================================
+-- Toma hasta p_limite activaciones vencidas y las marca 'procesando'.
+-- SKIP LOCKED: dos workers (o dos procesos) nunca toman la misma fila.
+-- Las que quedaron 'procesando' más de p_plazo_secs (proceso caído a mitad
+-- del lote) se vuelven a tomar.
+CREATE OR REPLACE FUNCTION tomar_activaciones(p_limite INT, p_plazo_secs INT DEFAULT 300)
+RETURNS SETOF activaciones_pendientes AS $$
+BEGIN
+    RETURN QUERY
+    WITH candidatas AS (
+        SELECT id FROM activaciones_pendientes
+        WHERE (estado = 'pendiente' AND proximo_intento <= CURRENT_TIMESTAMP)
+           OR (estado = 'procesando' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => p_plazo_secs))
+        ORDER BY proximo_intento
+        LIMIT p_limite
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE activaciones_pendientes a
+    SET estado = 'procesando',
+        updated_at = CURRENT_TIMESTAMP
+    FROM candidatas c
+    WHERE a.id = c.id
+    RETURNING a.*;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = pg_catalog, public;
+
+COMMENT ON FUNCTION tomar_activaciones IS 'Reclama un lote de activaciones vencidas para un worker';
+
+-- =============================================================================
+-- FUNCIÓN: registrar_resultados_activaciones
+-- =============================================================================
+-- Guarda el resultado de un lote en una sola llamada
+-- p_resultados: [{"id": 1, "estado": "pendiente", "intentos": 2,
+--                 "proximo_intento": "2026-...", "ultimo_error": "..."}, ...]
+CREATE OR REPLACE FUNCTION registrar_resultados_activaciones(p_resultados JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_filas INTEGER;
+BEGIN
+    UPDATE activaciones_pendientes a
+    SET estado = r.estado,
+        intentos = r.intentos,
+        proximo_intento = COALESCE(r.proximo_intento, a.proximo_intento),
+        ultimo_error = r.ultimo_error,
+        updated_at = CURRENT_TIMESTAMP
+    FROM jsonb_to_recordset(p_resultados) AS r(
+        id BIGINT, estado TEXT, intentos INT, proximo_intento TIMESTAMPTZ, ultimo_error TEXT
+    )
+    WHERE a.id = r.id;
+
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = pg_catalog, public;
+
+COMMENT ON FUNCTION registrar_resultados_activaciones IS 'Actualiza estado, intentos y próximo intento de un lote de activaciones';
+
+-- =============================================================================
+-- RLS: solo el backend (service role) lee y escribe
+-- =============================================================================
+ALTER TABLE activaciones_pendientes ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,47 @@
+-- 013_aprobacion_masiva.sql
+-- Aprobación masiva de ventas pendientes (ver aprobar_ventas_pendientes en
+-- app/services/aprobaciones.py): todas las ventas se aprueban y encolan su
+-- activación en el outbox (migración 012) con una sola llamada
+
+-- =============================================================================
+-- FUNCIÓN: aprobar_ventas_con_activacion
+-- =============================================================================
+-- p_ventas: [{"venta_id": 1, "usuario": "juan", "plan": "1User5Dia",
+--             "dias": 5, "campamento_id": 2}, ...]
+-- Solo aprueba las que siguen 'pendiente' (un clic del admin pudo ganarle)
+-- y devuelve los ids de las ventas aprobadas.
+CREATE OR REPLACE FUNCTION aprobar_ventas_con_activacion(p_ventas JSONB)
+RETURNS TABLE (aprobada_id BIGINT) AS $$
+BEGIN
+    RETURN QUERY
+    WITH datos AS (
+        SELECT *
+        FROM jsonb_to_recordset(p_ventas) AS d(
+            venta_id BIGINT, usuario TEXT, plan TEXT, dias INT, campamento_id BIGINT
+        )
+    ),
+    aprobadas AS (
+        UPDATE ventas v
+        SET estado = 'aprobado',
+            fecha_aprobacion = COALESCE(v.fecha_aprobacion, CURRENT_TIMESTAMP),
+            aprobacion_estado = 'pendiente_activacion',
+            aprobacion_accion = 'aprobar',
+            aprobacion_error = NULL,
+            aprobacion_actualizada = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+        FROM datos d
+        WHERE v.id = d.venta_id
+          AND v.estado = 'pendiente'
+        RETURNING v.id
+    )
+    INSERT INTO activaciones_pendientes AS a (venta_id, usuario, plan, dias, campamento_id)
+    SELECT d.venta_id, d.usuario, d.plan, COALESCE(d.dias, 1), d.campamento_id
+    FROM datos d
+    JOIN aprobadas ap ON ap.id = d.venta_id
+    ON CONFLICT (venta_id) DO NOTHING
+    RETURNING a.venta_id;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = pg_catalog, public;
+
+COMMENT ON FUNCTION aprobar_ventas_con_activacion IS 'Aprueba varias ventas pendientes y encola sus activaciones en MikroTik (una transacción)';
@@ -0,0 +1,85 @@
+-- 014_activaciones_vencimientos.sql
+-- Vencimientos de activaciones (ver app/services/vencimientos.py)
+-- El outbox de MikroTik registra cada plan activado en activaciones y un
+-- barredor en segundo plano concilia los vencidos con el router, los marca
+-- 'expirada' en lote y envía los recordatorios antes del vencimiento
+
+-- =============================================================================
+-- COLUMNAS
+-- =============================================================================
+ALTER TABLE activaciones
+    ADD COLUMN IF NOT EXISTS recordatorio_enviado_at TIMESTAMP WITH TIME ZONE;
+
+COMMENT ON COLUMN activaciones.recordatorio_enviado_at IS 'Cuándo se avisó al cliente que su plan está por vencer (NULL = sin aviso)';
+COMMENT ON COLUMN activaciones.fecha_expiracion_real IS 'Cuándo el barredor confirmó en el router que el plan ya no está vigente';
+
+-- =============================================================================
+-- ÍNDICES
+-- =============================================================================
+-- Al arrancar se cargan las activaciones vigentes
+CREATE INDEX IF NOT EXISTS idx_activaciones_activas_fin
+    ON activaciones(fecha_fin)
+    WHERE estado = 'activa';
+
+-- Una sola activación vigente por usuario: una renovación cancela la anterior.
+-- Antes de crear el índice se cancelan los duplicados viejos (queda la más nueva)
+UPDATE activaciones a
+SET estado = 'cancelada',
+    motivo_cancelacion = 'renovada',
+    updated_at = CURRENT_TIMESTAMP
+WHERE a.estado = 'activa'
+  AND EXISTS (
+      SELECT 1 FROM activaciones b
+      WHERE b.usuario_hotspot = a.usuario_hotspot
+        AND b.estado = 'activa'
+        AND b.id > a.id
+  );
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_activaciones_usuario_activa
+    ON activaciones(usuario_hotspot)
+    WHERE estado = 'activa';
+
+-- =============================================================================
+-- FUNCIÓN: registrar_activaciones
+-- =============================================================================
+-- Registra los planes recién activados por el outbox en una transacción:
+-- cancela la activación vigente de cada usuario (renovación) e inserta la
+-- nueva. Si el lote trae dos ventas del mismo usuario queda la última (es el
+-- plan que quedó en el router). Si otro proceso registró al mismo usuario en
+-- paralelo, su fila vigente se actualiza en lugar de duplicarla.
+-- p_activaciones: [{"venta_id": 1, "usuario_hotspot": "juan",
+--                   "fecha_inicio": "2026-...", "fecha_fin": "2026-..."}, ...]
+CREATE OR REPLACE FUNCTION registrar_activaciones(p_activaciones JSONB)
+RETURNS SETOF activaciones AS $$
+BEGIN
+    UPDATE activaciones
+    SET estado = 'cancelada',
+        motivo_cancelacion = 'renovada',
+        updated_at = CURRENT_TIMESTAMP
+    WHERE estado = 'activa'
+      AND usuario_hotspot IN (
+          SELECT d->>'usuario_hotspot' FROM jsonb_array_elements(p_activaciones) AS d
+      );
+
+    RETURN QUERY
+    INSERT INTO activaciones AS a (venta_id, usuario_hotspot, fecha_inicio, fecha_fin, estado)
+    SELECT DISTINCT ON (d.usuario_hotspot)
+        d.venta_id, d.usuario_hotspot, d.fecha_inicio, d.fecha_fin, 'activa'
+    FROM ROWS FROM (
+        jsonb_to_recordset(p_activaciones) AS (
+            venta_id BIGINT, usuario_hotspot TEXT, fecha_inicio TIMESTAMPTZ, fecha_fin TIMESTAMPTZ
+        )
+    ) WITH ORDINALITY AS d(venta_id, usuario_hotspot, fecha_inicio, fecha_fin, orden)
+    ORDER BY d.usuario_hotspot, d.orden DESC
+    ON CONFLICT (usuario_hotspot) WHERE estado = 'activa' DO UPDATE
+    SET venta_id = EXCLUDED.venta_id,
+        fecha_inicio = EXCLUDED.fecha_inicio,
+        fecha_fin = EXCLUDED.fecha_fin,
+        recordatorio_enviado_at = NULL,
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING a.*;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = pg_catalog, public;
+
+COMMENT ON FUNCTION registrar_activaciones IS 'Cancela la activación vigente de cada usuario y registra la nueva (una transacción, una fila activa por usuario)';
@@ -0,0 +1,22 @@
+-- 015_campamentos_router_opcional.sql
+-- Router propio por campamento, opcional (ver app/services/mikrotik_routers.py)
+-- El router principal es siempre MIKROTIK_HOST/MIKROTIK_PORT. Un campamento
+-- solo lleva router_ip si tiene un MikroTik propio (y MIKROTIK_MULTI_ROUTER=true);
+-- sin router_ip sus clientes van al principal
+
+-- =============================================================================
+-- COLUMNAS
+-- =============================================================================
+ALTER TABLE campamentos
+    ALTER COLUMN router_ip DROP NOT NULL;
+
+COMMENT ON COLUMN campamentos.router_ip IS 'IP del MikroTik propio del campamento (NULL = router principal, MIKROTIK_HOST)';
+
+-- =============================================================================
+-- DATOS
+-- =============================================================================
+-- La fila sembrada en 001 traía una IP de ejemplo que no es un router real
+UPDATE campamentos
+SET router_ip = NULL
+WHERE nombre = 'Principal'
+  AND router_ip = '192.168.1.1';
@@ -0,0 +1,43 @@
+-- 016_ventas_avance_lote.sql
+-- Avance de las ventas de un lote del outbox en una sola llamada
+-- (ver app/services/activaciones.py): antes cada venta era un UPDATE
+
+-- =============================================================================
+-- FUNCIÓN: registrar_avance_ventas
+-- =============================================================================
+-- p_ventas: [{"id": 1, "aprobacion_estado": "completado", "aprobacion_intentos": 1,
+--             "aprobacion_error": null, "activo": true, "usuario_hotspot": "pepa3",
+--             "fecha_inicio_activacion": "2026-...", "fecha_fin_activacion": "2026-..."}, ...]
+-- aprobacion_intentos y aprobacion_error se escriben siempre; el resto,
+-- solo si viene (NULL = sin cambio)
+CREATE OR REPLACE FUNCTION registrar_avance_ventas(p_ventas JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_filas INTEGER;
+BEGIN
+    UPDATE ventas v
+    SET aprobacion_estado = COALESCE(r.aprobacion_estado, v.aprobacion_estado),
+        aprobacion_actualizada = CASE
+            WHEN r.aprobacion_estado IS NOT NULL THEN CURRENT_TIMESTAMP
+            ELSE v.aprobacion_actualizada
+        END,
+        aprobacion_intentos = r.aprobacion_intentos,
+        aprobacion_error = r.aprobacion_error,
+        activo = COALESCE(r.activo, v.activo),
+        usuario_hotspot = COALESCE(r.usuario_hotspot, v.usuario_hotspot),
+        fecha_inicio_activacion = COALESCE(r.fecha_inicio_activacion, v.fecha_inicio_activacion),
+        fecha_fin_activacion = COALESCE(r.fecha_fin_activacion, v.fecha_fin_activacion)
+    FROM jsonb_to_recordset(p_ventas) AS r(
+        id BIGINT, aprobacion_estado TEXT, aprobacion_intentos INT, aprobacion_error TEXT,
+        activo BOOLEAN, usuario_hotspot TEXT,
+        fecha_inicio_activacion TIMESTAMPTZ, fecha_fin_activacion TIMESTAMPTZ
+    )
+    WHERE v.id = r.id;
+
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = pg_catalog, public;
+
+COMMENT ON FUNCTION registrar_avance_ventas IS 'Actualiza el avance de aprobación/activación de un lote de ventas';
@@ -0,0 +1,33 @@
+"""
+Configuración de pytest para las pruebas unitarias de tests/.
+
+Las pruebas usan fakes (sin Twilio, Telegram, Supabase ni MikroTik reales);
+solo hace falta que Settings encuentre las variables obligatorias.
+
+Los scripts manuales de esta carpeta (llaman al servidor local o a la API
+de Telegram al importarse) se ejecutan a mano y no los recoge pytest.
+"""
+
+import os
+
+for variable, valor in {
+    "TWILIO_ACCOUNT_SID": "AC_test",
+    "TWILIO_AUTH_TOKEN": "test",
+    "TWILIO_FROM_NUMBER": "whatsapp:+10000000000",
+    "TELEGRAM_BOT_TOKEN": "1:test",
+    "TELEGRAM_ADMIN_ID": "1",
+    "SUPABASE_URL": "https://test.supabase.co",
+    "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.test",
+    "OPENAI_API_KEY": "sk-test",
+    "MIKROTIK_HOST": "127.0.0.1",
+    "MIKROTIK_PASS": "test",
+}.items():
+    os.environ.setdefault(variable, valor)
+
+collect_ignore = [
+    "debug_telegram.py",
+    "test_telegram_button.py",
+    "test_telegram_debug.py",
+    "test_webhook.py",
+    "verificar_sistema.py",
+]
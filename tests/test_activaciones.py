@@ -0,0 +1,96 @@
+"""Pruebas del outbox de activaciones (app/services/activaciones.py)"""
+
+import asyncio
+from datetime import datetime, timezone
+
+from app.services import activaciones
+from app.services.activaciones import OutboxActivaciones, PENDIENTE, COMPLETADA, FALLIDA
+from app.services.aprobaciones import COMPLETADO, ERROR
+
+AHORA = datetime(2026, 1, 1, tzinfo=timezone.utc)
+OK = {"exito": True, "mensaje": "ok", "router_caido": False}
+FALLA = {"exito": False, "mensaje": "perfil inexistente", "router_caido": False}
+CAIDO = {"exito": False, "mensaje": "router caído", "router_caido": True}
+
+
+def outbox():
+    return OutboxActivaciones(lote_max=10, intervalo_secs=1, reintentos_max=3, backoff_secs=10, backoff_max_secs=60)
+
+
+def fila(id, intentos=0, campamento_id=None):
+    return {"id": id, "venta_id": 100 + id, "usuario": f"user{id}", "plan": "1Dia", "dias": 1,
+            "intentos": intentos, "campamento_id": campamento_id}
+
+
+def test_exito_completa_la_activacion():
+    registro = outbox()._registro(fila(1), OK, AHORA)
+    assert registro["estado"] == COMPLETADA
+    assert registro["intentos"] == 1
+    assert registro["proximo_intento"] is None
+
+
+def test_falla_reintenta_con_backoff_acotado():
+    o = outbox()
+    espera = lambda r: (datetime.fromisoformat(r["proximo_intento"]) - AHORA).total_seconds()
+
+    primero = o._registro(fila(1, intentos=0), FALLA, AHORA)
+    assert primero["estado"] == PENDIENTE
+    assert 8 <= espera(primero) <= 12
+
+    # Router caído: nunca se da por fallida, y la espera no pasa del máximo
+    caido = o._registro(fila(1, intentos=9), CAIDO, AHORA)
+    assert caido["estado"] == PENDIENTE
+    assert espera(caido) <= 60 * 1.2
+
+
+def test_agotar_reintentos_marca_fallida():
+    registro = outbox()._registro(fila(1, intentos=2), FALLA, AHORA)
+    assert registro["estado"] == FALLIDA
+    assert registro["ultimo_error"] == "perfil inexistente"
+
+
+def test_lote_registra_el_avance_de_todas_las_ventas_en_una_llamada(monkeypatch):
+    filas = [fila(1, campamento_id=1), fila(2, campamento_id=1), fila(3, intentos=2, campamento_id=2)]
+    llamadas = {"avance": [], "resultados": [], "routers": []}
+
+    async def tomar(limite, plazo):
+        return filas
+
+    def reemplazar(pares, campamento_id):
+        llamadas["routers"].append(campamento_id)
+        return [OK] * len(pares) if campamento_id == 1 else [FALLA] * len(pares)
+
+    async def registrar_resultados(registros):
+        llamadas["resultados"].append(registros)
+
+    async def obtener_ventas(ids):
+        return [{"id": i, "whatsapp_id": f"+51{i}"} for i in ids]
+
+    async def registrar_activaciones(nuevas):
+        return []
+
+    async def registrar_avance(ventas):
+        llamadas["avance"].append(ventas)
+
+    async def no_hacer_nada(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(activaciones, "tomar_activaciones_async", tomar)
+    monkeypatch.setattr(activaciones, "reemplazar_planes_lote", reemplazar)
+    monkeypatch.setattr(activaciones, "registrar_resultados_activaciones_async", registrar_resultados)
+    monkeypatch.setattr(activaciones, "obtener_ventas_async", obtener_ventas)
+    monkeypatch.setattr(activaciones, "registrar_activaciones_async", registrar_activaciones)
+    monkeypatch.setattr(activaciones, "registrar_avance_ventas_async", registrar_avance)
+    monkeypatch.setattr(activaciones, "responder_whatsapp", no_hacer_nada)
+    monkeypatch.setattr(activaciones, "editar_mensaje_telegram_async", no_hacer_nada)
+
+    registros = asyncio.run(outbox().procesar_lote())
+
+    assert sorted(llamadas["routers"]) == [1, 2]
+    assert [r["estado"] for r in registros] == [COMPLETADA, COMPLETADA, FALLIDA]
+    assert len(llamadas["resultados"]) == 1
+    assert len(llamadas["avance"]) == 1
+    avance = {v["id"]: v for v in llamadas["avance"][0]}
+    assert avance[101]["aprobacion_estado"] == COMPLETADO
+    assert avance[101]["usuario_hotspot"] == "user1"
+    assert avance[103]["aprobacion_estado"] == ERROR
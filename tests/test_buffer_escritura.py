@@ -0,0 +1,116 @@
+"""Pruebas del buffer de escritura diferida (app/services/buffer_escritura.py)"""
+
+import asyncio
+import json
+
+import httpx
+from postgrest.exceptions import APIError
+
+from app.services.buffer_escritura import BufferEscritura
+
+
+class BufferFalso(BufferEscritura):
+    """Inserta en una lista; rechaza las filas con "invalida" y puede simular caídas"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.insertadas = []
+        self.caido = False
+        self.intentos = 0
+
+    async def _insertar(self, filas):
+        self.intentos += 1
+        if self.caido:
+            raise httpx.ConnectError("sin red")
+        if any(f.get("invalida") for f in filas):
+            raise APIError({"message": "invalid input syntax", "code": "22P02"})
+        self.insertadas.extend(filas)
+
+
+def leer(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f]
+
+
+def test_fila_invalida_no_bloquea_las_demas(tmp_path):
+    async def escenario():
+        buffer = BufferFalso("t", max_filas=4, intervalo_ms=60000, archivo=str(tmp_path / "pendientes_t.jsonl"), max_intentos=2)
+        buffer.iniciar()
+        for i in range(6):
+            buffer.agregar({"n": i, "invalida": i == 1})
+        await buffer.vaciar()   # 1er rechazo
+        await buffer.vaciar()   # 2do rechazo
+        assert buffer.insertadas == []
+        await buffer.vaciar()   # se aísla la fila inválida
+        await buffer.detener()
+        return buffer
+
+    buffer = asyncio.run(escenario())
+
+    assert [f["n"] for f in buffer.insertadas] == [0, 2, 3, 4, 5]
+    assert [f["n"] for f in leer(tmp_path / "descartadas_t.jsonl")] == [1]
+    assert leer(tmp_path / "pendientes_t.jsonl") == []
+    assert buffer.estadisticas()["invalidas"] == 1
+
+
+def test_sin_red_no_se_descarta_nada_y_se_reintenta(tmp_path):
+    async def escenario():
+        buffer = BufferFalso("t", max_filas=2, intervalo_ms=60000, archivo=str(tmp_path / "pendientes_t.jsonl"), max_intentos=1)
+        buffer.iniciar()
+        buffer.caido = True
+        for i in range(3):
+            buffer.agregar({"n": i})
+        await buffer._respaldar_nuevas()
+        for _ in range(3):
+            await buffer.vaciar()
+        assert buffer.pendientes("n", 0)
+        buffer.caido = False
+        await buffer.vaciar()
+        await buffer.detener()
+        return buffer
+
+    buffer = asyncio.run(escenario())
+
+    assert [f["n"] for f in buffer.insertadas] == [0, 1, 2]
+    assert not (tmp_path / "descartadas_t.jsonl").exists()
+
+
+def test_tope_de_pendientes_descarta_las_mas_viejas(tmp_path):
+    async def escenario():
+        buffer = BufferFalso("t", max_filas=2, intervalo_ms=60000, max_pendientes=3)
+        buffer.iniciar()
+        for i in range(5):
+            buffer.agregar({"n": i})
+        estadisticas = buffer.estadisticas()
+        await buffer.detener()
+        return buffer, estadisticas
+
+    buffer, estadisticas = asyncio.run(escenario())
+
+    assert estadisticas["pendientes"] == 3
+    assert estadisticas["descartadas"] == 2
+    assert [f["n"] for f in buffer.insertadas] == [2, 3, 4]
+
+
+def test_respaldo_se_recupera_al_arrancar(tmp_path):
+    archivo = str(tmp_path / "pendientes_t.jsonl")
+
+    async def caida():
+        buffer = BufferFalso("t", max_filas=10, intervalo_ms=60000, archivo=archivo)
+        buffer.iniciar()
+        buffer.agregar({"n": 1})
+        buffer.agregar({"n": 2})
+        await buffer._respaldar_nuevas()
+        buffer._tarea.cancel()  # el proceso muere sin vaciar
+
+    async def arranque():
+        buffer = BufferFalso("t", max_filas=10, intervalo_ms=60000, archivo=archivo)
+        buffer.iniciar()
+        await buffer.detener()
+        return buffer
+
+    asyncio.run(caida())
+    buffer = asyncio.run(arranque())
+
+    assert [f["n"] for f in buffer.insertadas] == [1, 2]
+    assert leer(archivo) == []
@@ -0,0 +1,82 @@
+"""Pruebas de la cola de trabajos por carriles (app/services/cola.py)"""
+
+import asyncio
+
+from app.services.cola import ColaTrabajos
+
+
+def test_mensajes_de_un_cliente_salen_en_orden_y_clientes_distintos_en_paralelo():
+    async def escenario():
+        procesados = []
+        en_curso = set()
+        simultaneos = []
+
+        async def procesar(trabajo):
+            en_curso.add(trabajo["cliente"])
+            simultaneos.append(len(en_curso))
+            await asyncio.sleep(0.01)
+            procesados.append((trabajo["cliente"], trabajo["n"]))
+            en_curso.discard(trabajo["cliente"])
+
+        cola = ColaTrabajos("prueba", procesar, workers=8, maxsize=100, clave=lambda t: t["cliente"])
+        cola.iniciar()
+        for n in range(5):
+            for cliente in ("a", "b", "c"):
+                assert cola.encolar({"cliente": cliente, "n": n})
+        await cola.detener()
+        return procesados, simultaneos
+
+    procesados, simultaneos = asyncio.run(escenario())
+
+    for cliente in ("a", "b", "c"):
+        assert [n for c, n in procesados if c == cliente] == list(range(5))
+    assert max(simultaneos) > 1
+
+
+def test_carril_lleno_rechaza_sin_esperar():
+    async def escenario():
+        liberar = asyncio.Event()
+
+        async def procesar(trabajo):
+            await liberar.wait()
+
+        cola = ColaTrabajos("prueba", procesar, workers=1, maxsize=2, clave=lambda t: t["cliente"])
+        cola.iniciar()
+        resultados = [cola.encolar({"cliente": "a"}) for _ in range(5)]
+        await asyncio.sleep(0)
+        liberar.set()
+        await cola.detener()
+        return resultados, cola.estadisticas()
+
+    resultados, estadisticas = asyncio.run(escenario())
+
+    assert resultados[:2] == [True, True]
+    assert not all(resultados)
+    assert estadisticas["rechazados"] == resultados.count(False)
+
+
+def test_error_de_un_trabajo_no_detiene_el_carril():
+    async def escenario():
+        hechos = []
+
+        async def procesar(trabajo):
+            if trabajo["n"] == 0:
+                raise ValueError("falla")
+            hechos.append(trabajo["n"])
+
+        cola = ColaTrabajos("prueba", procesar, workers=1, clave=lambda t: "a")
+        cola.iniciar()
+        cola.encolar({"n": 0})
+        cola.encolar({"n": 1})
+        await cola.detener()
+        return hechos, cola.estadisticas()
+
+    hechos, estadisticas = asyncio.run(escenario())
+
+    assert hechos == [1]
+    assert estadisticas["errores"] == 1
+
+
+def test_cola_inactiva_no_acepta_trabajos():
+    cola = ColaTrabajos("prueba", lambda t: None)
+    assert not cola.encolar({"n": 1})
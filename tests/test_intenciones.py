@@ -0,0 +1,64 @@
+"""Pruebas del pre-router de intenciones (app/services/intenciones.py)"""
+
+import pytest
+
+from app.services.conversacion import ELIGIENDO_DIAS, PIDIENDO_USUARIO, REGISTRANDO
+from app.services.intenciones import detectar_intencion
+
+ELIGIENDO = {"estado": ELIGIENDO_DIAS, "ultimo_usuario": "pepa3"}
+
+
+@pytest.mark.parametrize("mensaje, dias", [
+    ("5 días", 5),
+    ("quiero 3", 3),
+    ("Una semana por favor", 7),
+    ("dame dos dias", 2),
+])
+def test_pedido_de_dias_mientras_elige(mensaje, dias):
+    resultado = detectar_intencion(mensaje, ELIGIENDO)
+
+    assert resultado["accion"] == "registrar_pedido"
+    assert resultado["datos"] == {"usuario": "pepa3", "dias": dias}
+
+
+@pytest.mark.parametrize("mensaje, contexto", [
+    ("5 días", {"ultimo_usuario": "pepa3"}),          # el bot no preguntó los días
+    ("hace 3 días no me conecta", ELIGIENDO),          # no es el mensaje completo
+    ("90 dias", ELIGIENDO),                            # fuera de rango
+])
+def test_numeros_que_no_son_pedidos(mensaje, contexto):
+    assert detectar_intencion(mensaje, contexto) is None
+
+
+@pytest.mark.parametrize("mensaje, usuario", [
+    ("mi usuario es pepa3", "pepa3"),
+    ("Mi usuario es Pepa3", "Pepa3"),
+    ("usuario: José.R", "José.R"),
+    ("USER: Ricky_3 🙂", "Ricky_3"),
+    ("mi usuario es pepa3.", "pepa3"),
+])
+def test_usuario_conserva_mayusculas_y_tildes(mensaje, usuario):
+    resultado = detectar_intencion(mensaje, None)
+
+    assert resultado["accion"] == "buscar_usuario_existente"
+    assert resultado["datos"] == {"usuario": usuario}
+
+
+@pytest.mark.parametrize("mensaje", [
+    "mi usuario es nuevo",
+    "Mi usuario es Bloqueado",
+    "mi usuario es pepa3 y no me conecta",
+    "tengo problemas con mi usuario",
+])
+def test_frases_que_no_son_un_usuario(mensaje):
+    assert detectar_intencion(mensaje, None) is None
+
+
+def test_cliente_nuevo_y_existente():
+    assert detectar_intencion("Soy nuevo", None)["estado"] == REGISTRANDO
+    assert detectar_intencion("ya soy cliente", None)["estado"] == PIDIENDO_USUARIO
+
+
+def test_texto_libre_va_a_chatgpt():
+    assert detectar_intencion("cuánto cuesta el plan de un mes?", None) is None
+    assert detectar_intencion("", None) is None
@@ -0,0 +1,79 @@
+"""Pruebas del índice de Userman (app/services/mikrotik_indice.py)"""
+
+from app.services.mikrotik_indice import COLUMNAS_USUARIO, RECURSO_USUARIOS, IndiceUserman
+from app.services.mikrotik_pool import RouterOsApiCommunicationError
+
+
+class RecursoFalso:
+    """Recurso de routeros_api: filas ya decodificadas ('.id' llega como 'id')"""
+
+    def __init__(self, filas, acepta_filtros=True):
+        self.filas = filas
+        self.acepta_filtros = acepta_filtros
+        self.llamadas = []
+
+    def call(self, comando, argumentos, filtros):
+        self.llamadas.append(("call", argumentos, filtros))
+        if not self.acepta_filtros:
+            raise RouterOsApiCommunicationError("unknown parameter", b"unknown parameter")
+        return [f for f in self.filas if all(f.get(k) == v for k, v in filtros.items())]
+
+    def get(self):
+        self.llamadas.append(("get",))
+        return [dict(f) for f in self.filas]
+
+
+class ApiFalsa:
+    def __init__(self, recurso):
+        self.recurso = recurso
+
+    def get_resource(self, ruta):
+        return self.recurso
+
+
+FILAS = [
+    {"id": "*1", "username": "pepa3", "customer": "admin", "disabled": "false", "password": "x"},
+    {"id": "*2", "username": "ricky3", "customer": "admin", "disabled": "true", "password": "y"},
+]
+
+
+def test_recorrido_completo_conserva_el_id():
+    recurso = RecursoFalso(FILAS, acepta_filtros=False)
+    indice = IndiceUserman()
+
+    filas = indice.consultar(ApiFalsa(recurso), RECURSO_USUARIOS, {"username": "ricky3"}, COLUMNAS_USUARIO)
+
+    assert filas == [{"id": "*2", "username": "ricky3", "customer": "admin", "disabled": "true"}]
+    assert not indice.filtros_soportados(RECURSO_USUARIOS)
+
+
+def test_rechazo_del_filtro_se_recuerda():
+    recurso = RecursoFalso(FILAS, acepta_filtros=False)
+    indice = IndiceUserman()
+    api = ApiFalsa(recurso)
+
+    indice.consultar(api, RECURSO_USUARIOS, {"username": "pepa3"}, COLUMNAS_USUARIO)
+    indice.consultar(api, RECURSO_USUARIOS, {"username": "ricky3"}, COLUMNAS_USUARIO)
+
+    assert [ll[0] for ll in recurso.llamadas] == ["call", "get", "get"]
+
+
+def test_indice_con_el_recorrido_completo_trae_el_id():
+    indice = IndiceUserman()
+    api = ApiFalsa(RecursoFalso(FILAS, acepta_filtros=False))
+
+    assert indice.buscar(api, "pepa3")["id"] == "*1"
+    assert indice.buscar(api, "ricky3")["id"] == "*2"
+
+
+def test_usuario_invalidado_se_relee_solo():
+    recurso = RecursoFalso(FILAS)
+    indice = IndiceUserman()
+    api = ApiFalsa(recurso)
+    indice.buscar(api, "pepa3")
+
+    recurso.filas = [dict(FILAS[0], disabled="true"), FILAS[1]]
+    indice.invalidar("pepa3")
+    assert indice.buscar(api, "pepa3")["disabled"] == "true"
+    assert recurso.llamadas[-1][2] == {"username": "pepa3"}
+    assert indice.buscar(api, "ricky3")["disabled"] == "true"
@@ -0,0 +1,124 @@
+"""Pruebas del pool de sesiones y el circuit breaker (app/services/mikrotik_pool.py)"""
+
+import pytest
+
+from app.services.mikrotik_pool import ABIERTO, CERRADO, SEMIABIERTO, CircuitoRouter, PoolMikrotik, _Conexion
+from app.services.mikrotik_pool import RouterOsApiCommunicationError
+
+
+class ConexionFalsa:
+    def __init__(self):
+        self.cerrada = False
+
+    def disconnect(self):
+        self.cerrada = True
+
+
+class ApiFalsa:
+    """Responde el keepalive (/system/identity)"""
+
+    def get_resource(self, ruta):
+        return self
+
+    def get(self):
+        return [{"name": "MikroTik"}]
+
+
+class PoolFalso(PoolMikrotik):
+    """Pool sin routeros_api: cada conexión nueva es un objeto falso"""
+
+    def __init__(self, max_conexiones=2, router_caido=False):
+        super().__init__("10.0.0.1", 8728, "api", "x", max_conexiones=max_conexiones, keepalive_secs=0, timeout_secs=0.05)
+        self.router_caido = router_caido
+        self.conexiones = 0
+
+    def _conectar(self):
+        if self.router_caido:
+            self.circuito.registrar_fallo()
+            return None
+        self.conexiones += 1
+        self.circuito.registrar_exito()
+        return _Conexion(ConexionFalsa(), ApiFalsa())
+
+
+def abrir(circuito):
+    for _ in range(circuito.fallos_max):
+        circuito.registrar_fallo()
+
+
+def test_circuito_abre_tras_fallos_seguidos_y_deja_una_sola_prueba():
+    circuito = CircuitoRouter("r", fallos_max=2, espera_secs=60)
+    circuito.registrar_fallo()
+    assert circuito.estado == CERRADO
+
+    circuito.registrar_fallo()
+    assert circuito.estado == ABIERTO
+    assert not circuito.permitir()
+
+    circuito._proximo_sondeo = 0  # venció la espera
+    assert circuito.permitir()
+    assert circuito.estado == SEMIABIERTO
+    assert not circuito.permitir()  # solo una prueba a la vez
+
+    circuito.registrar_exito()
+    assert circuito.estado == CERRADO
+    assert circuito.permitir()
+
+
+def test_prueba_fallida_duplica_la_espera():
+    circuito = CircuitoRouter("r", fallos_max=1, espera_secs=10, espera_max_secs=15)
+    abrir(circuito)
+    circuito._proximo_sondeo = 0
+    circuito.permitir()
+    circuito.registrar_fallo()
+
+    assert circuito.estado == ABIERTO
+    assert circuito._espera_actual == 15
+
+
+def test_sesiones_se_reutilizan():
+    pool = PoolFalso()
+    with pool.sesion() as api:
+        assert api is not None
+    with pool.sesion() as api:
+        assert api is not None
+
+    assert pool.conexiones == 1
+
+
+def test_trap_del_router_no_rompe_la_sesion():
+    pool = PoolFalso()
+    with pytest.raises(RouterOsApiCommunicationError):
+        with pool.sesion():
+            raise RouterOsApiCommunicationError("no such item", b"no such item")
+
+    assert len(pool._libres) == 1
+    assert pool.circuito.estado == CERRADO
+
+
+def test_router_caido_falla_al_instante():
+    pool = PoolFalso(router_caido=True)
+    for _ in range(pool.circuito.fallos_max):
+        with pool.sesion() as api:
+            assert api is None
+
+    assert pool.circuito.estado == ABIERTO
+    assert pool.adquirir() is None
+    assert pool._en_uso == 0
+
+
+def test_pool_agotado_libera_la_prueba_del_circuito():
+    pool = PoolFalso(max_conexiones=1)
+    ocupada = pool.adquirir()
+    abrir(pool.circuito)
+    pool.circuito._proximo_sondeo = 0
+
+    assert pool.adquirir(espera_secs=0.01) is None
+
+    # La prueba no llegó al router: otro puede probar ya, sin esperar espera_max_secs
+    assert pool.circuito.estado == ABIERTO
+    assert pool.circuito.disponible
+    pool.liberar(ocupada)
+    with pool.sesion() as api:
+        assert api is not None
+    assert pool.circuito.estado == CERRADO
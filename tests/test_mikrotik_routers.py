@@ -0,0 +1,78 @@
+"""Pruebas del catálogo de routers (app/services/mikrotik_routers.py)"""
+
+import pytest
+
+from app.core.config import settings
+from app.services import mikrotik_routers
+from app.services.mikrotik_routers import CatalogoRouters, RouterMikrotik, ZonaSinRouter, resolver_router
+
+
+class CatalogoFalso(CatalogoRouters):
+    def __init__(self, campamentos, multi_router=True):
+        super().__init__(ttl_secs=600, multi_router=multi_router)
+        self.filas = campamentos
+        self.lecturas = 0
+
+    def _leer_campamentos(self):
+        self.lecturas += 1
+        return list(self.filas)
+
+
+@pytest.fixture
+def catalogo(monkeypatch):
+    def usar(campamentos, multi_router=True):
+        catalogo = CatalogoFalso(campamentos, multi_router)
+        monkeypatch.setattr(mikrotik_routers, "catalogo_routers", catalogo)
+        return catalogo
+    return usar
+
+
+def principal():
+    return f"{settings.MIKROTIK_HOST}:{settings.MIKROTIK_PORT}"
+
+
+def test_sin_multi_router_no_lee_campamentos_y_toda_zona_va_al_principal(catalogo):
+    cat = catalogo([RouterMikrotik(1, "Cocha", "10.0.0.2", 8728)], multi_router=False)
+
+    assert [r.clave for r in cat.routers()] == [principal()]
+    assert cat.por_zona("Cocha").clave == principal()
+    assert cat.por_zona(1).clave == principal()
+    assert cat.lecturas == 0
+
+
+def test_el_principal_es_siempre_mikrotik_host(catalogo):
+    cat = catalogo([
+        RouterMikrotik(1, "Principal", settings.MIKROTIK_HOST, settings.MIKROTIK_PORT),
+        RouterMikrotik(2, "Campamento Cocha", "10.0.0.2", 8728),
+    ])
+
+    assert [r.clave for r in cat.routers()] == [principal(), "10.0.0.2:8728"]
+    assert cat.principal().clave == principal()
+    # El campamento que apunta al principal comparte su pool
+    assert cat.por_zona(1).clave == principal()
+    assert cat.por_zona("cocha").clave == "10.0.0.2:8728"
+
+
+def test_zona_explicita_sin_router_no_cae_en_otro_router(catalogo):
+    catalogo([RouterMikrotik(2, "Cocha", "10.0.0.2", 8728)])
+
+    with pytest.raises(ZonaSinRouter):
+        resolver_router("Pampa")
+    with pytest.raises(ZonaSinRouter):
+        resolver_router(99, "pepa3")
+
+
+def test_sin_zona_usa_el_router_recordado_o_busca_en_todos(catalogo):
+    cat = catalogo([RouterMikrotik(2, "Cocha", "10.0.0.2", 8728)])
+
+    assert resolver_router().clave == principal()
+    assert resolver_router(None, "pepa3") is None
+
+    cat.recordar("pepa3", cat.por_zona("Cocha"))
+    assert resolver_router(None, "pepa3").clave == "10.0.0.2:8728"
+
+
+def test_un_solo_router_resuelve_sin_buscar(catalogo):
+    catalogo([], multi_router=False)
+
+    assert resolver_router(None, "pepa3").clave == principal()
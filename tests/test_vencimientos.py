@@ -0,0 +1,96 @@
+"""Pruebas del barredor de vencimientos (app/services/vencimientos.py)"""
+
+import asyncio
+from datetime import datetime, timezone
+
+from app.services import vencimientos
+from app.services.vencimientos import BarredorVencimientos
+
+AHORA = 1_000_000.0
+
+
+def fila(id, usuario, fin, recordada=False):
+    return {
+        "id": id,
+        "venta_id": 100 + id,
+        "usuario_hotspot": usuario,
+        "fecha_fin": datetime.fromtimestamp(fin, timezone.utc).isoformat(),
+        "recordatorio_enviado_at": "2026-01-01T00:00:00+00:00" if recordada else None,
+    }
+
+
+class Fakes:
+    """Supabase, router y cola de envíos falsos"""
+
+    def __init__(self, monkeypatch, vigentes=None):
+        self.enviados = []
+        self.expiradas = []
+        self.vigentes = vigentes if vigentes is not None else {}
+
+        async def marcar_recordatorios(ids):
+            return ids
+
+        async def marcar_expiradas(ids):
+            self.expiradas.extend(ids)
+            return [{"id": i} for i in ids]
+
+        async def responder_lote(mensajes):
+            self.enviados.extend(mensajes)
+
+        monkeypatch.setattr(vencimientos, "marcar_recordatorios_async", marcar_recordatorios)
+        monkeypatch.setattr(vencimientos, "marcar_activaciones_expiradas_async", marcar_expiradas)
+        monkeypatch.setattr(vencimientos, "responder_whatsapp_lote", responder_lote)
+        monkeypatch.setattr(vencimientos, "perfiles_vigentes", lambda zona: self.vigentes.get(zona))
+
+
+def test_solo_sale_lo_que_ya_vencio(monkeypatch):
+    fakes = Fakes(monkeypatch, vigentes={None: {}})
+    barredor = BarredorVencimientos(aviso_secs=3600, rechequeo_secs=600)
+    barredor.agregar(fila(1, "pepa3", AHORA - 10), "+51911")
+    barredor.agregar(fila(2, "ricky3", AHORA + 1800), "+51922")
+    barredor.agregar(fila(3, "lolo", AHORA + 7200), "+51933")
+
+    resumen = asyncio.run(barredor.barrer(AHORA))
+
+    assert resumen == {"recordatorios": 1, "expiradas": 1, "rechequeos": 0}
+    assert [n for n, _ in fakes.enviados] == ["+51922", "+51911"]
+    assert fakes.expiradas == [1]
+    assert set(barredor._activas) == {2, 3}
+
+
+def test_plan_aun_vigente_en_el_router_se_revisa_mas_tarde(monkeypatch):
+    fakes = Fakes(monkeypatch, vigentes={None: {"pepa3": ["1Dia"]}})
+    barredor = BarredorVencimientos(aviso_secs=60, rechequeo_secs=600)
+    barredor.agregar(fila(1, "pepa3", AHORA - 10, recordada=True), "+51911")
+
+    assert asyncio.run(barredor.barrer(AHORA))["rechequeos"] == 1
+    assert asyncio.run(barredor.barrer(AHORA + 300))["expiradas"] == 0
+
+    fakes.vigentes[None] = {}
+    assert asyncio.run(barredor.barrer(AHORA + 601))["expiradas"] == 1
+    assert fakes.expiradas == [1]
+
+
+def test_router_sin_responder_no_vence_nada(monkeypatch):
+    fakes = Fakes(monkeypatch, vigentes={})  # perfiles_vigentes -> None
+    barredor = BarredorVencimientos(aviso_secs=60, rechequeo_secs=600)
+    barredor.agregar(fila(1, "pepa3", AHORA - 10, recordada=True), "+51911")
+
+    resumen = asyncio.run(barredor.barrer(AHORA))
+
+    assert resumen["expiradas"] == 0
+    assert fakes.expiradas == []
+    assert 1 in barredor._activas
+
+
+def test_renovacion_reemplaza_la_activacion_anterior(monkeypatch):
+    fakes = Fakes(monkeypatch, vigentes={None: {}})
+    barredor = BarredorVencimientos(aviso_secs=60, rechequeo_secs=600)
+    barredor.agregar(fila(1, "pepa3", AHORA - 10, recordada=True), "+51911")
+    barredor.agregar(fila(2, "pepa3", AHORA + 86400, recordada=True), "+51911")
+
+    resumen = asyncio.run(barredor.barrer(AHORA))
+
+    assert resumen["expiradas"] == 0
+    assert fakes.expiradas == []
+    assert set(barredor._activas) == {2}